@@ -1,4 +1,130 @@
+from itertools import repeat
+from typing import Dict, List, Tuple
+
 import geopandas as gpd
+from h3.api import basic_int as h3_int
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+from e84_proj.analayze.blocks import block_windows
+from e84_proj.extract.utils import cells_to_polygons, transform_coords
+
+H3_BLOCK_SIZE = 1024
+# block results held by CellAccumulator before they are merged
+MERGE_EVERY = 64
+
+
+def pixel_centres(transform, window: Window):
+    """
+    x and y coordinates of every pixel centre in a window, in the raster crs
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: flattened x and y arrays
+    """
+    rows, cols = np.mgrid[
+        window.row_off:window.row_off + window.height,
+        window.col_off:window.col_off + window.width
+    ]
+    cols = cols.ravel() + 0.5
+    rows = rows.ravel() + 0.5
+    xs = transform.a * cols + transform.b * rows + transform.c
+    ys = transform.d * cols + transform.e * rows + transform.f
+    return xs, ys
+
+
+def latlng_to_cells(lats: np.ndarray, lngs: np.ndarray, resolution: int) -> np.ndarray:
+    """
+    h3 cell ids for arrays of points.  h3-py has no array version of
+    `latlng_to_cell`, so this is still one python call per point and the
+    slowest part of binning.  Callers should drop points they don't need first
+
+    Returns:
+        np.ndarray: uint64 cell ids
+    """
+    cells = map(h3_int.latlng_to_cell, lats.tolist(), lngs.tolist(), repeat(resolution, len(lats)))
+    return np.fromiter(cells, dtype=np.uint64, count=len(lats))
+
+
+def reduce_by_cell(cells: np.ndarray, columns: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    sum every column per unique cell
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, np.ndarray]]: sorted unique cells and the
+            per cell totals
+    """
+    uniq, inverse = np.unique(cells, return_inverse=True)
+    totals = {
+        name: np.bincount(inverse, weights=values, minlength=len(uniq))
+        for name, values in columns.items()
+    }
+    return uniq, totals
+
+
+class CellAccumulator:
+    """
+    running per cell totals.  Every column is additive, so each block is reduced
+    to one row per cell on its own and the small per block results are merged
+    every `merge_every` blocks (and once more when read), instead of re-grouping
+    everything seen so far on every block
+    """
+
+    def __init__(self, merge_every: int = MERGE_EVERY):
+        """
+        Args:
+            merge_every (int): pending block results kept before merging
+        """
+        self.merge_every = merge_every
+        self._cells = np.empty(0, dtype=np.uint64)
+        self._columns: Dict[str, np.ndarray] = {}
+        self._pending: List[Tuple[np.ndarray, Dict[str, np.ndarray]]] = []
+
+    def add(self, cells: np.ndarray, columns: Dict[str, np.ndarray]):
+        """
+        fold per pixel values into the running totals
+
+        Args:
+            cells (np.ndarray): cell id per value
+            columns (Dict[str, np.ndarray]): column name -> value per cell id
+        """
+        if len(cells):
+            self._pending.append(reduce_by_cell(cells, columns))
+        if len(self._pending) >= self.merge_every:
+            self.merge()
+
+    def merge(self):
+        """
+        fold pending block results into the totals
+        """
+        if not self._pending:
+            return
+        parts = [(self._cells, self._columns)] + self._pending
+        names = set().union(*(columns for _, columns in parts))
+        cells = np.concatenate([part_cells for part_cells, _ in parts])
+        columns = {
+            name: np.concatenate([part.get(name, np.zeros(len(part_cells))) for part_cells, part in parts])
+            for name in names
+        }
+        self._cells, self._columns = reduce_by_cell(cells, columns)
+        self._pending = []
+
+    @property
+    def cells(self) -> np.ndarray:
+        """
+        sorted unique cell ids
+        """
+        self.merge()
+        return self._cells
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        column name -> total per cell, aligned with `cells`
+        """
+        self.merge()
+        return self._columns
+
 
 class E84Analyzer:
     """
@@ -8,5 +134,87 @@ class E84Analyzer:
     def __init__(self):
         pass
 
-    def h3Binning(self) -> gpd.GeoDataFrame:
-        return
\ No newline at end of file
+    def h3Binning(
+            self,
+            rasters: Dict[str, str],
+            resolution: int,
+            weights: str = None,
+            block_size: int = H3_BLOCK_SIZE,
+            geometry: bool = True
+    ) -> gpd.GeoDataFrame:
+        """
+        aggregate raster pixels into h3 cells.  Each pixel centre is assigned to a
+        cell and values are reduced per cell with bincount, no polygon overlays.
+        Rasters are read block by block so memory stays flat, and cell ids are
+        computed once per block and shared by every input raster
+
+        Args:
+            rasters (Dict[str, str]): name -> path of rasters on the same grid,
+                like {'rain_change': ..., 'cropland': ..., 'population': ...}
+            resolution (int): target h3 resolution
+            weights (str): name of the raster in `rasters` used as weights for a
+                weighted mean of the others, like 'population'
+            block_size (int): block edge length in pixels
+            geometry (bool): build cell polygons for the output
+
+        Returns:
+            gpd.GeoDataFrame: one row per cell with `h3` plus `<name>_sum`,
+                `<name>_count`, `<name>_mean` and, when weighted, `<name>_wmean`
+        """
+        if weights is not None and weights not in rasters:
+            raise ValueError(f'weights raster {weights} is not one of {list(rasters)}')
+        datasets = {name: rio.open(path) for name, path in rasters.items()}
+        try:
+            first = next(iter(datasets.values()))
+            for name, src in datasets.items():
+                if (src.shape, src.transform, src.crs) != (first.shape, first.transform, first.crs):
+                    raise ValueError(f'raster {name} is not on the same grid as the other inputs')
+
+            accumulator = CellAccumulator()
+            for window in block_windows(first.width, first.height, block_size):
+                data = {name: src.read(1, window=window, masked=True).ravel() for name, src in datasets.items()}
+                # drop pixels that are empty in every input before looking up cells
+                keep = np.zeros(window.width * window.height, dtype=bool)
+                for values in data.values():
+                    keep |= ~np.ma.getmaskarray(values)
+                if not keep.any():
+                    continue
+                data = {name: values[keep] for name, values in data.items()}
+
+                xs, ys = pixel_centres(first.transform, window)
+                lngs, lats = transform_coords(xs[keep], ys[keep], first.crs.to_wkt(), 'epsg:4326')
+                cells = latlng_to_cells(lats, lngs, resolution)
+
+                weight = data.get(weights)
+                columns_by_name = {}
+                for name, values in data.items():
+                    valid = ~np.ma.getmaskarray(values)
+                    columns = {
+                        'sum': np.where(valid, values.filled(0), 0).astype('float64'),
+                        'count': valid.astype('float64')
+                    }
+                    if weight is not None and name != weights:
+                        weighted = valid & ~np.ma.getmaskarray(weight)
+                        w = np.where(weighted, weight.filled(0), 0).astype('float64')
+                        columns['wsum'] = w * np.where(weighted, values.filled(0), 0)
+                        columns['wtotal'] = w
+                    columns_by_name.update({f'{name}_{key}': column for key, column in columns.items()})
+                accumulator.add(cells, columns_by_name)
+        finally:
+            for src in datasets.values():
+                src.close()
+
+        accumulator.merge()
+        out = {'h3': accumulator.cells}
+        for name in rasters:
+            total = accumulator.columns.get(f'{name}_sum', np.zeros(len(accumulator.cells)))
+            count = accumulator.columns.get(f'{name}_count', np.zeros(len(accumulator.cells)))
+            out[f'{name}_sum'] = total
+            out[f'{name}_count'] = count.astype('int64')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[f'{name}_mean'] = total / count
+                if f'{name}_wsum' in accumulator.columns:
+                    out[f'{name}_wmean'] = accumulator.columns[f'{name}_wsum'] / accumulator.columns[f'{name}_wtotal']
+
+        geoms = cells_to_polygons(accumulator.cells) if geometry else None
+        return gpd.GeoDataFrame(out, geometry=geoms, crs='epsg:4326' if geometry else None)
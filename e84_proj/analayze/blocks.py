@@ -0,0 +1,84 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+import os
+import threading
+
+import rasterio as rio
+from rasterio.windows import Window
+
+MAX_WORKERS = os.cpu_count() or 4
+
+
+def block_windows(width: int, height: int, block_size: int) -> Iterator[Window]:
+    """
+    split a raster of width x height into square windows of block_size
+
+    Yields:
+        Window: windows covering the raster, row by row
+    """
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+
+def map_windows(func: Callable, windows: Iterable[Window], max_workers: int = MAX_WORKERS) -> Iterator:
+    """
+    run `func` over windows on a thread pool and yield results in window order.
+    GDAL releases the GIL while decoding, so reads on separate threads overlap.
+    Only a couple of results per worker are held at a time so memory stays flat
+    even when the consumer (usually a writer) is slower than the readers
+
+    Args:
+        func (Callable): function called with each window
+        windows (Iterable[Window]): windows to process
+        max_workers (int): number of threads
+
+    Yields:
+        results of func, in the same order as windows
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        for window in windows:
+            pending.append(pool.submit(func, window))
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class ThreadLocalDatasets:
+    """
+    rasterio datasets are not safe to share between threads, so each thread
+    gets its own handle per path.  Close everything with `close` or a with block
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        self.paths = list(paths)
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def get(self) -> list:
+        """
+        datasets for the calling thread, in the same order as paths
+        """
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = [rio.open(path) for path in self.paths]
+            self._local.handles = handles
+            with self._lock:
+                self._opened.extend(handles)
+        return handles
+
+    def close(self):
+        with self._lock:
+            for handle in self._opened:
+                handle.close()
+            self._opened = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,102 @@
+from typing import Dict, Iterable
+import ast
+
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:  # numexpr is optional, numpy handles everything it does
+    numexpr = None
+
+FUNCTIONS = {
+    'where': np.where,
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'exp': np.exp,
+    'minimum': np.minimum,
+    'maximum': np.maximum,
+    'clip': np.clip,
+}
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.BitAnd, ast.BitOr, ast.BitXor, ast.Invert, ast.USub, ast.UAdd,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+
+class BandExpression:
+    """
+    compiled raster band math expression like `(b - a) * (lulc == 2)`.
+    Evaluates over whole blocks at once with numexpr when it is installed and
+    supports the expression, otherwise with numpy
+    """
+
+    def __init__(self, expression: str, names: Iterable[str]):
+        """
+        Args:
+            expression (str): expression over input names, numbers, arithmetic,
+                comparisons, & | ~ and the functions in FUNCTIONS
+            names (Iterable[str]): names of the available inputs
+
+        Raises:
+            ValueError: if the expression uses anything else
+        """
+        self.expression = expression
+        tree = ast.parse(expression, mode='eval')
+        names = set(names)
+        used = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError(f'{type(node).__name__} is not allowed in band expressions')
+            if isinstance(node, ast.Compare) and len(node.ops) > 1:
+                raise ValueError('chained comparisons are not supported, combine them with &')
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+                raise ValueError(f'only {sorted(FUNCTIONS)} can be called in band expressions')
+            if isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+                if node.id not in names:
+                    raise ValueError(f'unknown input {node.id} in band expression')
+                used.add(node.id)
+        self.names = used
+        self._code = compile(tree, '<band expression>', 'eval')
+        self._use_numexpr = numexpr is not None
+
+    def evaluate(self, arrays: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        evaluate the expression over same shaped arrays
+
+        Args:
+            arrays (Dict[str, np.ndarray]): input name -> array
+
+        Returns:
+            np.ndarray: result array
+        """
+        if self._use_numexpr:
+            try:
+                return numexpr.evaluate(self.expression, local_dict={name: arrays[name] for name in self.names})
+            except (TypeError, ValueError, KeyError, NotImplementedError):
+                # numexpr does not cover every numpy operation (e.g. bool arithmetic)
+                self._use_numexpr = False
+        return np.asarray(eval(self._code, {'__builtins__': {}}, {**FUNCTIONS, **arrays}))
+
+    def evaluate_masked(self, arrays: Dict[str, np.ma.MaskedArray]) -> np.ma.MaskedArray:
+        """
+        evaluate with nodata propagation.  A pixel is masked in the output when
+        it is masked in any input the expression uses or the result is not finite
+
+        Args:
+            arrays (Dict[str, np.ma.MaskedArray]): input name -> masked array
+
+        Returns:
+            np.ma.MaskedArray: masked result
+        """
+        mask = np.zeros(np.shape(next(iter(arrays.values()))), dtype=bool)
+        for name in self.names:
+            mask |= np.ma.getmaskarray(arrays[name])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = self.evaluate({name: np.ma.getdata(arrays[name]) for name in self.names})
+        if np.issubdtype(result.dtype, np.floating):
+            mask |= ~np.isfinite(result)
+        return np.ma.masked_array(result, mask=mask)
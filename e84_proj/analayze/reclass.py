@@ -0,0 +1,110 @@
+from typing import Dict, Sequence
+
+import numpy as np
+
+# integer types small enough to reclassify with a full lookup table
+LUT_DTYPES = (np.uint8, np.int8, np.uint16, np.int16)
+
+
+def smallest_dtype(values: Sequence, as_mask: bool = False) -> np.dtype:
+    """
+    smallest data type that holds every class value
+
+    Args:
+        values (Sequence): class values, including the default
+        as_mask (bool): return bool when every value is 0 or 1
+
+    Returns:
+        np.dtype: output data type, at least uint8
+    """
+    values = np.asarray(values)
+    if as_mask and np.isin(values, (0, 1)).all():
+        return np.dtype(bool)
+    if np.issubdtype(values.dtype, np.floating):
+        return np.dtype('float32')
+    return np.result_type(np.min_scalar_type(values.min()), np.min_scalar_type(values.max()), np.uint8)
+
+
+class Reclassifier:
+    """
+    single pass reclassification with a precomputed lookup.  Either map exact
+    values to classes (`mapping`) or value ranges to classes (`bins` + `classes`,
+    where classes[i] is used for bins[i-1] <= value < bins[i])
+    """
+
+    def __init__(
+            self,
+            mapping: Dict = None,
+            bins: Sequence = None,
+            classes: Sequence = None,
+            default=0,
+            as_mask: bool = False
+    ):
+        """
+        Args:
+            mapping (Dict): value -> class
+            bins (Sequence): increasing range edges
+            classes (Sequence): len(bins) + 1 classes, one per range
+            default: class for values not in mapping, and for nan
+            as_mask (bool): produce a bool array when every class is 0 or 1
+        """
+        if (mapping is None) == (bins is None):
+            raise ValueError('pass exactly one of mapping or bins')
+        if bins is not None and (classes is None or len(classes) != len(bins) + 1):
+            raise ValueError('classes must have one more entry than bins')
+
+        self.mapping = mapping
+        self.bins = None if bins is None else np.asarray(bins)
+        self.default = default
+        class_values = list(mapping.values()) if mapping is not None else list(classes)
+        self.dtype = smallest_dtype(class_values + [default], as_mask)
+        self.classes = None if classes is None else np.asarray(classes, dtype=self.dtype)
+        if mapping is not None:
+            order = np.argsort(list(mapping.keys()))
+            self._keys = np.asarray(list(mapping.keys()))[order]
+            self._values = np.asarray(list(mapping.values()), dtype=self.dtype)[order]
+        self._luts = {}
+
+    def _lut(self, dtype: np.dtype) -> np.ndarray:
+        # table indexed by the unsigned view of the input, so signed values wrap around
+        lut = self._luts.get(dtype)
+        if lut is None:
+            unsigned = np.dtype(f'uint{dtype.itemsize * 8}')
+            lut = np.full(2 ** (dtype.itemsize * 8), self.default, dtype=self.dtype)
+            info = np.iinfo(dtype)
+            for key, value in self.mapping.items():
+                if info.min <= key <= info.max:
+                    lut[np.array(key, dtype=dtype).view(unsigned)] = value
+            self._luts[dtype] = lut
+        return lut
+
+    def apply(self, data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        reclassify an array in one pass
+
+        Args:
+            data (np.ndarray): input values
+            out (np.ndarray): optional preallocated output of `self.dtype`
+
+        Returns:
+            np.ndarray: classes
+        """
+        data = np.asarray(data)
+        if out is None:
+            out = np.empty(data.shape, dtype=self.dtype)
+
+        if self.bins is not None:
+            np.take(self.classes, np.digitize(data, self.bins), out=out)
+        elif data.dtype in LUT_DTYPES:
+            unsigned = np.dtype(f'uint{data.dtype.itemsize * 8}')
+            np.take(self._lut(data.dtype), data.view(unsigned), out=out)
+        else:
+            pos = np.searchsorted(self._keys, data).clip(0, len(self._keys) - 1)
+            matched = self._keys[pos] == data
+            np.take(self._values, pos, out=out)
+            out[~matched] = self.default
+            return out
+
+        if np.issubdtype(data.dtype, np.floating):
+            out[np.isnan(data)] = self.default
+        return out
@@ -0,0 +1,168 @@
+from typing import Sequence, Tuple
+import math
+import warnings
+
+import numpy as np
+import xarray as xr
+from xarray import DataArray
+
+SPATIAL_CHUNK = 512
+TIME_CHUNK = 12
+# upper bound for one (time, y, x) block when a reduction needs every time step at once
+MAX_CHUNK_BYTES = 64 * 2 ** 20
+DAYS_PER_YEAR = 365.25
+CLIMATOLOGY_GROUPS = ('month', 'dayofyear', 'season')
+
+
+def _nanpercentile(block: np.ndarray, q: np.ndarray) -> np.ndarray:
+    with warnings.catch_warnings():
+        # all nan pixels give nan, no need to warn about every one
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.moveaxis(np.nanpercentile(block, q, axis=-1), 0, -1)
+
+
+class TemporalReducer:
+    """
+    reductions over a (time, y, x) stack, like the one `load_stack` returns.
+    Everything stays lazy and runs chunk by chunk: sums, means, trends and
+    climatologies are accumulated over time chunks, so memory depends on the
+    chunk size and not on how many time steps the series has.  Percentiles need
+    every time step of a pixel at once, their spatial chunks shrink as the
+    series grows to stay under `max_chunk_bytes`
+    """
+
+    def __init__(
+            self,
+            stack: DataArray,
+            spatial_chunk: int = SPATIAL_CHUNK,
+            time_chunk: int = TIME_CHUNK,
+            max_chunk_bytes: int = MAX_CHUNK_BYTES
+    ):
+        """
+        Args:
+            stack (DataArray): float stack with time, y and x dims, missing data as nan
+            spatial_chunk (int): y and x chunk size
+            time_chunk (int): time steps per chunk
+            max_chunk_bytes (int): block size limit for percentiles
+        """
+        self.spatial_chunk = spatial_chunk
+        self.max_chunk_bytes = max_chunk_bytes
+        self.stack = stack.chunk({'time': time_chunk, 'y': spatial_chunk, 'x': spatial_chunk})
+
+    def sum(self, min_count: int = 1) -> DataArray:
+        """
+        per pixel total, nan where fewer than min_count steps are valid
+        """
+        return self.stack.sum('time', skipna=True, min_count=min_count)
+
+    def mean(self) -> DataArray:
+        """
+        per pixel mean of the valid steps
+        """
+        return self.stack.mean('time', skipna=True)
+
+    def percentile(self, q: Sequence[float]) -> DataArray:
+        """
+        per pixel percentiles of the valid steps
+
+        Args:
+            q (Sequence[float]): percentiles between 0 and 100
+
+        Returns:
+            DataArray: (y, x, quantile) array
+        """
+        q = np.atleast_1d(np.asarray(q, dtype='float64'))
+        itemsize = self.stack.dtype.itemsize
+        side = int(math.sqrt(self.max_chunk_bytes / (self.stack.sizes['time'] * itemsize)))
+        side = max(1, min(side, self.spatial_chunk))
+        stack = self.stack.chunk({'time': -1, 'y': side, 'x': side})
+        result = xr.apply_ufunc(
+            _nanpercentile,
+            stack,
+            input_core_dims=[['time']],
+            output_core_dims=[['quantile']],
+            kwargs={'q': q},
+            dask='parallelized',
+            output_dtypes=['float64'],
+            dask_gufunc_kwargs={'output_sizes': {'quantile': len(q)}}
+        )
+        return result.assign_coords(quantile=q)
+
+    def trend(self, min_count: int = 2) -> Tuple[DataArray, DataArray]:
+        """
+        per pixel least squares linear trend against time in years.  Built from
+        running sums (n, sum t, sum y, sum ty, sum tt) so it streams over time
+        chunks like `sum` does
+
+        Args:
+            min_count (int): valid steps a pixel needs, fewer gives nan
+
+        Returns:
+            Tuple[DataArray, DataArray]: slope in units per year, and the
+                intercept at the first time step
+        """
+        elapsed = (self.stack.time - self.stack.time[0]) / np.timedelta64(1, 'D') / DAYS_PER_YEAR
+        valid = self.stack.notnull()
+        t = elapsed.astype('float64').where(valid, 0)
+        y = self.stack.astype('float64').fillna(0)
+
+        n = valid.sum('time')
+        sum_t = t.sum('time')
+        sum_y = y.sum('time')
+        sum_ty = (t * y).sum('time')
+        sum_tt = (t * t).sum('time')
+
+        denominator = n * sum_tt - sum_t ** 2
+        ok = (n >= min_count) & (denominator > 0)
+        slope = xr.where(ok, (n * sum_ty - sum_t * sum_y) / denominator.where(ok), np.nan)
+        intercept = xr.where(ok, (sum_y - slope * sum_t) / n.where(ok), np.nan)
+        return slope, intercept
+
+    def climatology(self, group: str = 'month', baseline: Tuple[str, str] = None, stat: str = 'mean') -> DataArray:
+        """
+        per pixel mean (or std) for each month, day of year or season
+
+        Args:
+            group (str): 'month', 'dayofyear' or 'season'
+            baseline (Tuple[str, str]): (start, end) of the reference period, the
+                whole stack when None
+            stat (str): 'mean' or 'std'
+
+        Returns:
+            DataArray: one layer per group value
+        """
+        if group not in CLIMATOLOGY_GROUPS:
+            raise ValueError(f'group must be one of {CLIMATOLOGY_GROUPS}, got {group}')
+        if stat not in ('mean', 'std'):
+            raise ValueError(f'stat must be mean or std, got {stat}')
+        stack = self.stack if baseline is None else self.stack.sel(time=slice(*baseline))
+        grouped = stack.groupby(f'time.{group}')
+        return grouped.mean('time', skipna=True) if stat == 'mean' else grouped.std('time', skipna=True)
+
+    def anomaly(
+            self,
+            group: str = 'month',
+            baseline: Tuple[str, str] = None,
+            climatology: DataArray = None,
+            standardize: bool = False
+    ) -> DataArray:
+        """
+        difference of every step from its climatology, for example each month's
+        rainfall minus the long term mean of that month
+
+        Args:
+            group (str): 'month', 'dayofyear' or 'season'
+            baseline (Tuple[str, str]): reference period for the climatology
+            climatology (DataArray): precomputed climatology from `climatology`
+            standardize (bool): divide by the climatology's standard deviation
+
+        Returns:
+            DataArray: (time, y, x) anomalies
+        """
+        if climatology is None:
+            climatology = self.climatology(group, baseline)
+        anomaly = self.stack.groupby(f'time.{group}') - climatology
+        if standardize:
+            std = self.climatology(group, baseline, stat='std')
+            anomaly = anomaly.groupby(f'time.{group}') / std.where(std > 0)
+        return anomaly.drop_vars(group, errors='ignore')
@@ -1,14 +1,68 @@
-from typing import List
+from typing import Dict, List, Sequence
+import math
 
 import geopandas as gpd
 import numpy as np
 import rasterio as rio
-from rasterio.enums import Resampling
-from rasterstats import zonal_stats
+from rasterio.features import rasterize
+from rasterio.errors import WindowError
+from rasterio.windows import Window, from_bounds
+import xarray as xr
 from xarray import DataArray
-from xrspatial.classify import reclassify
+
+from e84_proj.analayze.blocks import MAX_WORKERS, ThreadLocalDatasets, block_windows, map_windows
+from e84_proj.analayze.expression import BandExpression
+from e84_proj.analayze.reclass import Reclassifier
+from e84_proj.preprocess.overviews import overview_open_kwargs
+from e84_proj.preprocess.warp import RESAMPLING_METHODS, warp_to_grid
+from e84_proj.vector_io import read_polygons
 
 TARGET_RESOLUTION_METERS = 1000
+ZONAL_BLOCK_SIZE = 1024
+BLOCK_SIZE = 512
+ZONAL_STATS = ('count', 'sum', 'mean', 'min', 'max', 'std')
+# IO LULC class 2 to 1, everything else to 0
+LULC_RECLASS = {2: 1}
+
+
+def default_nodata(dtype: str):
+    """
+    nodata value for an output data type: nan for floats, the most negative
+    value for signed integers and the largest value for unsigned integers
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    if np.issubdtype(dtype, np.signedinteger):
+        return np.iinfo(dtype).min
+    return np.iinfo(dtype).max
+
+
+def tiled_profile(block_size: int, dtype: str, nodata) -> dict:
+    """
+    profile settings for a tiled, compressed single band GeoTIFF written window by window
+
+    Args:
+        block_size (int): tile edge length, multiple of 16
+        dtype (str): output data type
+        nodata: output nodata value
+
+    Returns:
+        dict: kwargs to update a rasterio profile with
+    """
+    floating = np.issubdtype(np.dtype(dtype), np.floating)
+    return {
+        'driver': 'GTiff',
+        'dtype': dtype,
+        'count': 1,
+        'nodata': nodata,
+        'tiled': True,
+        'blockxsize': block_size,
+        'blockysize': block_size,
+        'compress': 'deflate',
+        'predictor': 3 if floating else 2,
+        'BIGTIFF': 'IF_SAFER'
+    }
 
 class Analyzer:
     """
@@ -19,46 +73,162 @@ class Analyzer:
         self.coords = coords
         pass
 
-    def difference(self, start_path: str, end_path: str, output_path: str):
+    def difference(
+            self,
+            start_path: str,
+            end_path: str,
+            output_path: str,
+            block_size: int = BLOCK_SIZE,
+            max_workers: int = MAX_WORKERS
+    ):
         """
         raster difference claculator for getting difference of two rasters
-        for exammple to find CHANGE in ranfaill between two years
+        for exammple to find CHANGE in ranfaill between two years.
+        Walks the rasters window by window on a thread pool and writes a tiled,
+        compressed output, so memory use does not depend on raster size.
+        Integer inputs are subtracted as int64 and written as int32, float inputs
+        as float64 written as float32.  Nodata in either input is nodata in the output
 
         Args:
             start_path (str): path to start raster 
             end_path (str): path to end raster
             output_path (str): location to write out difference raster
+            block_size (int): window edge length in pixels, multiple of 16
+            max_workers (int): number of windows processed at the same time
         """
-        rast_start = rio.open(start_path).read()
-        rast_end = rio.open(end_path).read()
+        with rio.open(start_path) as start, rio.open(end_path) as end:
+            if (start.shape, start.transform) != (end.shape, end.transform):
+                raise ValueError('start and end rasters must share the same grid')
+            floating = any(
+                np.issubdtype(np.dtype(src.dtypes[0]), np.floating) for src in (start, end)
+            )
+            kwargs = start.profile.copy()
+            width, height = start.width, start.height
 
-        result = rast_end - rast_start
+        work_dtype, out_dtype = ('float64', 'float32') if floating else ('int64', 'int32')
+        nodata = default_nodata(out_dtype)
+        kwargs.update(tiled_profile(block_size, out_dtype, nodata))
 
-        kwargs = rast_start.meta
-        kwargs.update(
-            dtype=rio.int32,
-            count=1
-        )
+        with ThreadLocalDatasets([start_path, end_path]) as datasets:
+            def compute(window):
+                rast_start, rast_end = datasets.get()
+                a = rast_start.read(1, window=window, masked=True).astype(work_dtype)
+                b = rast_end.read(1, window=window, masked=True).astype(work_dtype)
+                result = b - a
+                return window, result.astype(out_dtype).filled(nodata)
 
-        with rio.open(output_path, 'w', **kwargs) as output:
-            output.write_band(1, result.astype(rio.int32))
+            with rio.open(output_path, 'w', **kwargs) as output:
+                windows = block_windows(width, height, block_size)
+                for window, block in map_windows(compute, windows, max_workers):
+                    output.write(block, 1, window=window)
         
         return output_path
 
-    def reclassify(self, agg: DataArray):
+    def evaluate(
+            self,
+            expression: str,
+            inputs: Dict[str, str],
+            output_path: str,
+            dtype: str = 'float32',
+            block_size: int = BLOCK_SIZE,
+            max_workers: int = MAX_WORKERS
+    ) -> str:
+        """
+        band math over named rasters, like `(b - a) * (lulc == 2)` for rainfall
+        change on cropland.  The whole expression is evaluated block by block in
+        one pass, so chained operations never write intermediate files or hold
+        full size intermediate arrays.  Nodata in any used input is nodata in the output
+
+        Args:
+            expression (str): expression over the names in `inputs`
+            inputs (Dict[str, str]): name -> raster path, all on the same grid
+            output_path (str): location to write the result
+            dtype (str): output data type, the expression itself is computed in
+                float64 (or int64 when every input is an integer raster)
+            block_size (int): window edge length in pixels, multiple of 16
+            max_workers (int): number of windows processed at the same time
+
+        Returns:
+            str: output_path
+        """
+        compiled = BandExpression(expression, inputs.keys())
+        names = sorted(compiled.names)
+        if not names:
+            raise ValueError('band expression must use at least one input')
+        paths = [inputs[name] for name in names]
+
+        grids = set()
+        input_dtypes = []
+        for path in paths:
+            with rio.open(path) as src:
+                grids.add((src.shape, src.transform))
+                input_dtypes.append(src.dtypes[0])
+                kwargs = src.profile.copy()
+                width, height = src.width, src.height
+        if len(grids) != 1:
+            raise ValueError('all inputs of a band expression must share the same grid')
+
+        # the inputs decide the working precision, `dtype` only applies when writing.
+        # Integers are widened so differences of unsigned bands can go negative
+        floating = np.issubdtype(np.result_type(*input_dtypes), np.floating)
+        work_dtype = 'float64' if floating else 'int64'
+        nodata = default_nodata(dtype)
+        kwargs.update(tiled_profile(block_size, dtype, nodata))
+
+        with ThreadLocalDatasets(paths) as datasets:
+            def compute(window):
+                arrays = {
+                    name: src.read(1, window=window, masked=True).astype(work_dtype)
+                    for name, src in zip(names, datasets.get())
+                }
+                result = compiled.evaluate_masked(arrays)
+                return window, result.astype(dtype).filled(nodata)
+
+            with rio.open(output_path, 'w', **kwargs) as output:
+                windows = block_windows(width, height, block_size)
+                for window, block in map_windows(compute, windows, max_workers):
+                    output.write(block, 1, window=window)
+
+        return output_path
+
+    def reclassify(
+            self,
+            agg: DataArray,
+            mapping: Dict = None,
+            bins: Sequence = None,
+            classes: Sequence = None,
+            default=0,
+            as_mask: bool = False
+    ) -> DataArray:
         """
         reclassify land use and land cover rasters into binary rasters for easier 
-        calculations and filtering.  Use numpy + xarray for speed
+        calculations and filtering.  Uses a precomputed lookup table so the data is
+        only scanned once and written straight into an output of the smallest
+        dtype that fits the classes.  Works block by block on dask backed arrays.
+        Without a mapping or bins, class 2 becomes 1 and everything else 0
 
         Args:
             agg (DataArray): xarray
+            mapping (Dict): value -> class
+            bins (Sequence): increasing range edges, for range -> class reclassification
+            classes (Sequence): len(bins) + 1 classes, one per range
+            default: class for values not covered by mapping
+            as_mask (bool): return a bool array when every class is 0 or 1
+
+        Returns:
+            DataArray: reclassified array
         """
-        # use either numpy WHERE 
-        agg[np.where( agg < 2 )] = 0
-        agg[np.where( agg > 2)] = 0
-        agg[np.where( agg == 2)] = 1
+        if mapping is None and bins is None:
+            mapping = LULC_RECLASS
+        reclassifier = Reclassifier(mapping, bins, classes, default, as_mask)
 
-        return 
+        return xr.apply_ufunc(
+            reclassifier.apply,
+            agg,
+            dask='parallelized',
+            output_dtypes=[reclassifier.dtype],
+            keep_attrs=True
+        )
     
     def resample(self, path: str, method: str, out_path: str, input_resolution_m: int=1000):
         """
@@ -79,57 +249,155 @@ class Analyzer:
             output_path (str): output path where resampled raster is saved
         """
         scale_factor = input_resolution_m/TARGET_RESOLUTION_METERS
-        resampling_method = None
-        if method == 'nearest_neighbor':
-            resampling_method = Resampling.nearest
-        elif method == 'bilinear':
-            resampling_method = Resampling.bilinear
+        resampling_method = RESAMPLING_METHODS[method]
         with rio.open(path) as dataset:
-            profile = dataset.profile.copy()
-
-            data = dataset.read(
-                out_shape=(
-                    dataset.count,
-                    int(dataset.height * scale_factor),
-                    int(dataset.width * scale_factor)
-                ),
-                resampling=resampling_method
-            )
+            width = max(int(dataset.width * scale_factor), 1)
+            height = max(int(dataset.height * scale_factor), 1)
             transform = dataset.transform * dataset.transform.scale(
-                (1 / scale_factor),
-                (1 / scale_factor)
+                dataset.width / width,
+                dataset.height / height
             )
-            profile.update({"height": data.shape[-2],
-                    "width": data.shape[-1],
-                   "transform": transform})
-        
-
-        with rio.open(out_path, "w", **profile) as dataset:
-            dataset.write(data)
+            crs = dataset.crs
+            target_res = abs(transform.a)
 
-        return out_path
+        # decode the closest overview instead of every full resolution pixel, then
+        # one multithreaded warp pass straight from it to the output
+        open_kwargs = overview_open_kwargs(path, target_res, resampling=resampling_method)
+        return warp_to_grid(
+            path, out_path, crs, transform, width, height, resampling_method, open_kwargs=open_kwargs
+        )
     
-    def spatial_statistics(self, poly_path: str, raster_path: str) -> gpd.GeoDataFrame:
+    def spatial_statistics(
+            self,
+            poly_path: str,
+            raster_path: str,
+            block_size: int = ZONAL_BLOCK_SIZE,
+            columns: List[str] = None,
+            bbox: tuple = None,
+            prefix: str = ''
+    ) -> gpd.GeoDataFrame:
         """
-        generate spatial statistics.  Input raster and use zonal stats to generate 
-        some statistics for each polygon
+        generate spatial statistics.  All polygons are rasterized once into a label
+        array on the raster grid, then count/sum/mean/min/max/std are computed for
+        every zone with bincount in a single block by block pass over the raster.
+        Pixels are assigned by their centre like rasterstats; where polygons
+        overlap the later polygon wins.  The std is merged block by block from
+        per block means and squared deviations, so large values don't lose
+        precision.  Zones outside the raster get a count of 0 and nan stats
 
         Args:
-            poly_path (str): _description_
-            raster_path (str): _description_
+            poly_path (str): path to polygon file readable by geopandas
+            raster_path (str): path to single band raster
+            block_size (int): block edge length in pixels
+            columns (List[str]): polygon attributes to keep, None keeps all of them
+            bbox (tuple): only use polygons intersecting (xmin, ymin, xmax, ymax),
+                in the polygon file's crs
+            prefix (str): prepended to the stat column names, like 'rain_'
 
         Returns:
-            gpd.GeoDataFrame: _description_
+            gpd.GeoDataFrame: input polygons with count, sum, mean, min, max and std columns
+
+        Raises:
+            ValueError: if a stat column would overwrite a polygon attribute
         """
+        gdf = read_polygons(poly_path, columns=columns, bbox=bbox)
+        names = {stat: f'{prefix}{stat}' for stat in ZONAL_STATS}
+        clashes = [name for name in names.values() if name in gdf.columns]
+        if clashes:
+            raise ValueError(f'{poly_path} already has columns {clashes}, pass a prefix or drop them with columns')
+
+        n_zones = len(gdf) + 1
+        count = np.zeros(n_zones, dtype='int64')
+        total = np.zeros(n_zones)
+        mean = np.zeros(n_zones)
+        m2 = np.zeros(n_zones)
+        mins = np.full(n_zones, np.inf)
+        maxs = np.full(n_zones, -np.inf)
+
+        with rio.open(raster_path) as src:
+            zones = gdf.to_crs(src.crs) if gdf.crs is not None and src.crs is not None else gdf
+            # only rasterize and read the part of the raster the zones cover
+            zone_window = from_bounds(*zones.total_bounds, transform=src.transform)
+            # widen to whole pixels on both sides, rounding the length would drop
+            # the last partly covered column or row
+            col_off, row_off = math.floor(zone_window.col_off), math.floor(zone_window.row_off)
+            zone_window = Window(
+                col_off,
+                row_off,
+                math.ceil(zone_window.col_off + zone_window.width) - col_off,
+                math.ceil(zone_window.row_off + zone_window.height) - row_off
+            )
+            try:
+                zone_window = zone_window.intersection(Window(0, 0, src.width, src.height))
+            except WindowError:
+                # no zone overlaps the raster, every zone is empty
+                zone_window = None
+
+            if zone_window is not None and zone_window.width > 0 and zone_window.height > 0:
+                shapes = (
+                    (geom, i + 1) for i, geom in enumerate(zones.geometry)
+                    if geom is not None and not geom.is_empty
+                )
+                labels = rasterize(
+                    shapes,
+                    out_shape=(int(zone_window.height), int(zone_window.width)),
+                    transform=src.window_transform(zone_window),
+                    fill=0,
+                    dtype='int32'
+                )
+                windows = block_windows(labels.shape[1], labels.shape[0], block_size)
+            else:
+                windows = ()
+
+            for window in windows:
+                block_labels = labels[
+                    window.row_off:window.row_off + window.height,
+                    window.col_off:window.col_off + window.width
+                ].ravel()
+                read_window = Window(
+                    zone_window.col_off + window.col_off,
+                    zone_window.row_off + window.row_off,
+                    window.width,
+                    window.height
+                )
+                values = src.read(1, window=read_window, masked=True).ravel()
+                keep = (block_labels > 0) & ~np.ma.getmaskarray(values)
+                if not keep.any():
+                    continue
+                block_labels = block_labels[keep]
+                block_values = values.data[keep].astype('float64')
+
+                block_count = np.bincount(block_labels, minlength=n_zones)
+                block_total = np.bincount(block_labels, weights=block_values, minlength=n_zones)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    block_mean = np.where(block_count > 0, block_total / block_count, 0)
+                deviations = block_values - block_mean[block_labels]
+                block_m2 = np.bincount(block_labels, weights=deviations ** 2, minlength=n_zones)
 
-        stats = zonal_stats(poly_path, raster_path)
-        gdf = gpd.read_file(poly_path)
+                # Chan et al. pairwise update of the running mean and squared deviations
+                merged = count + block_count
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    delta = block_mean - mean
+                    seen = merged > 0
+                    mean = np.where(seen, mean + delta * block_count / merged, mean)
+                    m2 = np.where(seen, m2 + block_m2 + delta ** 2 * count * block_count / merged, m2)
+                count = merged
+                total += block_total
+                np.minimum.at(mins, block_labels, block_values)
+                np.maximum.at(maxs, block_labels, block_values)
 
-        # use pandas vectorized operations and list comprehension to speed up
-        # get index as pandas series
-        # loop over stats list of dicts and add index to each item using list comprehension
-        # turn list into series with index
-        # join to geodataframe on index using pd.merge()
+        empty = count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(m2 / count)
+        mean[empty] = np.nan
+        mins[empty] = np.nan
+        maxs[empty] = np.nan
 
+        gdf[names['count']] = count[1:]
+        gdf[names['sum']] = total[1:]
+        gdf[names['mean']] = mean[1:]
+        gdf[names['min']] = mins[1:]
+        gdf[names['max']] = maxs[1:]
+        gdf[names['std']] = std[1:]
 
-        return gdf
\ No newline at end of file
+        return gdf
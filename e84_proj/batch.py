@@ -0,0 +1,313 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Set, Tuple
+import csv
+import io
+import os
+
+import geopandas as gpd
+from rasterio.enums import Resampling
+from shapely.geometry import Polygon
+
+from e84_proj.analyze import TARGET_RESOLUTION_METERS
+from e84_proj.extract.extraction import Extract
+from e84_proj.extract.stac_client.client import StacClient
+from e84_proj.extract.utils import coords_to_polygon
+from e84_proj.pipeline import summarize
+from e84_proj.preprocess.grid import TargetGrid
+from e84_proj.preprocess.warp import INPUT_RESAMPLING
+from e84_proj.vector_io import read_polygons, write_polygons
+
+BATCH_PROCESSES = os.cpu_count() or 1
+DOWNLOAD_WORKERS = 8
+ID_COLUMN = 'aoi_id'
+# how far back from the end of the results table to look for the last full line
+TAIL_BYTES = 64 * 1024
+
+
+def read_aois(path: str, id_column: str = None) -> List[Tuple[str, List[tuple]]]:
+    """
+    read AOIs from a GeoJSON, GeoPackage or (Geo)Parquet file.  AOIs are used as
+    a single outer ring all the way through the pipeline, so multi part
+    geometries and polygons with holes are rejected instead of being changed
+    into a different area
+
+    Args:
+        path (str): vector file path
+        id_column (str): column holding AOI ids, defaults to the row index
+
+    Returns:
+        List[Tuple[str, List[tuple]]]: (aoi id, coordinates in epsg:4326)
+
+    Raises:
+        ValueError: if any AOI is not a polygon without holes
+    """
+    gdf = read_polygons(path, columns=[id_column] if id_column else [])
+    if gdf.crs is not None:
+        gdf = gdf.to_crs('epsg:4326')
+    ids = gdf[id_column] if id_column else gdf.index
+    aois = []
+    unsupported = []
+    for aoi_id, geom in zip(ids.astype(str), gdf.geometry):
+        if geom is None or geom.is_empty:
+            continue
+        if geom.geom_type == 'MultiPolygon' and len(geom.geoms) == 1:
+            geom = geom.geoms[0]
+        if geom.geom_type != 'Polygon' or len(geom.interiors):
+            unsupported.append(aoi_id)
+            continue
+        aois.append((aoi_id, list(geom.exterior.coords)))
+    if unsupported:
+        raise ValueError(
+            f'AOIs must be polygons without holes, explode or fill these first: {unsupported[:10]}'
+            + (f' and {len(unsupported) - 10} more' if len(unsupported) > 10 else '')
+        )
+    return aois
+
+
+class ResultTable:
+    """
+    CSV table with one row per finished AOI, appended to as soon as each AOI is
+    done.  The ids already in the table are the checkpoint, so a restarted
+    batch skips them without a separate state file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def rows(self) -> List[dict]:
+        """
+        complete rows of the table.  A row counts when it has every column and
+        all its values parse as numbers
+
+        Returns:
+            List[dict]: aoi id plus float values per row
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, newline='') as f:
+            text = f.read()
+        # a last line without its newline was cut short by a crash, even if what
+        # is left of it still parses.  It gets redone, like rows with missing fields
+        if not text.endswith('\n'):
+            text = text[:text.rfind('\n') + 1]
+        return [
+            {key: value if key == ID_COLUMN else float(value) for key, value in row.items()}
+            for row in csv.DictReader(io.StringIO(text)) if _complete(row)
+        ]
+
+    def done(self) -> Set[str]:
+        """
+        ids of AOIs with a complete row in the table
+        """
+        return {row[ID_COLUMN] for row in self.rows()}
+
+    def to_geoparquet(self, aois: List[Tuple[str, List[tuple]]], out_path: str) -> str:
+        """
+        write the finished rows joined to their AOI polygons as GeoParquet.  The
+        CSV stays the checkpoint since parquet files can't be appended to
+
+        Args:
+            aois (List[Tuple[str, List[tuple]]]): (aoi id, coordinates in epsg:4326)
+            out_path (str): .parquet output path
+
+        Returns:
+            str: out_path
+        """
+        polygons = {aoi_id: Polygon(coords) for aoi_id, coords in aois}
+        rows = [row for row in self.rows() if row[ID_COLUMN] in polygons]
+        geometry = [polygons[row[ID_COLUMN]] for row in rows]
+        gdf = gpd.GeoDataFrame(rows, geometry=geometry, crs='epsg:4326')
+        return write_polygons(gdf, out_path)
+
+    def _repair(self):
+        # drop a last line left without its newline by a crash, so the next row
+        # starts on a line of its own.  The dropped row is not in `done` anyway
+        with open(self.path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read()
+            end = tail.rfind(b'\n')
+            f.truncate(size - len(tail) + end + 1 if end >= 0 else 0)
+
+    def append(self, row: dict):
+        """
+        write one row and flush it to disk
+        """
+        if os.path.exists(self.path):
+            self._repair()
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if new:
+                writer.writeheader()
+            writer.writerow(row)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _complete(row: dict) -> bool:
+    if None in row or None in row.values() or not row.get(ID_COLUMN):
+        return False
+    try:
+        for key, value in row.items():
+            if key != ID_COLUMN:
+                float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def process_aoi(aoi_id: str, coords: List[tuple], paths: Dict[str, str], resolution: float) -> dict:
+    """
+    warp the downloaded inputs onto the AOI's grid and summarize them.  Runs in
+    a worker process
+    """
+    grid = TargetGrid.from_coords(coords, resolution)
+    arrays = {
+        name: grid.read(path, INPUT_RESAMPLING.get(name.split('_')[0], Resampling.nearest))
+        for name, path in paths.items()
+    }
+    return {ID_COLUMN: aoi_id, **summarize(**arrays)}
+
+
+class BatchRunner:
+    """
+    runs the AOI summary for many AOIs.  Searches are batched across AOIs, every
+    distinct asset is downloaded once into the shared cache, and the raster work
+    fans out over a process pool whose workers are reused for every AOI
+    """
+
+    def __init__(
+            self,
+            sources: Dict[str, tuple],
+            extractor: Extract,
+            output_path: str,
+            processes: int = BATCH_PROCESSES,
+            download_workers: int = DOWNLOAD_WORKERS,
+            resolution: float = TARGET_RESOLUTION_METERS,
+            geoparquet_path: str = None
+    ):
+        """
+        Args:
+            sources (Dict[str, tuple]): input name -> (StacClient, date) or (href, None),
+                same as `build_aoi_pipeline`
+            extractor (Extract): downloader with a shared cache, must be in `download` mode
+            output_path (str): CSV results table, also the checkpoint
+            processes (int): worker processes for the raster work
+            download_workers (int): concurrent downloads
+            resolution (float): target grid resolution in meters
+            geoparquet_path (str): GeoParquet copy of the results with the AOI
+                polygons, rewritten at the end of every run when set
+        """
+        if extractor.mode != 'download':
+            raise ValueError('batch runs share whole assets between AOIs, use an Extract in download mode')
+        self.sources = sources
+        self.extractor = extractor
+        self.table = ResultTable(output_path)
+        self.processes = processes
+        self.download_workers = download_workers
+        self.resolution = resolution
+        self.geoparquet_path = geoparquet_path
+
+    def resolve_hrefs(self, polygons: List) -> List[Dict[str, str]]:
+        """
+        input hrefs for every AOI, with one batched search per STAC client covering
+        all of its dates and AOIs
+
+        Returns:
+            List[Dict[str, str]]: per AOI, input name -> href.  Inputs without a
+                matching item are left out
+        """
+        dates_by_client = {}
+        for source, date in self.sources.values():
+            if isinstance(source, StacClient):
+                dates_by_client.setdefault(source, set()).add(date)
+
+        matches = {}
+        for client, dates in dates_by_client.items():
+            matches[client] = client.batch_search(client.connection_factory(), polygons, sorted(dates))
+
+        hrefs = []
+        for i in range(len(polygons)):
+            aoi_hrefs = {}
+            for name, (source, date) in self.sources.items():
+                if not isinstance(source, StacClient):
+                    aoi_hrefs[name] = source
+                elif matches[source][(i, date)]:
+                    aoi_hrefs[name] = matches[source][(i, date)][0]
+            hrefs.append(aoi_hrefs)
+        return hrefs
+
+    def download(self, hrefs: Set[str]) -> Dict[str, str]:
+        """
+        fetch every distinct href once
+
+        Returns:
+            Dict[str, str]: href -> local path, failed downloads are left out
+        """
+        paths = {}
+        with ThreadPoolExecutor(max_workers=self.download_workers) as pool:
+            futures = {pool.submit(self.extractor.fetch_asset, href): href for href in hrefs}
+            for future in as_completed(futures):
+                try:
+                    paths[futures[future]] = future.result()
+                except Exception as e:
+                    print(f'download of {futures[future]} failed: {e}')
+        return paths
+
+    def run(self, aois: List[Tuple[str, List[tuple]]]) -> List[str]:
+        """
+        process every AOI not already in the results table
+
+        Args:
+            aois (List[Tuple[str, List[tuple]]]): (aoi id, coordinates in epsg:4326)
+
+        Returns:
+            List[str]: ids of AOIs that failed, they are retried on the next run
+        """
+        done = self.table.done()
+        pending = [(aoi_id, coords) for aoi_id, coords in aois if aoi_id not in done]
+        print(f'{len(done)} AOIs already done, {len(pending)} to process')
+        if not pending:
+            self.export(aois)
+            return []
+
+        polygons = [coords_to_polygon(coords, 'epsg:4326', 'epsg:4326') for _, coords in pending]
+        hrefs = self.resolve_hrefs(polygons)
+        paths = self.download({href for aoi_hrefs in hrefs for href in aoi_hrefs.values()})
+
+        failed = []
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            futures = {}
+            for (aoi_id, coords), aoi_hrefs in zip(pending, hrefs):
+                aoi_paths = {name: paths[href] for name, href in aoi_hrefs.items() if href in paths}
+                if len(aoi_paths) != len(self.sources):
+                    print(f'{aoi_id}: missing inputs {sorted(set(self.sources) - set(aoi_paths))}')
+                    failed.append(aoi_id)
+                    continue
+                futures[pool.submit(process_aoi, aoi_id, coords, aoi_paths, self.resolution)] = aoi_id
+
+            for i, future in enumerate(as_completed(futures), 1):
+                try:
+                    self.table.append(future.result())
+                except Exception as e:
+                    print(f'{futures[future]} failed: {e}')
+                    failed.append(futures[future])
+                if i % 100 == 0:
+                    print(f'{i}/{len(futures)} AOIs processed')
+
+        self.extractor.cache.evict()
+        self.export(aois)
+        return failed
+
+    def export(self, aois: List[Tuple[str, List[tuple]]]):
+        """
+        write the GeoParquet results, if a path was given
+        """
+        if self.geoparquet_path is not None:
+            self.table.to_geoparquet(aois, self.geoparquet_path)
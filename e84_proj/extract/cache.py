@@ -0,0 +1,149 @@
+from typing import Iterable, Optional
+from urllib.parse import urlparse
+import hashlib
+import os
+import re
+import threading
+import time
+
+from e84_proj.extract.downloader import PARTIAL_SUFFIX
+
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+# partial downloads untouched for this long were abandoned by an earlier run
+PARTIAL_MAX_AGE_SECONDS = 24 * 60 * 60
+# sha256 key plus extensions, like `<key>.tif`, `<key>.tif.part` or `<key>.tif.ovr`
+CACHE_FILE_PATTERN = re.compile(r'^[0-9a-f]{64}(\.[A-Za-z0-9]+)*$')
+
+
+class AssetCache:
+    """
+    content addressed store for downloaded assets.  Files are named by a hash of
+    the asset href plus its ETag/Last-Modified validator, so a changed remote
+    file or a different AOI window never reuses a stale copy.  Disk use is kept
+    under `max_bytes` by evicting the least recently used files.  Only files
+    named like cache keys are ever counted or removed, anything else in the
+    folder is left alone
+    """
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            root (str): folder to keep cached files in
+            max_bytes (int): byte budget for the cache folder
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key(self, href: str, validator: Optional[str] = None, variant: Optional[str] = None) -> str:
+        """
+        cache key for an asset
+
+        Args:
+            href (str): asset href
+            validator (str): ETag or Last-Modified value reported by the server
+            variant (str): anything else that changes the stored bytes, like the
+                AOI for windowed reads
+
+        Returns:
+            str: hex digest
+        """
+        digest = hashlib.sha256()
+        for part in (href, validator, variant):
+            digest.update((part or '').encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def path_for(self, href: str, validator: Optional[str] = None, variant: Optional[str] = None) -> str:
+        """
+        local path an asset is (or will be) stored at
+
+        Returns:
+            str: path inside the cache folder, keeps the href's file extension
+        """
+        # created on first use rather than when the cache object is built
+        os.makedirs(self.root, exist_ok=True)
+        extension = os.path.splitext(urlparse(href).path)[1] or '.tif'
+        return os.path.join(self.root, self.key(href, validator, variant) + extension)
+
+    def get(self, path: str) -> Optional[str]:
+        """
+        look up a cached file and mark it as recently used
+
+        Args:
+            path (str): path from `path_for`
+
+        Returns:
+            Optional[str]: path if cached, None on a miss
+        """
+        with self._lock:
+            if os.path.isfile(path):
+                os.utime(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def evict(self, keep: Iterable[str] = (), partial_max_age: float = PARTIAL_MAX_AGE_SECONDS) -> int:
+        """
+        delete least recently used files until the cache fits in its budget.
+        Files in `keep` are in use by the current run and are never removed.
+        Partial downloads count against the budget, and ones untouched for
+        `partial_max_age` seconds are removed as abandoned
+
+        Args:
+            keep (Iterable[str]): paths to protect from eviction
+            partial_max_age (float): seconds before a partial download is abandoned
+
+        Returns:
+            int: number of files removed
+        """
+        keep = {os.path.abspath(path) for path in keep}
+        keep |= {path + PARTIAL_SUFFIX for path in keep}
+        if not os.path.isdir(self.root):
+            return 0
+        with self._lock:
+            now = time.time()
+            entries = []
+            removed = 0
+            for entry in os.scandir(self.root):
+                if not entry.is_file() or not CACHE_FILE_PATTERN.match(entry.name):
+                    continue
+                stat = entry.stat()
+                if entry.name.endswith(PARTIAL_SUFFIX):
+                    if now - stat.st_mtime > partial_max_age and os.path.abspath(entry.path) not in keep:
+                        os.remove(entry.path)
+                        removed += 1
+                        continue
+                    # an in-progress download can't be evicted but still uses disk
+                    keep.add(os.path.abspath(entry.path))
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if os.path.abspath(path) in keep:
+                    continue
+                os.remove(path)
+                total -= size
+                removed += 1
+
+            self.evictions += removed
+        return removed
+
+    @property
+    def stats(self) -> dict:
+        """
+        hit/miss/eviction counts since this cache object was created
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,103 @@
+from typing import List
+from urllib.parse import urlparse
+import os
+
+import rasterio as rio
+from rasterio.errors import WindowError
+from rasterio.features import geometry_window
+from shapely.geometry import mapping
+
+from e84_proj.extract.downloader import PARTIAL_SUFFIX
+from e84_proj.extract.utils import coords_to_polygon
+
+# GDAL settings so a remote COG is read with a handful of range requests:
+# no directory listing, merged multi-range requests and an in-process block cache
+REMOTE_GDAL_OPTIONS = {
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.tiff',
+    'GDAL_HTTP_MULTIRANGE': 'YES',
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'VSI_CACHE': 'TRUE',
+    'AWS_NO_SIGN_REQUEST': 'YES',
+}
+
+
+def to_vsi_path(href: str) -> str:
+    """
+    turn an asset href into a path GDAL can open remotely
+
+    Args:
+        href (str): s3:// uri, http(s) url or local path
+
+    Returns:
+        str: `/vsis3/...` or `/vsicurl/...` path, local paths are returned as is
+    """
+    parsed = urlparse(href)
+    if parsed.scheme == 's3':
+        return f'/vsis3/{parsed.netloc}{parsed.path}'
+    if parsed.scheme in ('http', 'https'):
+        return f'/vsicurl/{href}'
+    return href
+
+
+def remote_env(region: str = None) -> rio.Env:
+    """
+    rasterio environment configured for remote COG reads
+
+    Args:
+        region (str): aws region for /vsis3 reads
+
+    Returns:
+        rio.Env: environment to open remote datasets in
+    """
+    options = dict(REMOTE_GDAL_OPTIONS)
+    if region is not None:
+        options['AWS_REGION'] = region
+    return rio.Env(**options)
+
+
+def read_aoi_window(href: str, coords: List[tuple], out_path: str, region: str = None) -> str:
+    """
+    open an asset remotely as a Cloud-Optimized GeoTIFF and only read the internal
+    tiles that intersect the AOI.  The window is written to a small local GeoTIFF
+    so the rest of the pipeline can treat it like a downloaded file
+
+    Args:
+        href (str): asset href, s3:// or http(s)
+        coords (List[tuple]): AOI coordinates in epsg:4326
+        out_path (str): where to write the clipped window
+        region (str): aws region for s3 hosted assets
+
+    Returns:
+        str: out_path
+
+    Raises:
+        ValueError: if the AOI does not intersect the asset
+    """
+    with remote_env(region):
+        with rio.open(to_vsi_path(href)) as src:
+            aoi = coords_to_polygon(coords, out_crs=src.crs.to_wkt(), in_crs='epsg:4326')
+            try:
+                window = geometry_window(src, [mapping(aoi)])
+            except WindowError as e:
+                raise ValueError(f'AOI does not intersect {href}') from e
+            data = src.read(window=window)
+
+            profile = src.profile.copy()
+            for key in ('blockxsize', 'blockysize', 'tiled'):
+                profile.pop(key, None)
+            profile.update(
+                driver='GTiff',
+                height=data.shape[-2],
+                width=data.shape[-1],
+                transform=src.window_transform(window),
+                compress='deflate'
+            )
+
+    # write next to the target and move into place so readers never see half a file
+    partial_path = out_path + PARTIAL_SUFFIX
+    with rio.open(partial_path, 'w', **profile) as dst:
+        dst.write(data)
+    os.replace(partial_path, out_path)
+
+    return out_path
@@ -0,0 +1,230 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import os
+import threading
+import time
+
+import boto3
+from botocore import UNSIGNED
+from botocore.client import Config
+from botocore.exceptions import ClientError
+import urllib3
+
+MAX_WORKERS = 8
+CHUNK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = '.part'
+
+
+@dataclass
+class DownloadJob:
+    """
+    single file to fetch.  `href` is either an http(s) url or an s3:// uri.
+    `validator` is the ETag or Last-Modified value when already known, it guards
+    resumed downloads against the object changing in between
+    """
+    href: str
+    file_path: str
+    region: Optional[str] = None
+    validator: Optional[str] = None
+
+
+@dataclass
+class DownloadResult:
+    """
+    outcome of a single download with throughput numbers for reporting
+    """
+    href: str
+    file_path: str
+    bytes_transferred: int
+    seconds: float
+    resumed_from: int = 0
+
+    @property
+    def throughput_mbps(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return (self.bytes_transferred / (1024 * 1024)) / self.seconds
+
+
+def split_s3_href(href: str) -> Tuple[str, str]:
+    """
+    split an s3:// uri into bucket and key
+
+    Args:
+        href (str): uri like `s3://bucket/path/to/file.tif`
+
+    Returns:
+        Tuple[str, str]: bucket and key
+    """
+    parsed = urlparse(href)
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+class DownloadEngine:
+    """
+    concurrent downloader for http and s3 assets.  Keeps one s3 client per region
+    and one http connection pool per host, and resumes partially written files
+    with byte range requests instead of starting over.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, chunk_size: int = CHUNK_SIZE):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        # PoolManager keeps a connection pool per host, sized for our workers
+        self._http = urllib3.PoolManager(maxsize=max_workers)
+        self._s3_clients: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def s3_client(self, region: str):
+        """
+        get the shared unsigned s3 client for a region, creating it once.
+        boto3 clients are thread safe so workers can share them
+
+        Args:
+            region (str): aws region of the bucket
+
+        Returns:
+            botocore client for s3
+        """
+        with self._lock:
+            client = self._s3_clients.get(region)
+            if client is None:
+                client = boto3.client(
+                    's3',
+                    region_name=region,
+                    config=Config(signature_version=UNSIGNED, max_pool_connections=self.max_workers)
+                )
+                self._s3_clients[region] = client
+        return client
+
+    def validator(self, job: DownloadJob) -> Optional[str]:
+        """
+        ask the server for the ETag (or Last-Modified when there is no ETag)
+        of an asset without downloading it
+
+        Args:
+            job (DownloadJob): file to check
+
+        Returns:
+            Optional[str]: validator string, None if the server sends neither
+        """
+        if job.href.startswith('s3'):
+            bucket, key = split_s3_href(job.href)
+            head = self.s3_client(job.region).head_object(Bucket=bucket, Key=key)
+            return head.get('ETag') or str(head.get('LastModified') or '') or None
+        response = self._http.request('HEAD', job.href)
+        return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+    def validators(self, jobs: List[DownloadJob]) -> List[Optional[str]]:
+        """
+        fetch validators for many jobs concurrently
+
+        Returns:
+            List[Optional[str]]: validators in the same order as jobs
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self.validator, jobs))
+
+    def fetch(self, job: DownloadJob) -> DownloadResult:
+        """
+        download a single file.  Data is streamed into `<file_path>.part` and moved
+        into place once complete, so an interrupted run picks up where it stopped
+
+        Args:
+            job (DownloadJob): file to download
+
+        Returns:
+            DownloadResult: bytes transferred and time taken
+        """
+        partial_path = job.file_path + PARTIAL_SUFFIX
+        offset = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+
+        start = time.perf_counter()
+        if job.href.startswith('s3'):
+            written, offset = self._fetch_s3(job, partial_path, offset)
+        else:
+            written, offset = self._fetch_http(job, partial_path, offset)
+        elapsed = time.perf_counter() - start
+
+        os.replace(partial_path, job.file_path)
+        return DownloadResult(
+            href=job.href,
+            file_path=job.file_path,
+            bytes_transferred=written,
+            seconds=elapsed,
+            resumed_from=offset
+        )
+
+    def _fetch_http(self, job: DownloadJob, partial_path: str, offset: int) -> Tuple[int, int]:
+        if offset and job.validator is None:
+            # nothing to prove the partial file is from the same object, start over
+            offset = 0
+        headers = {'Range': f'bytes={offset}-', 'If-Range': job.validator} if offset else {}
+        response = self._http.request('GET', job.href, headers=headers, preload_content=False)
+        try:
+            if response.status == 416 and offset:
+                # validator still matches and the partial file holds the whole object
+                return 0, offset
+            if response.status not in (200, 206):
+                raise IOError(f'download of {job.href} failed with status {response.status}')
+            if response.status == 206 and not response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                raise IOError(f'download of {job.href} returned an unexpected range')
+            if response.status == 200:
+                # object changed (If-Range failed) or the server ignored the range, start over
+                offset = 0
+            mode = 'ab' if offset else 'wb'
+            return self._stream(response.stream(self.chunk_size), partial_path, mode), offset
+        finally:
+            response.release_conn()
+
+    def _fetch_s3(self, job: DownloadJob, partial_path: str, offset: int) -> Tuple[int, int]:
+        bucket, key = split_s3_href(job.href)
+        client = self.s3_client(job.region)
+        if offset and job.validator is None:
+            # one head request for the ETag, needed to resume safely
+            job.validator = client.head_object(Bucket=bucket, Key=key).get('ETag')
+        if not offset or job.validator is None:
+            body = client.get_object(Bucket=bucket, Key=key)['Body']
+            return self._stream(body.iter_chunks(self.chunk_size), partial_path, 'wb'), 0
+
+        try:
+            # If-Match makes s3 refuse the range when the object changed since the first bytes
+            body = client.get_object(Bucket=bucket, Key=key, Range=f'bytes={offset}-', IfMatch=job.validator)['Body']
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code == 'InvalidRange':
+                # partial file already holds the whole object
+                return 0, offset
+            if code not in ('PreconditionFailed', '412'):
+                raise
+            body = client.get_object(Bucket=bucket, Key=key)['Body']
+            return self._stream(body.iter_chunks(self.chunk_size), partial_path, 'wb'), 0
+        return self._stream(body.iter_chunks(self.chunk_size), partial_path, 'ab'), offset
+
+    def _stream(self, chunks, partial_path: str, mode: str) -> int:
+        written = 0
+        with open(partial_path, mode) as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def run(self, jobs: List[DownloadJob]) -> List[DownloadResult]:
+        """
+        download all jobs at the same time on a bounded thread pool.  Per file
+        throughput is on each result's `throughput_mbps`
+
+        Args:
+            jobs (List[DownloadJob]): files to fetch
+
+        Returns:
+            List[DownloadResult]: results in the same order as jobs
+        """
+        results: List[Optional[DownloadResult]] = [None] * len(jobs)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch, job): i for i, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        return results
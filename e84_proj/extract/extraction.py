@@ -1,25 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 import os
 
-import boto3
-from botocore import UNSIGNED
-from botocore.client import Config
-import urllib.request
-
-from e84_proj.extract.stac_client.client import StacClient
+from e84_proj.extract.cache import AssetCache
+from e84_proj.extract.cog import read_aoi_window
+from e84_proj.extract.downloader import DownloadEngine, DownloadJob
 
 DOWNLOAD_FOLDER = "/home/treuter/repos/geo_py/e84_proj/data/"
+# the asset cache gets its own folder so eviction never sees analysis outputs
+CACHE_FOLDER = 'asset_cache'
 CHIRPS_REGION = 'af-south-1'
+# `download` pulls whole files, `window` reads only the AOI window of remote COGs
+EXTRACTION_MODES = ('download', 'window')
 
 class Extract:
     """
     class for handling extraction and clean up 
     """
 
-    def __init__(self, coords: List[tuple], path=DOWNLOAD_FOLDER, chirps_region: str= CHIRPS_REGION):
+    def __init__(
+            self,
+            coords: List[tuple],
+            path=DOWNLOAD_FOLDER,
+            chirps_region: str= CHIRPS_REGION,
+            engine: DownloadEngine=None,
+            mode: str='download',
+            cache: AssetCache=None
+    ):
+        if mode not in EXTRACTION_MODES:
+            raise ValueError(f'mode must be one of {EXTRACTION_MODES}, got {mode}')
         self.coords = coords
         self.path = path
         self.chirps_region = chirps_region
+        self.engine = engine if engine is not None else DownloadEngine()
+        self.mode = mode
+        self.cache = cache if cache is not None else AssetCache(os.path.join(path, CACHE_FOLDER))
 
 
     def input_transformer(self, path: str) -> List[tuple]:
@@ -46,10 +61,9 @@ class Extract:
     ) -> str:
         """
         downloader to either download directly from url or if stored in s3 bucket
-        use boto3 to download a file and store to local machine
+        use boto3 to download a file and store to local machine.  Goes through the
+        shared download engine so s3 clients and http connections are reused
 
-        LOCAL STORAGE IS INEFFICENT.  MORE TIME would have more efficient process   
-        
         Args:
             bucket (str): name of s3 bucket
             region (str): region of s3 bucket
@@ -60,20 +74,47 @@ class Extract:
         Returns:
             file_path (str): file path to where downloaded files are stored.
         """
-        if bucket is None:
-            urllib.request.urlretrieve(url, file_path)
-        else:
-            s3 = boto3.client('s3', region_name=region, config=Config(signature_version=UNSIGNED))
-            s3.download_file(Bucket=bucket, Key=key, Filename=file_path)
-            # arn = 's3://deafrica-input-datasets/rainfall_chirps_monthly/chirps-v2.0_2022.06.tif'
-            # s3 = boto3.client('s3', region_name='af-south-1', config=Config(signature_version=UNSIGNED))
-            # s3.download_file(Bucket='deafrica-input-datasets', Key='rainfall_chirps_monthly/chirps-v2.0_2022.06.tif', Filename=file_path)
-        
+        href = url if bucket is None else f's3://{bucket}/{key}'
+        self.engine.fetch(DownloadJob(href=href, file_path=file_path, region=region))
+
         return file_path
-    
+
+    def plan_downloads(self, links: dict) -> List[tuple]:
+        """
+        work out where every link in `links` should be stored locally.  Files are
+        placed in the asset cache under a name derived from the href and its
+        ETag/Last-Modified, plus the AOI for windowed reads
+
+        Args:
+            links (dict): dict containing file links to parse for download
+
+        Returns:
+            List[tuple]: (key, sub_key, DownloadJob) for every link, sub_key is None
+                for un-nested links like worldpop
+        """
+        planned = []
+        for key in links.keys():
+            if isinstance(links.get(key), dict):
+                for sub_key in links.get(key).keys():
+                    url_path: str = links.get(key).get(sub_key)
+                    region = self.chirps_region if url_path.startswith('s3') else None
+                    planned.append((key, sub_key, DownloadJob(href=url_path, file_path='', region=region)))
+            else:
+                planned.append((key, None, DownloadJob(href=links.get(key), file_path='')))
+
+        jobs = [job for _, _, job in planned]
+        variant = str(self.coords) if self.mode == 'window' else None
+        for job, validator in zip(jobs, self.engine.validators(jobs)):
+            job.validator = validator
+            job.file_path = self.cache.path_for(job.href, validator, variant)
+
+        return planned
+
     def execute_downloads(self, links: dict) -> dict:
         """
         take in file paths and execute downloads of files to local machine.
+        All missing files are downloaded at the same time.  In `window` mode only
+        the part of each remote COG that covers the AOI is read
 
         Args:
             links (dict): dict containing file links to parse for download
@@ -93,31 +134,73 @@ class Extract:
             "worldpop": ""
         }
 
-        for key in links.keys():
-            if isinstance(links.get(key), dict):
-                for sub_key in links.get(key).keys():
-                    url_path: str = links.get(key).get(sub_key)
-                    if url_path.startswith('s3'):
-                        bucket = url_path.split("://")[1].split("/")[0]
-                        split = url_path.split("://")[1].split("/")
-                        s3_key = split[1] + '/' + split[2]
-                        file_path = self.path + sub_key + '_rainfall.tif'
-                        if not os.path.isfile(file_path):
-                            out_path = self.download_file(bucket=bucket, key=s3_key, file_path=file_path, region=self.chirps_region)
-                        outputs[key][sub_key] = file_path
-                    else:
-                        file_path = self.path + sub_key + "_lulc.tif"
-                        if not os.path.isfile(file_path):
-                            out_path = self.download_file(url=url_path, file_path=file_path)
-                        outputs[key][sub_key] = file_path
+        planned = self.plan_downloads(links)
+        jobs = [job for _, _, job in planned]
+        missing = [job for job in jobs if self.cache.get(job.file_path) is None]
+        if self.mode == 'window':
+            self.read_windows(missing)
+        else:
+            results = list(self.engine.run(missing) or [])
+            for result in results:
+                print(f'{result.href}: {result.bytes_transferred / (1024 * 1024):.1f} MB '
+                      f'at {result.throughput_mbps:.2f} MB/s')
+            if results:
+                megabytes = sum(result.bytes_transferred for result in results) / (1024 * 1024)
+                print(f'downloaded {len(results)} files, {megabytes:.1f} MB')
+        self.cache.evict(keep=[job.file_path for job in jobs])
+        print(f'asset cache: {self.cache.stats}')
+
+        for key, sub_key, job in planned:
+            if sub_key is None:
+                outputs[key] = job.file_path
             else:
-                file_path = self.path + 'pop.tif'
-                if not os.path.isfile(file_path):
-                    out_path = self.download_file(url=links.get(key), file_path=self.path+'pop.tif')
-                outputs['worldpop'] = file_path
+                outputs[key][sub_key] = job.file_path
         
         return outputs
 
+    def fetch_asset(self, href: str, region: str = None) -> str:
+        """
+        fetch a single asset through the cache, downloading it (or its AOI
+        window in `window` mode) only on a miss
+
+        Args:
+            href (str): asset href
+            region (str): aws region for s3 hrefs, defaults to the chirps region
+
+        Returns:
+            str: local path of the asset
+        """
+        if region is None and href.startswith('s3'):
+            region = self.chirps_region
+        job = DownloadJob(href=href, file_path='', region=region)
+        variant = str(self.coords) if self.mode == 'window' else None
+        job.validator = self.engine.validator(job)
+        job.file_path = self.cache.path_for(href, job.validator, variant)
+        if self.cache.get(job.file_path) is None:
+            if self.mode == 'window':
+                read_aoi_window(href, self.coords, job.file_path, region)
+            else:
+                self.engine.fetch(job)
+        return job.file_path
+
+    def read_windows(self, jobs: List[DownloadJob]) -> List[str]:
+        """
+        read the AOI window of every job's remote COG concurrently instead
+        of downloading whole files
+
+        Args:
+            jobs (List[DownloadJob]): assets to read
+
+        Returns:
+            List[str]: paths of the written windows
+        """
+        with ThreadPoolExecutor(max_workers=self.engine.max_workers) as pool:
+            futures = [
+                pool.submit(read_aoi_window, job.href, self.coords, job.file_path, job.region)
+                for job in jobs
+            ]
+            return [future.result() for future in futures]
+
     def cleanup(self, path: str):
         """
         clean up post download and processing
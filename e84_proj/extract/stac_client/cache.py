@@ -0,0 +1,118 @@
+from contextlib import closing
+from typing import List, Optional, Tuple
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from shapely import wkt
+from shapely.geometry.base import BaseGeometry
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+GEOMETRY_PRECISION = 7
+
+
+class SearchCache:
+    """
+    on disk SQLite cache of STAC search results.  Entries are keyed by endpoint,
+    collection, normalized geometry and datetime, and expire after `ttl` seconds.
+    With `stale_while_revalidate` an expired entry is still served while the
+    caller refreshes it in the background.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL_SECONDS, stale_while_revalidate: bool = False):
+        """
+        Args:
+            path (str): sqlite database file
+            ttl (float): seconds an entry stays fresh
+            stale_while_revalidate (bool): serve expired entries while refreshing them
+        """
+        self.path = path
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS searches ('
+                'key TEXT PRIMARY KEY, payload TEXT NOT NULL, created REAL NOT NULL)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call keeps background revalidation threads safe
+        return sqlite3.connect(self.path, timeout=30)
+
+    def key(
+            self,
+            endpoint: str,
+            collection: str,
+            geometry: BaseGeometry,
+            datetime: str,
+            options: dict = None
+    ) -> str:
+        """
+        build the cache key for a search.  Geometry is normalized and rounded so the
+        same AOI written with a different vertex order or float noise shares an entry
+
+        Args:
+            options (dict): any other search options that change the result
+
+        Returns:
+            str: hex digest
+        """
+        geom = wkt.dumps(geometry.normalize(), rounding_precision=GEOMETRY_PRECISION, trim=True)
+        raw = json.dumps([endpoint, collection, geom, datetime, options or {}], sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Tuple[Optional[List[str]], bool]:
+        """
+        look up a search result
+
+        Args:
+            key (str): key from `key`
+
+        Returns:
+            Tuple[Optional[List[str]], bool]: cached hrefs (None on a miss) and
+                whether the entry is still fresh
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT payload, created FROM searches WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, False
+        payload, created = row
+        return json.loads(payload), (time.time() - created) < self.ttl
+
+    def set(self, key: str, hrefs: List[str]):
+        """
+        store a search result
+
+        Args:
+            key (str): key from `key`
+            hrefs (List[str]): search result to store
+        """
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO searches (key, payload, created) VALUES (?, ?, ?)',
+                (key, json.dumps(hrefs), time.time())
+            )
+
+    def begin_revalidation(self, key: str) -> bool:
+        """
+        claim a key for a background refresh
+
+        Returns:
+            bool: False when a refresh of the key is already running
+        """
+        with self._lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            return True
+
+    def end_revalidation(self, key: str):
+        """
+        release a key claimed with `begin_revalidation`
+        """
+        with self._lock:
+            self._revalidating.discard(key)
@@ -1,55 +1,380 @@
-from typing import List
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+import math
+import threading
+
 from pystac_client import Client, ItemSearch
-from shapely.geometry import Polygon
+import shapely
+from shapely.geometry import Polygon, shape
+from shapely.geometry.base import BaseGeometry
 from pystac import Item
 
+from e84_proj.extract.stac_client.cache import SearchCache
+from e84_proj.extract.stac_client.footprints import FootprintStore, to_timestamp
+from e84_proj.spatial_index import SpatialIndex
+
+# AOIs whose centroids share a tile of this many degrees are searched together
+BATCH_TILE_DEGREES = 5.0
+BATCH_MAX_WORKERS = 4
+# length of the timestamp prefix that identifies a time step
+TIME_STEPS = {'day': 10, 'month': 7, 'year': 4}
+
+_CLIENTS: Dict[str, Client] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def open_client(endpoint: str) -> Client:
+    """
+    open a STAC client for an endpoint once and hand the same client back on
+    later calls, so the root catalog is only fetched once per process
+
+    Args:
+        endpoint (str): STAC catalog endpoint
+
+    Returns:
+        Client: client connected to the endpoint
+    """
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(endpoint)
+        if client is None:
+            client = Client.open(endpoint)
+            _CLIENTS[endpoint] = client
+    return client
+
+
+def clear_client_cache():
+    """
+    forget all memoized clients
+    """
+    with _CLIENTS_LOCK:
+        _CLIENTS.clear()
+
+
+def group_time_steps(
+        records: List[Tuple[str, BaseGeometry, List[str]]],
+        aoi: Polygon,
+        step: str = 'day'
+) -> List[Tuple[str, List[str]]]:
+    """
+    group items into time steps.  Within a step an item is dropped when the
+    items already kept cover its part of the AOI, which removes duplicate and
+    reprocessed copies but keeps neighbouring tiles
+
+    Args:
+        records (List[Tuple[str, BaseGeometry, List[str]]]): (timestamp, footprint, hrefs) per item
+        aoi (Polygon): search AOI
+        step (str): 'day', 'month' or 'year'
+
+    Returns:
+        List[Tuple[str, List[str]]]: (time step, hrefs) sorted by time
+    """
+    groups = defaultdict(list)
+    for timestamp, footprint, hrefs in sorted(records, key=lambda record: record[0]):
+        groups[timestamp[:TIME_STEPS[step]]].append((footprint, hrefs))
+
+    steps = []
+    for key in sorted(groups):
+        covered = None
+        hrefs = []
+        for footprint, item_hrefs in groups[key]:
+            part = footprint.intersection(aoi)
+            if part.is_empty or (covered is not None and covered.covers(part)):
+                continue
+            covered = part if covered is None else covered.union(part)
+            hrefs.extend(href for href in item_hrefs if href not in hrefs)
+        if hrefs:
+            steps.append((key, hrefs))
+    return steps
+
+
 class StacClient:
     """
     client used to create STAC connections, search STAC API, and create lists 
     of hrefs to assets that are desired to be downloaded
     """
-    def __init__(self, catalog_endpoint: str, collection: str):
+    def __init__(
+            self,
+            catalog_endpoint: str,
+            collection: str,
+            search_cache: SearchCache = None,
+            footprints: FootprintStore = None
+    ):
         """_summary_
 
         Args:
             catalog_endpoint (str): STAC catalog endpoint
             collection (str): collection string for search
+            search_cache (SearchCache): optional on disk cache of search results
+            footprints (FootprintStore): optional local copy of the collection's
+                items, searches are answered from it once the collection is synced
         """
         self.endpoint = catalog_endpoint
         self.collection = collection
+        self.search_cache = search_cache
+        self.footprints = footprints
 
     def connection_factory(self) -> Client:
         """
-        factory to create client connected to stac catalog endpoint
+        factory to create client connected to stac catalog endpoint.
+        Clients are memoized per endpoint
 
         Returns:
             Client: client connected to target catalog
         """
-        print('hold')
-        catalog = Client.open(self.endpoint)
+        catalog = open_client(self.endpoint)
         return catalog
 
-    def aoi_search(self, client: Client, aoi: Polygon, date='str') -> List[Item]:
+    def sync_footprints(self, by: str = 'datetime', full: bool = False) -> int:
+        """
+        copy the collection's item metadata into the footprint store, only items
+        newer than the last sync are fetched
+
+        Args:
+            by (str): refresh by item 'datetime' or 'updated' time
+            full (bool): pull the whole collection again
+
+        Returns:
+            int: number of items written
         """
-        search stac API for items in AOI
+        if self.footprints is None:
+            raise ValueError('no footprint store set on this client')
+        return self.footprints.sync(self.connection_factory(), self.endpoint, self.collection, by, full)
+
+    def _local(self) -> bool:
+        return self.footprints is not None and self.footprints.is_synced(self.endpoint, self.collection)
+
+    def aoi_search(
+            self,
+            client: Client,
+            aoi: Polygon,
+            date='str',
+            max_items: int = None,
+            asset_keys: List[str] = None,
+            media_type: str = None
+    ) -> List[Item]:
+        """
+        search stac API for items in AOI.  A synced footprint store answers the
+        search locally.  Otherwise, when a search cache is set, fresh cached
+        results are returned without touching the API
 
         Args:
             client (Client): STAC client
             aoi (Polygon): shapely polygon for search
             date: string date like '2015-01-03' for date search too
+            max_items (int): stop paging once this many items have been seen
+            asset_keys (List[str]): only return hrefs for these asset keys
+            media_type (str): only return hrefs of assets with this media type
 
         Returns:
             List[Item]: List of items from the collection that are in the AOI
         """
+        options = {'max_items': max_items, 'asset_keys': asset_keys, 'media_type': media_type}
+        if self._local():
+            return self.footprints.search(self.endpoint, self.collection, aoi, date, **options)
+        if self.search_cache is None:
+            return self._search(client, aoi, date, options)
+
+        key = self.search_cache.key(self.endpoint, self.collection, aoi, date, options)
+        cached, fresh = self.search_cache.get(key)
+        if cached is not None and fresh:
+            return cached
+        if cached is not None and self.search_cache.stale_while_revalidate:
+            # a hot key gets one refresh at a time, not one per stale read
+            if self.search_cache.begin_revalidation(key):
+                threading.Thread(
+                    target=self._revalidate_in_background, args=(client, aoi, date, options, key), daemon=True
+                ).start()
+            return cached
+
+        return self._revalidate(client, aoi, date, options, key)
+
+    def _search(self, client: Client, aoi: Polygon, date: str, options: dict) -> List[str]:
         search = client.search(
             collections=self.collection,
             intersects=aoi,
-            datetime=date
+            datetime=date,
+            max_items=options.get('max_items')
         )
-        items = self.generate_itmes(search)
+        items = list(self.iter_hrefs(search, **options))
       
         return items
 
+    def _revalidate(self, client: Client, aoi: Polygon, date: str, options: dict, key: str) -> List[str]:
+        items = self._search(client, aoi, date, options)
+        self.search_cache.set(key, items)
+        return items
+
+    def _revalidate_in_background(self, client: Client, aoi: Polygon, date: str, options: dict, key: str):
+        try:
+            self._revalidate(client, aoi, date, options, key)
+        finally:
+            self.search_cache.end_revalidation(key)
+
+    def batch_search(
+            self,
+            client: Client,
+            aois: List[Polygon],
+            dates: List[str],
+            tile_degrees: float = BATCH_TILE_DEGREES,
+            max_workers: int = BATCH_MAX_WORKERS
+    ) -> Dict[Tuple[int, str], List[str]]:
+        """
+        search for many AOIs and dates with a small number of requests.  AOIs are
+        grouped by the tile their centroid falls in, each group is searched once
+        per date with the group's bounding box, and the returned items are matched
+        back to the individual AOIs locally with a spatial index of item footprints
+
+        Args:
+            client (Client): STAC client
+            aois (List[Polygon]): shapely polygons in epsg:4326
+            dates (List[str]): dates like '2015-01-03'
+            tile_degrees (float): size of the grouping tiles in degrees
+            max_workers (int): number of searches to run at the same time
+
+        Returns:
+            Dict[Tuple[int, str], List[str]]: hrefs keyed by (index into aois, date)
+        """
+        if self._local():
+            return {
+                (i, date): self.footprints.search(self.endpoint, self.collection, aoi, date)
+                for i, aoi in enumerate(aois) for date in dates
+            }
+
+        groups = defaultdict(list)
+        for i, aoi in enumerate(aois):
+            centroid = aoi.centroid
+            tile = (math.floor(centroid.x / tile_degrees), math.floor(centroid.y / tile_degrees))
+            groups[tile].append(i)
+
+        jobs = [(members, date) for members in groups.values() for date in dates]
+
+        def run(job):
+            members, date = job
+            bbox = shapely.total_bounds([aois[i] for i in members])
+            search = client.search(collections=self.collection, bbox=list(bbox), datetime=date)
+            return list(search.items())
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(run, jobs))
+
+        matches = {(i, date): [] for i in range(len(aois)) for date in dates}
+        for (members, date), items in zip(jobs, results):
+            items = [item for item in items if item.geometry is not None]
+            if not items:
+                continue
+            index = SpatialIndex([shape(item.geometry) for item in items])
+            aoi_idx, item_idx = index.query([aois[i] for i in members])
+            for a, it in zip(aoi_idx, item_idx):
+                matches[(members[a], date)].extend(self.item_hrefs(items[it]))
+
+        return matches
+
+    def time_series(
+            self,
+            client: Client,
+            aoi: Polygon,
+            datetime_range: str,
+            step: str = 'day',
+            asset_keys: List[str] = None,
+            media_type: str = None
+    ) -> List[Tuple[str, List[str]]]:
+        """
+        one search over a datetime range, returned as time steps.  Replaces a
+        separate `aoi_search` per date
+
+        Args:
+            client (Client): STAC client
+            aoi (Polygon): shapely polygon for search
+            datetime_range (str): STAC datetime range like '2003-01/2023-12'
+            step (str): group items by 'day', 'month' or 'year'
+            asset_keys (List[str]): only return hrefs for these asset keys
+            media_type (str): only return hrefs of assets with this media type
+
+        Returns:
+            List[Tuple[str, List[str]]]: (time step, hrefs) sorted by time, see
+                `group_time_steps` for how overlapping items are deduplicated
+        """
+        if step not in TIME_STEPS:
+            raise ValueError(f'step must be one of {list(TIME_STEPS)}, got {step}')
+        if self._local():
+            records = [
+                (item['datetime'], item['geometry'], [
+                    asset['href'] for asset in item['assets']
+                    if (asset_keys is None or asset['key'] in asset_keys)
+                    and (media_type is None or asset['type'] == media_type)
+                ])
+                for item in self.footprints.search_items(self.endpoint, self.collection, aoi, datetime_range)
+            ]
+        else:
+            search = client.search(collections=self.collection, intersects=aoi, datetime=datetime_range)
+            records = [
+                (
+                    to_timestamp(item.datetime or item.common_metadata.start_datetime),
+                    shape(item.geometry),
+                    self.item_hrefs(item, asset_keys, media_type)
+                )
+                for item in search.items() if item.geometry is not None
+            ]
+        return group_time_steps(records, aoi, step)
+
+    def item_hrefs(self, item: Item, asset_keys: List[str] = None, media_type: str = None) -> List[str]:
+        """
+        hrefs of the assets on an item
+
+        Args:
+            item (Item): STAC item
+            asset_keys (List[str]): only keep these asset keys, all when None
+            media_type (str): only keep assets with this media type, all when None
+
+        Returns:
+            List[str]: asset hrefs
+        """
+        return [
+            asset.href for key, asset in item.assets.items()
+            if (asset_keys is None or key in asset_keys)
+            and (media_type is None or asset.media_type == media_type)
+        ]
+
+    def iter_items(self, search: ItemSearch, max_items: int = None) -> Iterator[Item]:
+        """
+        yield items as their result pages arrive.  Pages are only requested as the
+        caller consumes items, so breaking out of the loop stops paging
+
+        Args:
+            search (ItemSearch): search results
+            max_items (int): stop after this many items
+
+        Yields:
+            Item: matching items
+        """
+        for count, item in enumerate(search.items(), start=1):
+            yield item
+            if max_items is not None and count >= max_items:
+                return
+
+    def iter_hrefs(
+            self,
+            search: ItemSearch,
+            max_items: int = None,
+            asset_keys: List[str] = None,
+            media_type: str = None
+    ) -> Iterator[str]:
+        """
+        streaming version of `generate_itmes`, yields hrefs as pages arrive
+
+        Args:
+            search (ItemSearch): search results
+            max_items (int): stop after this many items
+            asset_keys (List[str]): only yield these asset keys
+            media_type (str): only yield assets with this media type
+
+        Yields:
+            str: asset hrefs
+        """
+        for item in self.iter_items(search, max_items):
+            yield from self.item_hrefs(item, asset_keys, media_type)
+
     def generate_itmes(self, search: ItemSearch) -> List[str]:
         """
         take search results and generate href links for download
@@ -60,13 +385,5 @@ class StacClient:
         Returns:
             List[str]: list of hrefs of items that were found as matches
         """
-
-        item_links = []
-        for item in search.items():
-            # TODO: what if search results are empty?
-            for key in item.assets.keys():
-                # could be multiple keys, only have one for now
-                link = item.assets[key].href
-                item_links.append(link)
-
-        return item_links
+        # TODO: what if search results are empty?
+        return list(self.iter_hrefs(search))
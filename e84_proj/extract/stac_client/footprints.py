@@ -0,0 +1,293 @@
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+import calendar
+import json
+import sqlite3
+import threading
+import time
+
+from pystac_client import Client
+import shapely
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+
+SYNC_BATCH_SIZE = 500
+# fixed width UTC timestamps compare correctly as text
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+REFRESH_FIELDS = ('datetime', 'updated')
+
+
+def to_timestamp(value: datetime) -> str:
+    """
+    fixed width UTC timestamp, naive datetimes are taken as UTC
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _parse_bound(value: str, end: bool) -> Optional[str]:
+    """
+    one side of a STAC datetime.  Partial dates cover the whole year, month or
+    day like they do in pystac_client searches
+    """
+    if value in ('', '..'):
+        return None
+    if len(value) == 4:
+        year = int(value)
+        bound = datetime(year, 12, 31, 23, 59, 59, 999999) if end else datetime(year, 1, 1)
+    elif len(value) == 7:
+        year, month = int(value[:4]), int(value[5:7])
+        last_day = calendar.monthrange(year, month)[1]
+        bound = datetime(year, month, last_day, 23, 59, 59, 999999) if end else datetime(year, month, 1)
+    elif len(value) == 10:
+        day = datetime.strptime(value, '%Y-%m-%d')
+        bound = day.replace(hour=23, minute=59, second=59, microsecond=999999) if end else day
+    else:
+        bound = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return to_timestamp(bound)
+
+
+def datetime_range(value: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    (start, end) timestamps for a STAC datetime like '2022', '2022-06-15',
+    '2022-01-01/2022-06-30' or '../2022-06-30'.  Open ends are None
+    """
+    if value is None:
+        return None, None
+    if '/' in value:
+        start, end = value.split('/', 1)
+        return _parse_bound(start, end=False), _parse_bound(end, end=True)
+    return _parse_bound(value, end=False), _parse_bound(value, end=True)
+
+
+def _item_times(item: dict) -> Tuple[str, str]:
+    properties = item['properties']
+    start = properties.get('start_datetime') or properties['datetime']
+    end = properties.get('end_datetime') or properties['datetime']
+    return _parse_bound(start, end=False), _parse_bound(end, end=True)
+
+
+class FootprintStore:
+    """
+    local SQLite copy of a collection's item metadata: id, time range, footprint
+    and asset hrefs, with an R-tree over footprint bounding boxes.  Once a
+    collection is synced, spatial and temporal searches are answered from disk
+    without calling the STAC API, and later syncs only pull items newer than the
+    last one seen
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): sqlite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS items ('
+                'rowid INTEGER PRIMARY KEY, endpoint TEXT NOT NULL, collection TEXT NOT NULL, '
+                'item_id TEXT NOT NULL, start_datetime TEXT NOT NULL, end_datetime TEXT NOT NULL, '
+                'updated TEXT, geometry BLOB NOT NULL, assets TEXT NOT NULL, '
+                'UNIQUE (endpoint, collection, item_id))'
+            )
+            conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS items_rtree USING rtree(id, xmin, xmax, ymin, ymax)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sync_state ('
+                'endpoint TEXT NOT NULL, collection TEXT NOT NULL, last_datetime TEXT, last_updated TEXT, '
+                'synced REAL NOT NULL, PRIMARY KEY (endpoint, collection))'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def is_synced(self, endpoint: str, collection: str) -> bool:
+        """
+        whether a collection has been synced at least once
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT 1 FROM sync_state WHERE endpoint = ? AND collection = ?', (endpoint, collection)
+            ).fetchone()
+        return row is not None
+
+    def _upsert(self, conn: sqlite3.Connection, endpoint: str, collection: str, item: dict):
+        geometry = shape(item['geometry'])
+        start, end = _item_times(item)
+        updated = item['properties'].get('updated')
+        updated = updated and _parse_bound(updated, end=False)
+        assets = [
+            {'key': key, 'href': asset['href'], 'type': asset.get('type')}
+            for key, asset in item.get('assets', {}).items()
+        ]
+        row = conn.execute(
+            'SELECT rowid FROM items WHERE endpoint = ? AND collection = ? AND item_id = ?',
+            (endpoint, collection, item['id'])
+        ).fetchone()
+        if row is not None:
+            conn.execute('DELETE FROM items WHERE rowid = ?', row)
+            conn.execute('DELETE FROM items_rtree WHERE id = ?', row)
+        rowid = conn.execute(
+            'INSERT INTO items (endpoint, collection, item_id, start_datetime, end_datetime, updated, geometry, assets) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (endpoint, collection, item['id'], start, end, updated,
+             shapely.to_wkb(geometry), json.dumps(assets))
+        ).lastrowid
+        xmin, ymin, xmax, ymax = geometry.bounds
+        conn.execute('INSERT INTO items_rtree VALUES (?, ?, ?, ?, ?)', (rowid, xmin, xmax, ymin, ymax))
+        return end, updated
+
+    def sync(
+            self,
+            client: Client,
+            endpoint: str,
+            collection: str,
+            by: str = 'datetime',
+            full: bool = False
+    ) -> int:
+        """
+        pull item metadata from the STAC API.  The first sync (or `full`) pulls the
+        whole collection, later syncs only ask for items at or after the latest
+        datetime or updated time already stored.  Items are upserted, so the
+        overlap at the boundary is harmless
+
+        Args:
+            client (Client): STAC client for endpoint
+            endpoint (str): STAC catalog endpoint, part of the store key
+            collection (str): collection id
+            by (str): refresh by item 'datetime' or 'updated' time, the latter
+                needs an API that supports CQL2 filters
+            full (bool): ignore the sync state and pull everything
+
+        Returns:
+            int: number of items written
+        """
+        if by not in REFRESH_FIELDS:
+            raise ValueError(f'by must be one of {REFRESH_FIELDS}, got {by}')
+        with closing(self._connect()) as conn:
+            state = conn.execute(
+                'SELECT last_datetime, last_updated FROM sync_state WHERE endpoint = ? AND collection = ?',
+                (endpoint, collection)
+            ).fetchone()
+        last_datetime, last_updated = state if state is not None and not full else (None, None)
+
+        search_kwargs = {'collections': collection}
+        if by == 'datetime' and last_datetime is not None:
+            search_kwargs['datetime'] = f'{last_datetime}/..'
+        elif by == 'updated' and last_updated is not None:
+            search_kwargs['filter'] = {'op': '>=', 'args': [{'property': 'updated'}, last_updated]}
+            search_kwargs['filter_lang'] = 'cql2-json'
+
+        count = 0
+        batch = []
+        with self._lock, closing(self._connect()) as conn:
+            def flush():
+                nonlocal last_datetime, last_updated
+                with conn:
+                    for item in batch:
+                        end, updated = self._upsert(conn, endpoint, collection, item)
+                        last_datetime = max(filter(None, (last_datetime, end)))
+                        if updated:
+                            last_updated = max(filter(None, (last_updated, updated)))
+                batch.clear()
+
+            for item in client.search(**search_kwargs).items_as_dicts():
+                if item.get('geometry') is None:
+                    continue
+                batch.append(item)
+                count += 1
+                if len(batch) >= SYNC_BATCH_SIZE:
+                    flush()
+            flush()
+
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO sync_state (endpoint, collection, last_datetime, last_updated, synced) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (endpoint, collection, last_datetime, last_updated, time.time())
+                )
+        return count
+
+    def search_items(
+            self,
+            endpoint: str,
+            collection: str,
+            aoi: BaseGeometry,
+            date: str = None,
+            max_items: int = None
+    ) -> List[dict]:
+        """
+        stored items intersecting an AOI and a STAC datetime.  The R-tree narrows
+        items down by bounding box, exact footprints decide the rest
+
+        Args:
+            endpoint (str): STAC catalog endpoint
+            collection (str): collection id
+            aoi (BaseGeometry): shapely geometry in epsg:4326
+            date (str): STAC datetime or range, None for any time
+            max_items (int): stop after this many items
+
+        Returns:
+            List[dict]: items in datetime order with `id`, `datetime` (start
+                timestamp), `geometry` (shapely) and `assets` (key, href, type)
+        """
+        start, end = datetime_range(date)
+        xmin, ymin, xmax, ymax = aoi.bounds
+        sql = (
+            'SELECT items.item_id, items.start_datetime, items.geometry, items.assets FROM items '
+            'JOIN items_rtree ON items_rtree.id = items.rowid '
+            'WHERE items.endpoint = ? AND items.collection = ? '
+            'AND items_rtree.xmin <= ? AND items_rtree.xmax >= ? '
+            'AND items_rtree.ymin <= ? AND items_rtree.ymax >= ?'
+        )
+        params = [endpoint, collection, xmax, xmin, ymax, ymin]
+        if end is not None:
+            sql += ' AND items.start_datetime <= ?'
+            params.append(end)
+        if start is not None:
+            sql += ' AND items.end_datetime >= ?'
+            params.append(start)
+        sql += ' ORDER BY items.start_datetime, items.item_id'
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if not rows:
+            return []
+
+        geometries = shapely.from_wkb([row[2] for row in rows])
+        hits = shapely.intersects(geometries, aoi)
+        items = [
+            {'id': row[0], 'datetime': row[1], 'geometry': geometry, 'assets': json.loads(row[3])}
+            for row, geometry, hit in zip(rows, geometries, hits) if hit
+        ]
+        return items[:max_items]
+
+    def search(
+            self,
+            endpoint: str,
+            collection: str,
+            aoi: BaseGeometry,
+            date: str = None,
+            max_items: int = None,
+            asset_keys: List[str] = None,
+            media_type: str = None
+    ) -> List[str]:
+        """
+        asset hrefs of stored items intersecting an AOI and a STAC datetime
+
+        Args:
+            asset_keys (List[str]): only return these asset keys
+            media_type (str): only return assets with this media type
+
+        Returns:
+            List[str]: asset hrefs, items in datetime order
+        """
+        return [
+            asset['href']
+            for item in self.search_items(endpoint, collection, aoi, date, max_items)
+            for asset in item['assets']
+            if (asset_keys is None or asset['key'] in asset_keys)
+            and (media_type is None or asset['type'] == media_type)
+        ]
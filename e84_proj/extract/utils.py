@@ -1,11 +1,98 @@
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List, Sequence, Tuple
 
 import geopandas as gpd
 import h3
-import pandas as pd
+from h3.api import basic_int as h3_int
+import numpy as np
 import pyproj
+import shapely
 from shapely.geometry import Polygon
-from shapely.ops import transform
+
+H3_CHUNK_SIZE = 250_000
+
+
+@lru_cache(maxsize=None)
+def _crs(crs: str) -> pyproj.CRS:
+    return pyproj.CRS.from_user_input(crs)
+
+
+@lru_cache(maxsize=128)
+def get_transformer(in_crs: str, out_crs: str, always_xy: bool = True) -> pyproj.Transformer:
+    """
+    cached transformer between two coordinate systems.  Building a transformer is
+    far more expensive than using one, so each (in_crs, out_crs, always_xy) pair
+    is only built once per process
+
+    Args:
+        in_crs (str): source crs like `epsg:4326`
+        out_crs (str): target crs like `epsg:3857`
+        always_xy (bool): treat coordinates as (x, y) / (lon, lat) regardless of crs axis order
+
+    Returns:
+        pyproj.Transformer: transformer between the two systems
+    """
+    return pyproj.Transformer.from_crs(_crs(in_crs), _crs(out_crs), always_xy=always_xy)
+
+
+def same_crs(in_crs: str, out_crs: str) -> bool:
+    """
+    check if two crs strings describe the same coordinate system
+
+    Returns:
+        bool: True if no transformation is needed
+    """
+    return in_crs == out_crs or _crs(in_crs) == _crs(out_crs)
+
+
+def transform_coords(
+        xs: Sequence[float],
+        ys: Sequence[float],
+        in_crs: str,
+        out_crs: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    reproject whole arrays of coordinates in one vectorized call
+
+    Args:
+        xs (Sequence[float]): x / longitude values
+        ys (Sequence[float]): y / latitude values
+        in_crs (str): crs of input coordinates
+        out_crs (str): target crs
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: projected x and y arrays
+    """
+    xs = np.asarray(xs, dtype='float64')
+    ys = np.asarray(ys, dtype='float64')
+    if same_crs(in_crs, out_crs):
+        return xs, ys
+    return get_transformer(in_crs, out_crs).transform(xs, ys)
+
+
+def transform_geometries(geometries, in_crs: str, out_crs: str):
+    """
+    reproject a shapely geometry or array of geometries.  All vertices of all
+    geometries go through the transformer in a single call
+
+    Args:
+        geometries: shapely geometry or array like of geometries
+        in_crs (str): crs of input geometries
+        out_crs (str): target crs
+
+    Returns:
+        geometry or np.ndarray of geometries, matching the input
+    """
+    if same_crs(in_crs, out_crs):
+        return geometries
+    transformer = get_transformer(in_crs, out_crs)
+
+    def project(coords: np.ndarray) -> np.ndarray:
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    return shapely.transform(geometries, project)
+
 
 def coords_to_polygon(coords: List[tuple], out_crs: str, in_crs: str='epsg:4326') -> Polygon:
     """
@@ -21,32 +108,130 @@ def coords_to_polygon(coords: List[tuple], out_crs: str, in_crs: str='epsg:4326'
         Polygon: shapely polygon with coordinates projected to desired coordinate system
     """
     poly = Polygon(coords)
-    project = pyproj.Transformer.from_proj(
-    pyproj.Proj(init=in_crs), # source crs
-    pyproj.Proj(init=out_crs) # dest crs
-)
-    projected_poly = transform(project.transform, poly)
+    projected_poly = transform_geometries(poly, str(in_crs), str(out_crs))
     
     return projected_poly
 
-def generate_h3_grid(self, resolution: int) -> gpd.GeoDataFrame:
-        """
-        generate h3 grid over area of interest 
+def _h3_shape(polygon: Polygon) -> h3.LatLngPoly:
+    # h3 wants (lat, lng) rings without the closing vertex
+    def ring(coords):
+        return [(lat, lng) for lng, lat in list(coords)[:-1]]
+    return h3.LatLngPoly(ring(polygon.exterior.coords), *(ring(hole.coords) for hole in polygon.interiors))
 
-        Args:
-            resolution (int): target h3 resolution.  Must be between or equal to 1-15
 
-        Returns:
-            gpd.GeoDataFrame: geodataframe with 2 cols 'h3' and 'geometry'
-        """
+def h3_fill_tiles(polygon: Polygon, resolution: int, chunk_size: int = H3_CHUNK_SIZE) -> List[Polygon]:
+    """
+    split an AOI into lon/lat tiles that each hold about `chunk_size` cells.
+    Tiles partition the AOI, and h3 assigns a cell to a shape by its centre, so
+    filling every tile separately gives the same cells as filling the whole AOI
 
-        poly = h3.LatLngPoly(self.coords)
-        cells = h3.h3shape_to_cells(poly, res=resolution)
+    Returns:
+        List[Polygon]: non empty polygon parts of the AOI, tile by tile
+    """
+    cell_km2 = h3.average_hexagon_area(resolution, unit='km^2')
+    # about 111 km per degree, good enough for sizing chunks
+    side = max(np.sqrt(chunk_size * cell_km2) / 111.0, 1e-6)
+    xmin, ymin, xmax, ymax = polygon.bounds
+    xs = np.arange(xmin, xmax + side, side)
+    ys = np.arange(ymin, ymax + side, side)
+    tiles = shapely.box(*np.meshgrid(xs[:-1], ys[:-1]), *np.meshgrid(xs[1:], ys[1:])).ravel()
+    parts = []
+    for piece in shapely.intersection(tiles[shapely.intersects(tiles, polygon)], polygon):
+        for part in getattr(piece, 'geoms', [piece]):
+            if part.geom_type == 'Polygon' and not part.is_empty:
+                parts.append(part)
+    return parts
+
+
+def iter_h3_cell_ids(coords: List[tuple], resolution: int, chunk_size: int = H3_CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """
+    fill an AOI with h3 cells one tile at a time, so only about `chunk_size`
+    cell ids exist at once no matter how large the AOI is
+
+    Args:
+        coords (List[tuple]): AOI coordinates as (lon, lat) tuples in epsg:4326
+        resolution (int): target h3 resolution.  Must be between or equal to 0-15
+        chunk_size (int): approximate number of cells per yielded array
+
+    Yields:
+        np.ndarray: uint64 arrays of h3 cell ids
+    """
+    for part in h3_fill_tiles(Polygon(coords), resolution, chunk_size):
+        cells = h3_int.h3shape_to_cells(_h3_shape(part), res=resolution)
+        if cells:
+            yield np.fromiter(cells, dtype=np.uint64, count=len(cells))
 
-        data = {'h3': cells,}
-        df = pd.DataFrame(data)
 
-        df['geometry'] = df['h3'].apply(lambda x: Polygon(h3.cell_to_boundary(x)))
-        gdf = gpd.GeoDataFrame(df, geometry=df['geometry'], crs='epsg:4326')
+def h3_cell_ids(coords: List[tuple], resolution: int) -> np.ndarray:
+    """
+    fill an AOI with h3 cells without building any geometries
+
+    Args:
+        coords (List[tuple]): AOI coordinates as (lon, lat) tuples in epsg:4326
+        resolution (int): target h3 resolution.  Must be between or equal to 0-15
+
+    Returns:
+        np.ndarray: uint64 array of h3 cell ids
+    """
+    cells = h3_int.h3shape_to_cells(_h3_shape(Polygon(coords)), res=resolution)
+    return np.fromiter(cells, dtype=np.uint64, count=len(cells))
+
+
+def cells_to_polygons(cells: np.ndarray) -> np.ndarray:
+    """
+    build polygons for many h3 cells at once.  Boundaries are written into one
+    coordinate array and turned into geometries with a single shapely call.
+    h3-py has no batch boundary function, so the boundaries themselves still
+    come from one `cell_to_boundary` call per cell
+
+    Args:
+        cells (np.ndarray): uint64 h3 cell ids
+
+    Returns:
+        np.ndarray: shapely polygons in epsg:4326, one per cell
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    # 6 vertices for hexagons plus the closing vertex, pentagons repeat the closing vertex
+    rings = np.empty((len(cells), 7, 2), dtype='float64')
+    for i, cell in enumerate(cells):
+        boundary = np.asarray(h3_int.cell_to_boundary(int(cell)))[:, ::-1]
+        n = len(boundary)
+        rings[i, :n] = boundary
+        rings[i, n:] = boundary[0]
+    return shapely.polygons(rings)
+
+
+def iter_h3_grid(coords: List[tuple], resolution: int, chunk_size: int = H3_CHUNK_SIZE) -> Iterator[gpd.GeoDataFrame]:
+    """
+    generate h3 grid over area of interest in chunks.  The fill itself is
+    streamed tile by tile, so huge AOIs never hold every cell id or geometry in
+    memory at once
+
+    Args:
+        coords (List[tuple]): AOI coordinates as (lon, lat) tuples in epsg:4326
+        resolution (int): target h3 resolution.  Must be between or equal to 0-15
+        chunk_size (int): approximate number of cells per yielded chunk
+
+    Yields:
+        gpd.GeoDataFrame: geodataframe with 2 cols 'h3' and 'geometry'
+    """
+    for chunk in iter_h3_cell_ids(coords, resolution, chunk_size):
+        yield gpd.GeoDataFrame({'h3': chunk}, geometry=cells_to_polygons(chunk), crs='epsg:4326')
+
+
+def generate_h3_grid(coords: List[tuple], resolution: int) -> gpd.GeoDataFrame:
+    """
+    generate h3 grid over area of interest.  Use `h3_cell_ids` when only the cell
+    ids are needed and `iter_h3_grid` for AOIs too large to hold at once
+
+    Args:
+        coords (List[tuple]): AOI coordinates as (lon, lat) tuples in epsg:4326
+        resolution (int): target h3 resolution.  Must be between or equal to 0-15
+
+    Returns:
+        gpd.GeoDataFrame: geodataframe with 2 cols 'h3' and 'geometry'
+    """
+    cells = h3_cell_ids(coords, resolution)
+    gdf = gpd.GeoDataFrame({'h3': cells}, geometry=cells_to_polygons(cells), crs='epsg:4326')
 
-        return gdf
\ No newline at end of file
+    return gdf
@@ -1,10 +1,14 @@
 import argparse
+import ast
+import os
 from typing import List
 
+from e84_proj.batch import BatchRunner, read_aois
 from e84_proj.extract.stac_client.client import StacClient
 from e84_proj.extract.utils import coords_to_polygon
 from e84_proj.extract.extraction import Extract
-from e84_proj.preprocess.preprocess import Preprocessor
+from e84_proj.pipeline import build_aoi_pipeline
+from e84_proj.preprocess.grid import TargetGrid
 
 
 
@@ -25,15 +29,43 @@ CHIRPS_END = '2023-06-15'
 LULC_START = '2022-01-01'
 LULC_END = '2023-01-01'
 
+BATCH_OUTPUT = 'aoi_results.csv'
+
 parser = argparse.ArgumentParser()
 
-parser.add_argument(
+aoi_input = parser.add_mutually_exclusive_group(required=True)
+aoi_input.add_argument(
     '--coords',
-    required=True,
     help="input coordinates for search area, like [(0,0), (0,1), (1,1), (0,1), (0,0)]")
+aoi_input.add_argument(
+    '--aoi-file',
+    help="GeoJSON, GeoPackage or Parquet file of AOI polygons to process in one batch")
+parser.add_argument(
+    '--id-column',
+    help="AOI id column in --aoi-file, defaults to the row number")
+parser.add_argument(
+    '--output',
+    default=BATCH_OUTPUT,
+    help="results table for --aoi-file, AOIs already in it are skipped.  A GeoParquet copy with the "
+         "AOI polygons is written next to it")
 
 
 
+def build_sources(de_africa_stac: str, io_stac: str, world_pop: str, chirps: str, lulc: str) -> dict:
+    """
+    pipeline inputs: name -> (StacClient, date) for searched inputs, (href, None) for direct links
+    """
+    chirps = StacClient(de_africa_stac, chirps)
+    lulc = StacClient(io_stac, lulc)
+    return {
+        'chirps_start': (chirps, CHIRPS_START),
+        'chirps_end': (chirps, CHIRPS_END),
+        'lulc_start': (lulc, LULC_START),
+        'lulc_end': (lulc, LULC_END),
+        'worldpop': (world_pop, None),
+    }
+
+
 def main(
         coords: List[tuple],
         de_africa_stac: str = DE_AFRICA_STAC,
@@ -54,33 +86,48 @@ def main(
         lulc (str): path to STAC v1.0 endpoint for LULC dataset
     """
     polygon = coords_to_polygon(coords, in_crs='epsg:4326', out_crs='epsg:4326')
-    chirps = StacClient(de_africa_stac, chirps)
-    chirps_catalog = chirps.connection_factory()
-    chirps_start_items = chirps.aoi_search(chirps_catalog, polygon, CHIRPS_START)
-    chirps_end_items = chirps.aoi_search(chirps_catalog, polygon, CHIRPS_END)
-
-    lulc = StacClient(io_stac, lulc)
-    lulc_catalog = lulc.connection_factory()
-    lulc_start_items = lulc.aoi_search(lulc_catalog, polygon, LULC_START)
-    lulc_end_items = lulc.aoi_search(lulc_catalog, polygon, LULC_END)
-    
-    links = {
-        "chirps": {
-            "start": chirps_start_items[0],
-            "end": chirps_end_items[0]
-        },
-        "lulc": {
-            "start": lulc_start_items[0],
-            "end": lulc_end_items[0]
-        }, 
-        "worldpop": world_pop
-    }
+    sources = build_sources(de_africa_stac, io_stac, world_pop, chirps, lulc)
     extractor = Extract(coords)
-    download_paths = extractor.execute_downloads(links)
+    grid = TargetGrid.from_coords(coords)
 
-    preprocessor = Preprocessor(coords)
+    # searches, downloads and warps run as a DAG: each input moves on as soon
+    # as its own search finishes instead of waiting on every other input
+    pipeline = build_aoi_pipeline(polygon, sources, extractor, grid)
+    results = pipeline.run()
+    extractor.cache.evict()
+    print(pipeline.report())
 
-    return 
+    return results['summary']
+
+
+def batch_main(
+        aoi_file: str,
+        output: str = BATCH_OUTPUT,
+        id_column: str = None,
+        de_africa_stac: str = DE_AFRICA_STAC,
+        io_stac: str = IO_LULC_STAC_ENDPOINT,
+        world_pop: str = WORLD_POP_PATH,
+        chirps: str = CHIRPS_COLLECTION,
+        lulc: str = LULC_COLLECTION,
+    ):
+    """
+    run the AOI summary for every polygon in a file, resuming from whatever is
+    already in the output table
+
+    Args:
+        aoi_file (str): GeoJSON, GeoPackage or Parquet file of AOI polygons
+        output (str): CSV results table, one row per AOI.  The results are also
+            written with their AOI polygons to a .parquet file of the same name
+        id_column (str): AOI id column, defaults to the row number
+
+    Returns:
+        List[str]: ids of AOIs that failed
+    """
+    aois = read_aois(aoi_file, id_column)
+    sources = build_sources(de_africa_stac, io_stac, world_pop, chirps, lulc)
+    geoparquet_path = os.path.splitext(output)[0] + '.parquet'
+    runner = BatchRunner(sources, Extract(coords=None), output, geoparquet_path=geoparquet_path)
+    return runner.run(aois)
 
 # run command: /home/treuter/repos/geo_py/.venv/bin/python /home/treuter/repos/geo_py/e84_proj/main.py --coords "(16.78711,14.40821), (17.73743,14.43018), (17.74292,13.64466), (16.83105,13.60072), (16.79260,14.38624), (16.78711,14.40821)"
 
@@ -88,9 +135,11 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
 
-    # UNSAFE UNSAFE UNSAFE use of eval.  Using only for demo expediency
-    coords = [eval(x) for x in args.coords.split(', ')]
-
-
-    print(f'coords are: {coords}')
-    main(coords)
+    if args.aoi_file:
+        failed = batch_main(args.aoi_file, args.output, args.id_column)
+        print(f'{len(failed)} AOIs failed')
+    else:
+        # literal_eval only accepts python literals, so the coords string can't run code
+        coords = list(ast.literal_eval(args.coords))
+        print(f'coords are: {coords}')
+        print(main(coords))
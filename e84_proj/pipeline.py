@@ -0,0 +1,208 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, List
+import asyncio
+import os
+import time
+
+import numpy as np
+from rasterio.enums import Resampling
+
+from e84_proj.analayze.reclass import Reclassifier
+from e84_proj.analyze import LULC_RECLASS
+from e84_proj.extract.extraction import Extract
+from e84_proj.extract.stac_client.client import StacClient
+from e84_proj.preprocess.grid import TargetGrid
+from e84_proj.preprocess.warp import INPUT_RESAMPLING
+
+IO_WORKERS = 8
+CPU_WORKERS = os.cpu_count() or 1
+# target grids already seen by this (worker) process, see `read_on_grid`
+_WORKER_GRIDS: Dict[tuple, TargetGrid] = {}
+
+
+@dataclass
+class Stage:
+    """
+    one step of a pipeline.  `func` is called with the results of `deps` in
+    order.  `io` stages run on a thread pool, `cpu` stages on a process pool
+    so raster work is not held back by the GIL
+    """
+    name: str
+    func: Callable
+    deps: List[str] = field(default_factory=list)
+    kind: str = 'io'
+
+
+class Pipeline:
+    """
+    runs stages as a DAG with asyncio: every stage starts as soon as its
+    dependencies finish, so independent searches, downloads and preprocessing
+    overlap.  A stage is only handed to its pool once a worker is free, so the
+    pools' queues never grow past the worker count.  This caps running work, not
+    finished results: a fast io stage can still get ahead of slow cpu stages and
+    its result is held until every dependent has run.  Wall clock time per stage
+    is kept in `timings`
+    """
+
+    def __init__(self, io_workers: int = IO_WORKERS, cpu_workers: int = CPU_WORKERS):
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add(self, name: str, func: Callable, deps: List[str] = (), kind: str = 'io') -> 'Pipeline':
+        """
+        add a stage.  Dependencies must already be added, which keeps the graph acyclic
+
+        Args:
+            name (str): unique stage name
+            func (Callable): work to run, must be picklable for `cpu` stages
+            deps (List[str]): stages whose results are passed to func
+            kind (str): 'io' or 'cpu'
+
+        Returns:
+            Pipeline: self, for chaining
+        """
+        if name in self.stages:
+            raise ValueError(f'stage {name} already exists')
+        if kind not in ('io', 'cpu'):
+            raise ValueError(f'kind must be io or cpu, got {kind}')
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f'stage {name} depends on unknown stages {missing}')
+        self.stages[name] = Stage(name, func, list(deps), kind)
+        return self
+
+    async def _run(self, threads: ThreadPoolExecutor, processes: ProcessPoolExecutor) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        tasks: Dict[str, asyncio.Task] = {}
+        executors = {'io': threads, 'cpu': processes}
+        slots = {'io': asyncio.Semaphore(self.io_workers), 'cpu': asyncio.Semaphore(self.cpu_workers)}
+
+        async def run_stage(stage: Stage):
+            inputs = [await tasks[dep] for dep in stage.deps]
+            async with slots[stage.kind]:
+                start = time.perf_counter()
+                result = await loop.run_in_executor(executors[stage.kind], partial(stage.func, *inputs))
+                self.timings[stage.name] = time.perf_counter() - start
+            return result
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+        results = await asyncio.gather(*tasks.values())
+        return dict(zip(tasks.keys(), results))
+
+    def run(self) -> Dict[str, Any]:
+        """
+        run every stage
+
+        Returns:
+            Dict[str, Any]: stage name -> result
+        """
+        self.timings = {}
+        with ThreadPoolExecutor(max_workers=self.io_workers) as threads:
+            with ProcessPoolExecutor(max_workers=self.cpu_workers) as processes:
+                return asyncio.run(self._run(threads, processes))
+
+    def report(self) -> str:
+        """
+        per stage timings, slowest first
+        """
+        lines = [f'{name}: {seconds:.2f}s' for name, seconds in sorted(self.timings.items(), key=lambda x: -x[1])]
+        return '\n'.join(lines)
+
+
+def search_first_href(client: StacClient, aoi, date: str) -> str:
+    """
+    first asset href of the first item matching an AOI and date
+    """
+    items = client.aoi_search(client.connection_factory(), aoi, date, max_items=1)
+    if not items:
+        raise LookupError(f'no {client.collection} items found for {date}')
+    return items[0]
+
+
+def read_on_grid(grid: TargetGrid, resampling: Resampling, path: str) -> np.ma.MaskedArray:
+    """
+    warp a downloaded input onto the shared target grid.  Every cpu task gets
+    its own unpickled copy of the grid, so the first copy seen by a worker
+    process is kept and reused, along with the source windows it has cached
+    """
+    key = (str(grid.crs), tuple(grid.transform), grid.width, grid.height)
+    grid = _WORKER_GRIDS.setdefault(key, grid)
+    return grid.read(path, resampling)
+
+
+def summarize(chirps_start, chirps_end, lulc_start, lulc_end, worldpop) -> dict:
+    """
+    AOI level summary of rainfall change, cropland and population.  All inputs
+    are masked arrays on the same target grid
+
+    Returns:
+        dict: summary statistics
+    """
+    reclassifier = Reclassifier(LULC_RECLASS, as_mask=True)
+    cropland_start = np.ma.masked_array(reclassifier.apply(lulc_start.filled(0)), mask=np.ma.getmaskarray(lulc_start))
+    cropland_end = np.ma.masked_array(reclassifier.apply(lulc_end.filled(0)), mask=np.ma.getmaskarray(lulc_end))
+    not_cropland = ~cropland_end.filled(False)
+
+    rain_change = chirps_end.astype('float64') - chirps_start.astype('float64')
+    population = worldpop.astype('float64')
+    crop_rain_change = np.ma.masked_array(rain_change, mask=np.ma.getmaskarray(rain_change) | not_cropland)
+    crop_population = np.ma.masked_array(population, mask=np.ma.getmaskarray(population) | not_cropland)
+
+    return {
+        'rain_change_mean': float(rain_change.mean()),
+        'rain_change_cropland_mean': float(crop_rain_change.mean()),
+        'cropland_fraction_start': float(cropland_start.mean()),
+        'cropland_fraction_end': float(cropland_end.mean()),
+        'population': float(population.sum()),
+        'population_on_cropland': float(crop_population.sum()),
+    }
+
+
+def summarize_named(names: List[str], *arrays) -> dict:
+    """
+    call `summarize` with stage results matched to input names
+    """
+    return summarize(**dict(zip(names, arrays)))
+
+
+def build_aoi_pipeline(
+        polygon,
+        sources: Dict[str, tuple],
+        extractor: Extract,
+        grid: TargetGrid,
+        pipeline: Pipeline = None
+) -> Pipeline:
+    """
+    search -> download -> warp stages for every input of one AOI, plus a final
+    summary stage that waits on all of them
+
+    Args:
+        polygon: AOI polygon used for searches
+        sources (Dict[str, tuple]): input name -> (StacClient, date) for STAC
+            inputs or (href, None) for direct links.  Names are the `summarize`
+            arguments: chirps_start, chirps_end, lulc_start, lulc_end, worldpop
+        extractor (Extract): downloader with a shared cache
+        grid (TargetGrid): target grid for the AOI
+        pipeline (Pipeline): pipeline to add to, a new one when None
+
+    Returns:
+        Pipeline: pipeline ready to run, the summary is the `summary` stage
+    """
+    pipeline = pipeline or Pipeline()
+    for name, (source, date) in sources.items():
+        if isinstance(source, StacClient):
+            pipeline.add(f'search_{name}', partial(search_first_href, source, polygon, date))
+            pipeline.add(f'download_{name}', extractor.fetch_asset, deps=[f'search_{name}'])
+        else:
+            pipeline.add(f'download_{name}', partial(extractor.fetch_asset, source))
+        resampling = INPUT_RESAMPLING.get(name.split('_')[0], Resampling.nearest)
+        pipeline.add(f'warp_{name}', partial(read_on_grid, grid, resampling), deps=[f'download_{name}'], kind='cpu')
+
+    names = list(sources)
+    pipeline.add('summary', partial(summarize_named, names), deps=[f'warp_{name}' for name in names], kind='cpu')
+    return pipeline
@@ -0,0 +1,209 @@
+from typing import Dict, List, Tuple
+import math
+import threading
+
+from affine import Affine
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
+
+from e84_proj.analyze import TARGET_RESOLUTION_METERS
+from e84_proj.extract.utils import coords_to_polygon
+from e84_proj.preprocess.overviews import build_external_overviews, overview_resampling, select_overview_level
+from e84_proj.preprocess.warp import WARP_THREADS, aoi_grid, estimate_utm_crs, warp_to_grid
+
+
+class TargetGrid:
+    """
+    one shared pixel grid for an AOI.  Every input (CHIRPS, LULC, WorldPop) is
+    warped onto it, so arrays read through the grid have identical shapes and
+    later analysis is plain elementwise numpy.  The source window each input
+    needs is cached per source grid, so every date of the same product reuses it
+    """
+
+    def __init__(self, crs: str, transform: Affine, width: int, height: int):
+        self.crs = crs
+        self.transform = transform
+        self.width = width
+        self.height = height
+        self._warp_params: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # locks can't be pickled, the warp params cached so far travel with the grid
+        with self._lock:
+            state = self.__dict__.copy()
+            state['_warp_params'] = dict(self._warp_params)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_coords(cls, coords: List[tuple], resolution: float = TARGET_RESOLUTION_METERS, crs: str = None):
+        """
+        build the grid for an AOI
+
+        Args:
+            coords (List[tuple]): AOI coordinates in epsg:4326
+            resolution (float): pixel size in meters
+            crs (str): grid crs, defaults to the AOI's UTM zone
+
+        Returns:
+            TargetGrid: grid covering the AOI, aligned to multiples of resolution
+        """
+        crs = crs or estimate_utm_crs(coords_to_polygon(coords, 'epsg:4326', 'epsg:4326'))
+        transform, width, height = aoi_grid(coords, crs, resolution)
+        return cls(crs, transform, width, height)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        left, top = self.transform.c, self.transform.f
+        return left, top + self.transform.e * self.height, left + self.transform.a * self.width, top
+
+    def warp_params(self, src) -> dict:
+        """
+        source window (and its transform) that covers this grid, computed once per
+        source grid and reused for every raster on that grid
+
+        Args:
+            src: open rasterio dataset
+
+        Returns:
+            dict: `window` and `transform` of the source pixels to read
+        """
+        key = (src.crs.to_wkt(), tuple(src.transform), src.width, src.height)
+        with self._lock:
+            params = self._warp_params.get(key)
+        if params is None:
+            src_bounds = transform_bounds(self.crs, src.crs, *self.bounds, densify_pts=21)
+            window = from_bounds(*src_bounds, transform=src.transform)
+            # pad a pixel so resampling kernels have neighbours at the edges
+            window = Window(window.col_off - 1, window.row_off - 1, window.width + 2, window.height + 2)
+            window = window.round_offsets(op='floor').round_lengths(op='ceil')
+            window = window.intersection(Window(0, 0, src.width, src.height))
+            params = {'window': window, 'transform': src.window_transform(window)}
+            with self._lock:
+                self._warp_params[key] = params
+        return params
+
+    def source_resolution(self, source) -> float:
+        """
+        this grid's pixel size expressed in the units of a source raster's crs
+
+        Args:
+            source: raster path or an open rasterio dataset
+
+        Returns:
+            float: approximate target pixel size in source units
+        """
+        if isinstance(source, str):
+            with rio.open(source) as src:
+                return self.source_resolution(src)
+        left, _, right, _ = transform_bounds(self.crs, source.crs, *self.bounds, densify_pts=21)
+        return (right - left) / self.width
+
+    def read(
+            self,
+            path: str,
+            resampling: Resampling = Resampling.nearest,
+            band: int = 1,
+            use_overviews: bool = True,
+            build_overviews: bool = False
+    ) -> np.ma.MaskedArray:
+        """
+        read a raster band warped onto this grid.  When the grid is coarser than
+        the source, the closest overview at or finer than the grid resolution is
+        decoded instead of every full resolution pixel
+
+        Args:
+            path (str): raster path
+            resampling (Resampling): resampling method for this input
+            band (int): band to read
+            use_overviews (bool): read from internal or external overviews when possible
+            build_overviews (bool): build external overviews for local rasters without any
+
+        Returns:
+            np.ma.MaskedArray: array of `self.shape`, nodata masked
+        """
+        if use_overviews and build_overviews:
+            build_external_overviews(path, overview_resampling(resampling))
+        # one open: the overview is picked from this handle and read through
+        # `out_shape`, which GDAL serves from the matching overview
+        with rio.open(path) as src:
+            params = self.warp_params(src)
+            window, src_transform = params['window'], params['transform']
+            height, width = int(window.height), int(window.width)
+            out_shape = (height, width)
+            level = select_overview_level(src, self.source_resolution(src)) if use_overviews else None
+            if level is not None:
+                factor = src.overviews(band)[level]
+                out_shape = (max(1, math.ceil(height / factor)), max(1, math.ceil(width / factor)))
+                src_transform = src_transform * Affine.scale(width / out_shape[1], height / out_shape[0])
+            source = src.read(band, window=window, out_shape=out_shape)
+            src_crs, src_nodata, dtype = src.crs, src.nodata, src.dtypes[0]
+
+        fill = src_nodata
+        if fill is None:
+            fill = np.nan if np.issubdtype(np.dtype(dtype), np.floating) else 0
+        destination = np.full(self.shape, fill, dtype=dtype)
+        reproject(
+            source=source,
+            destination=destination,
+            src_transform=src_transform,
+            src_crs=src_crs,
+            src_nodata=src_nodata,
+            dst_transform=self.transform,
+            dst_crs=self.crs,
+            dst_nodata=fill,
+            resampling=resampling,
+            num_threads=WARP_THREADS
+        )
+        if src_nodata is None:
+            # no nodata value to tell the fill apart from real values, so warp
+            # a coverage mask to find the pixels the source reaches
+            covered = np.zeros(self.shape, dtype='uint8')
+            reproject(
+                source=np.ones(source.shape, dtype='uint8'),
+                destination=covered,
+                src_transform=src_transform,
+                src_crs=src_crs,
+                dst_transform=self.transform,
+                dst_crs=self.crs,
+                dst_nodata=0,
+                resampling=Resampling.nearest,
+                num_threads=WARP_THREADS
+            )
+            return np.ma.masked_array(destination, mask=covered == 0)
+        if np.issubdtype(destination.dtype, np.floating) and np.isnan(fill):
+            return np.ma.masked_invalid(destination)
+        return np.ma.masked_equal(destination, fill)
+
+    def read_many(self, inputs: Dict[str, Tuple[str, Resampling]]) -> Dict[str, np.ma.MaskedArray]:
+        """
+        read several inputs onto the grid
+
+        Args:
+            inputs (Dict[str, Tuple[str, Resampling]]): name -> (path, resampling)
+
+        Returns:
+            Dict[str, np.ma.MaskedArray]: name -> identically shaped arrays
+        """
+        return {name: self.read(path, resampling) for name, (path, resampling) in inputs.items()}
+
+    def write(self, path: str, out_path: str, resampling: Resampling = Resampling.nearest) -> str:
+        """
+        warp a raster onto this grid and write it to disk
+
+        Returns:
+            str: out_path
+        """
+        return warp_to_grid(path, out_path, self.crs, self.transform, self.width, self.height, resampling)
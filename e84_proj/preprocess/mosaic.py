@@ -0,0 +1,124 @@
+from typing import List, Tuple
+import math
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import rasterio as rio
+
+from e84_proj.extract.cog import remote_env, to_vsi_path
+
+SNAP_TOLERANCE = 1e-6
+
+GDAL_DTYPES = {
+    'uint8': 'Byte',
+    'int8': 'Int8',
+    'uint16': 'UInt16',
+    'int16': 'Int16',
+    'uint32': 'UInt32',
+    'int32': 'Int32',
+    'float32': 'Float32',
+    'float64': 'Float64',
+}
+
+
+def snap_bounds(bounds: Tuple[float, float, float, float], origin: Tuple[float, float], res: Tuple[float, float]):
+    """
+    grow bounds outwards so their edges fall on the pixel grid defined by origin and res
+
+    Returns:
+        Tuple[float, float, float, float]: snapped (xmin, ymin, xmax, ymax)
+    """
+    (xmin, ymin, xmax, ymax), (ox, oy), (rx, ry) = bounds, origin, res
+    # tolerate float noise so edges already on the grid are not pushed out a pixel
+    return (
+        ox + math.floor((xmin - ox) / rx + SNAP_TOLERANCE) * rx,
+        oy - math.ceil((oy - ymin) / ry - SNAP_TOLERANCE) * ry,
+        ox + math.ceil((xmax - ox) / rx - SNAP_TOLERANCE) * rx,
+        oy - math.floor((oy - ymax) / ry + SNAP_TOLERANCE) * ry,
+    )
+
+
+def build_vrt(paths: List[str], out_path: str, bounds: Tuple[float, float, float, float] = None) -> str:
+    """
+    write a GDAL VRT mosaic over a set of tiles.  Nothing is copied, readers of
+    the VRT only touch the windows of each source they need.  Tiles must share
+    crs, resolution, band count and data type
+
+    Args:
+        paths (List[str]): tile paths or hrefs, remote hrefs are read via /vsis3 or /vsicurl
+        out_path (str): where to write the .vrt file
+        bounds (Tuple[float, float, float, float]): crop the mosaic to these
+            bounds (in the tile crs), snapped outwards to the tile pixel grid
+
+    Returns:
+        str: out_path
+    """
+    sources = []
+    with remote_env():
+        for path in paths:
+            with rio.open(to_vsi_path(path)) as src:
+                sources.append({
+                    'name': src.name,
+                    'crs': src.crs,
+                    'res': src.res,
+                    'bounds': src.bounds,
+                    'count': src.count,
+                    'dtype': src.dtypes[0],
+                    'nodata': src.nodata
+                })
+
+    first = sources[0]
+    crs, res, count, dtype = first['crs'], first['res'], first['count'], first['dtype']
+    for source in sources[1:]:
+        if source['crs'] != crs:
+            raise ValueError(f"{source['name']} has a different crs, reproject tiles before merging")
+        if not np.allclose(source['res'], res) or source['count'] != count or source['dtype'] != dtype:
+            raise ValueError(f"{source['name']} does not match the resolution, band count or dtype of the other tiles")
+
+    union = (
+        min(source['bounds'].left for source in sources),
+        min(source['bounds'].bottom for source in sources),
+        max(source['bounds'].right for source in sources),
+        max(source['bounds'].top for source in sources),
+    )
+    if bounds is not None:
+        union = (max(union[0], bounds[0]), max(union[1], bounds[1]), min(union[2], bounds[2]), min(union[3], bounds[3]))
+        if union[0] >= union[2] or union[1] >= union[3]:
+            raise ValueError('bounds do not overlap any tile')
+    xmin, ymin, xmax, ymax = snap_bounds(union, (first['bounds'].left, first['bounds'].top), res)
+    rx, ry = res
+    width = int(round((xmax - xmin) / rx))
+    height = int(round((ymax - ymin) / ry))
+
+    root = ET.Element('VRTDataset', rasterXSize=str(width), rasterYSize=str(height))
+    ET.SubElement(root, 'SRS').text = crs.to_wkt()
+    ET.SubElement(root, 'GeoTransform').text = f'{xmin}, {rx}, 0.0, {ymax}, 0.0, {-ry}'
+    for band in range(1, count + 1):
+        band_el = ET.SubElement(root, 'VRTRasterBand', dataType=GDAL_DTYPES[dtype], band=str(band))
+        if first['nodata'] is not None:
+            ET.SubElement(band_el, 'NoDataValue').text = repr(first['nodata'])
+        for source_info in sources:
+            src_bounds, src_nodata = source_info['bounds'], source_info['nodata']
+            left, bottom = max(src_bounds.left, xmin), max(src_bounds.bottom, ymin)
+            right, top = min(src_bounds.right, xmax), min(src_bounds.top, ymax)
+            if left >= right or bottom >= top:
+                continue
+            # ComplexSource with NODATA so one tile's empty edge never paints over its neighbour
+            source = ET.SubElement(band_el, 'ComplexSource' if src_nodata is not None else 'SimpleSource')
+            ET.SubElement(source, 'SourceFilename', relativeToVRT='0').text = source_info['name']
+            ET.SubElement(source, 'SourceBand').text = str(band)
+            ET.SubElement(
+                source, 'SrcRect',
+                xOff=str((left - src_bounds.left) / rx), yOff=str((src_bounds.top - top) / ry),
+                xSize=str((right - left) / rx), ySize=str((top - bottom) / ry)
+            )
+            ET.SubElement(
+                source, 'DstRect',
+                xOff=str((left - xmin) / rx), yOff=str((ymax - top) / ry),
+                xSize=str((right - left) / rx), ySize=str((top - bottom) / ry)
+            )
+            if src_nodata is not None:
+                ET.SubElement(source, 'NODATA').text = repr(src_nodata)
+
+    ET.ElementTree(root).write(out_path)
+    return out_path
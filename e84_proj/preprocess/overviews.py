@@ -0,0 +1,88 @@
+from typing import List, Optional
+import os
+
+import rasterio as rio
+from rasterio.enums import Resampling
+
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32, 64, 128, 256]
+
+
+def overview_resampling(resampling: Resampling) -> Resampling:
+    """
+    method used to build overviews for an input: mode keeps categorical
+    classes intact, average for everything continuous
+    """
+    return Resampling.mode if resampling == Resampling.nearest else Resampling.average
+
+
+def select_overview_level(src, target_res: float) -> Optional[int]:
+    """
+    pick the coarsest overview whose pixels are still no larger than the target
+    resolution, so the final resampling step never has to upsample
+
+    Args:
+        src: open rasterio dataset
+        target_res (float): target pixel size in units of the dataset crs
+
+    Returns:
+        Optional[int]: overview level for `rio.open(..., overview_level=)`,
+            None when full resolution should be read
+    """
+    native = min(abs(src.res[0]), abs(src.res[1]))
+    level = None
+    for i, factor in enumerate(src.overviews(1)):
+        if native * factor <= target_res:
+            level = i
+    return level
+
+
+def build_external_overviews(path: str, resampling: Resampling = Resampling.average, factors: List[int] = None) -> bool:
+    """
+    build a `.ovr` file next to a local raster that has no overviews.  Runs once,
+    later calls see the overviews and return straight away
+
+    Args:
+        path (str): local raster path
+        resampling (Resampling): overview resampling, mode for categorical data
+        factors (List[int]): decimation factors, defaults to every factor that
+            leaves at least one pixel
+
+    Returns:
+        bool: True if overviews were built
+    """
+    if '://' in path or path.startswith('/vsi') or os.path.exists(path + '.ovr'):
+        return False
+    with rio.open(path) as src:
+        if src.overviews(1):
+            return False
+        size = min(src.width, src.height)
+    factors = factors or [factor for factor in OVERVIEW_FACTORS if size // factor >= 1]
+    if not factors:
+        return False
+    # TIFF_USE_OVR writes an external .ovr instead of modifying the source file
+    with rio.Env(TIFF_USE_OVR=True, COMPRESS_OVERVIEW='DEFLATE'):
+        with rio.open(path, 'r+') as dst:
+            dst.build_overviews(factors, resampling)
+    return True
+
+
+def overview_open_kwargs(path: str, target_res: float, build: bool = False,
+                         resampling: Resampling = Resampling.nearest) -> dict:
+    """
+    open kwargs that read a raster from the overview closest to (and not
+    coarser than) the target resolution
+
+    Args:
+        path (str): raster path
+        target_res (float): target pixel size in units of the raster crs
+        build (bool): build external overviews first if the raster has none
+        resampling (Resampling): the input's final resampling method
+
+    Returns:
+        dict: `{'overview_level': n}` or `{}` for full resolution
+    """
+    if build:
+        build_external_overviews(path, overview_resampling(resampling))
+    with rio.open(path) as src:
+        level = select_overview_level(src, target_res)
+    return {} if level is None else {'overview_level': level}
@@ -1,42 +1,63 @@
 from typing import List
+import threading
 
+import dask
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform
 import rioxarray as rx
-from rioxarray.raster_dataset import RasterDataset
+from xarray import DataArray
 
+from e84_proj.extract.cog import remote_env, to_vsi_path
 from e84_proj.extract.utils import coords_to_polygon
+from e84_proj.preprocess.mosaic import build_vrt
+from e84_proj.preprocess.warp import INPUT_RESAMPLING, aoi_grid, estimate_utm_crs, warp_to_grid
+
+# band, y, x chunks for dask backed rasters
+DEFAULT_CHUNKS = {'band': 1, 'y': 2048, 'x': 2048}
 
 class Preprocessor:
     """
     class to hold preprocesing functionality for doing basic data housekeeping
-    on rasterio datasets for e84 intervie project
+    on rasterio datasets for e84 intervie project.
+    Everything returns lazy, dask backed DataArrays, nothing is read until
+    `write_raster` (or an analysis step) computes the result
     """
 
-    def __init__(self, coords: List[tuple]):
+    def __init__(self, coords: List[tuple], chunks: dict = None):
         self.coords = coords
-        pass
+        self.chunks = dict(DEFAULT_CHUNKS) if chunks is None else chunks
+        self._handles = []
+
+    def open_raster(self, path: str) -> DataArray:
+        """
+        lazily open a raster as a chunked, dask backed DataArray
 
-    def open_raster(self, path: str):
-        xds = rx.open_rasterio(path)
-        return
+        Args:
+            path (str): path to raster
+
+        Returns:
+            DataArray: lazy raster, nodata masked as nan
+        """
+        xds = rx.open_rasterio(path, chunks=self.chunks, lock=False, masked=True)
+        return xds
 
-    def clip_raster(self, xds: RasterDataset) -> RasterDataset:
+    def clip_raster(self, xds: DataArray) -> DataArray:
         """
-        PROBABLY WRONG TYPING
-        take in an opened raster dataset and clip it to input geometry to 
-        keep data volume down
+        take in an opened raster dataset and clip it to input geometry to
+        keep data volume down.  Stays lazy on dask backed rasters
 
         Args:
-            xds (RasterDataset): opened raster
+            xds (DataArray): opened raster
 
         Returns:
-            RasterDataset: clipped raster
-        """
-        raster_crs = xds.rio.crs
-        print(f'raster crs is: {raster_crs}')
-        # clip_geom = self.clip_prep(raster_crs)
-        # clipped: RasterDataset = xds.rio.clip(clip_geom)
-        # return clipped
-    
+            DataArray: clipped raster
+        """
+        clip_geom = self.clip_prep(xds.rio.crs)
+        clipped: DataArray = xds.rio.clip(clip_geom, crs=xds.rio.crs)
+        return clipped
+
     def clip_prep(self, raster_crs: str) -> dict:
         """
         take input coords and create clipping geometry compatible with rioxarray
@@ -48,7 +69,7 @@ class Preprocessor:
         Returns:
             dict: geoJSON like polygon dict for clipping raster
         """
-        
+
         projected_poly = coords_to_polygon(self.coords, raster_crs, 'epsg:4326')
         clip_geom = [
             {
@@ -57,12 +78,167 @@ class Preprocessor:
             }
         ]
         return clip_geom
-    
-    def merge_tiles(self):
-        return
-    
-    def reproject(self):
-        return
-    
-    def resample(self):
-        return
\ No newline at end of file
+
+    def merge_tiles(self, paths: List[str], out_path: str) -> str:
+        """
+        build a virtual mosaic (GDAL VRT) over a set of tiles, cropped to the AOI
+        bounds.  No merged copy is written, downstream reads only pull the windows
+        they need from each tile.  Open the result with `open_raster`
+
+        Args:
+            paths (List[str]): tile paths or hrefs sharing one crs and resolution
+            out_path (str): where to write the .vrt file
+
+        Returns:
+            str: out_path
+        """
+        with remote_env(), rio.open(to_vsi_path(paths[0])) as src:
+            tile_crs = src.crs
+        bounds = coords_to_polygon(self.coords, tile_crs, 'epsg:4326').bounds
+        return build_vrt(paths, out_path, bounds)
+
+    def _open_warped(
+            self,
+            path: str,
+            dst_crs=None,
+            resolution: float = None,
+            resampling: Resampling = Resampling.nearest,
+            aoi_only: bool = False
+    ) -> DataArray:
+        # a WarpedVRT reprojects/resamples on read, so the dask graph only warps
+        # the chunks that are eventually computed
+        src = rio.open(path)
+        self._handles.append(src)
+        dst_crs = dst_crs or src.crs.to_wkt()
+        transform, width, height = calculate_default_transform(
+            src.crs, dst_crs, src.width, src.height, *src.bounds, resolution=resolution
+        )
+        if aoi_only:
+            # the output grid only covers the AOI bounds, so nothing outside it is warped
+            transform, width, height = aoi_grid(self.coords, dst_crs, resolution or transform.a)
+        vrt = WarpedVRT(src, crs=dst_crs, transform=transform, width=width, height=height, resampling=resampling)
+        self._handles.append(vrt)
+        return rx.open_rasterio(vrt, chunks=self.chunks, lock=False, masked=True)
+
+    def reproject(self, path: str, dst_crs: str, resampling: Resampling = Resampling.nearest) -> DataArray:
+        """
+        lazily reproject a raster
+
+        Args:
+            path (str): path to raster
+            dst_crs (str): target crs like `epsg:32633`
+            resampling (Resampling): resampling method
+
+        Returns:
+            DataArray: lazy reprojected raster
+        """
+        return self._open_warped(path, dst_crs=dst_crs, resampling=resampling)
+
+    def resample(
+            self,
+            path: str,
+            resolution: float,
+            resampling: Resampling = Resampling.nearest,
+            dst_crs: str = None
+    ) -> DataArray:
+        """
+        lazily resample a raster to a target resolution, optionally reprojecting
+        in the same step
+
+        Args:
+            path (str): path to raster
+            resolution (float): target pixel size in units of the target crs
+            resampling (Resampling): nearest for categorical data, bilinear for continuous
+            dst_crs (str): target crs, keeps the raster crs when None
+
+        Returns:
+            DataArray: lazy resampled raster
+        """
+        return self._open_warped(path, dst_crs=dst_crs, resolution=resolution, resampling=resampling)
+
+    def process(
+            self,
+            path: str,
+            dst_crs: str,
+            resolution: float,
+            resampling: Resampling = Resampling.nearest
+    ) -> DataArray:
+        """
+        lazy reproject + resample + clip chain for one input.  The warp targets
+        a grid over the AOI bounds, the clip then only masks pixels outside the
+        AOI polygon
+
+        Returns:
+            DataArray: lazy raster on the target crs and resolution, clipped to the AOI
+        """
+        warped = self._open_warped(path, dst_crs=dst_crs, resolution=resolution, resampling=resampling, aoi_only=True)
+        return self.clip_raster(warped)
+
+    def warp(
+            self,
+            path: str,
+            out_path: str,
+            resolution: float,
+            input_name: str = None,
+            resampling: Resampling = None,
+            dst_crs: str = None
+    ) -> str:
+        """
+        clip, reproject and resample to an AOI aligned grid in a single warp pass,
+        writing one output instead of a file per step
+
+        Args:
+            path (str): input raster
+            out_path (str): output raster
+            resolution (float): target pixel size in meters
+            input_name (str): 'chirps', 'lulc' or 'worldpop', picks the resampling method
+            resampling (Resampling): explicit resampling method, overrides input_name
+            dst_crs (str): target crs, defaults to the AOI's UTM zone
+
+        Returns:
+            str: out_path
+        """
+        polygon = coords_to_polygon(self.coords, 'epsg:4326', 'epsg:4326')
+        dst_crs = dst_crs or estimate_utm_crs(polygon)
+        if resampling is None:
+            resampling = INPUT_RESAMPLING.get(input_name, Resampling.nearest)
+        transform, width, height = aoi_grid(self.coords, dst_crs, resolution)
+        clip_geom = coords_to_polygon(self.coords, dst_crs, 'epsg:4326')
+        return warp_to_grid(path, out_path, dst_crs, transform, width, height, resampling, clip_geom)
+
+    def write_raster(self, xds: DataArray, out_path: str, scheduler='threads') -> str:
+        """
+        compute a lazy raster and write it as a tiled, compressed GeoTIFF
+
+        Args:
+            xds (DataArray): lazy raster
+            out_path (str): where to write
+            scheduler: dask scheduler, 'threads', 'synchronous' or a
+                dask.distributed Client.  'processes' is not supported, a
+                threading lock can't be shared between processes
+
+        Returns:
+            str: out_path
+
+        Raises:
+            ValueError: for the 'processes' scheduler
+        """
+        if scheduler == 'processes':
+            raise ValueError("write_raster needs the 'threads', 'synchronous' or a distributed scheduler")
+        if isinstance(scheduler, str):
+            lock = threading.Lock()
+        else:
+            # workers of a distributed cluster need a cluster wide lock
+            from dask.distributed import Lock
+            lock = Lock(out_path)
+        with dask.config.set(scheduler=scheduler):
+            xds.rio.to_raster(out_path, tiled=True, compress='deflate', lock=lock)
+        return out_path
+
+    def close(self):
+        """
+        close datasets opened for warped reads
+        """
+        for handle in reversed(self._handles):
+            handle.close()
+        self._handles = []
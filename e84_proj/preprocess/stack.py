@@ -0,0 +1,96 @@
+from typing import List, Tuple
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+from rasterio.enums import Resampling
+import rioxarray  # noqa: F401, registers the .rio accessor
+import xarray as xr
+
+from e84_proj.extract.cog import remote_env, to_vsi_path
+from e84_proj.preprocess.grid import TargetGrid
+
+STACK_DTYPE = 'float32'
+
+
+def read_step(
+        grid: TargetGrid,
+        hrefs: List[str],
+        resampling: Resampling = Resampling.nearest,
+        band: int = 1,
+        dtype: str = STACK_DTYPE,
+        region: str = None
+) -> np.ndarray:
+    """
+    warp every tile of one time step onto the grid.  Where tiles overlap the
+    first one with a valid pixel wins, pixels no tile covers are nan.  Remote
+    COGs are read in place, only the window covering the grid is fetched
+
+    Returns:
+        np.ndarray: array of `grid.shape`
+    """
+    out = np.full(grid.shape, np.nan, dtype=dtype)
+    with remote_env(region):
+        for href in hrefs:
+            data = grid.read(to_vsi_path(href), resampling, band)
+            fill = np.isnan(out) & ~np.ma.getmaskarray(data)
+            out[fill] = data.data[fill]
+    return out
+
+
+def grid_coords(grid: TargetGrid) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    pixel centre y and x coordinates of a grid
+    """
+    transform = grid.transform
+    xs = transform.c + (np.arange(grid.width) + 0.5) * transform.a
+    ys = transform.f + (np.arange(grid.height) + 0.5) * transform.e
+    return ys, xs
+
+
+def load_stack(
+        steps: List[Tuple[str, List[str]]],
+        grid: TargetGrid,
+        resampling: Resampling = Resampling.nearest,
+        band: int = 1,
+        dtype: str = STACK_DTYPE,
+        region: str = None,
+        name: str = None
+) -> xr.DataArray:
+    """
+    lazy (time, y, x) stack over an AOI.  Each time step is one dask chunk that
+    reads and warps its tiles when computed, so building the stack touches no
+    pixels and only the steps an analysis needs are ever fetched
+
+    Args:
+        steps (List[Tuple[str, List[str]]]): (time step, hrefs) as returned by
+            `StacClient.time_series`
+        grid (TargetGrid): AOI grid every step is warped onto
+        resampling (Resampling): resampling method for this input
+        band (int): band to read
+        dtype (str): float output data type, missing pixels are nan
+        region (str): aws region for s3 hrefs
+        name (str): name of the returned DataArray
+
+    Returns:
+        xr.DataArray: dask backed stack with time, y and x coordinates and the grid crs
+    """
+    if not steps:
+        raise ValueError('no time steps to stack')
+    arrays = [
+        da.from_delayed(
+            dask.delayed(read_step)(grid, hrefs, resampling, band, dtype, region),
+            shape=grid.shape,
+            dtype=dtype
+        )
+        for _, hrefs in steps
+    ]
+    ys, xs = grid_coords(grid)
+    stack = xr.DataArray(
+        da.stack(arrays),
+        dims=('time', 'y', 'x'),
+        coords={'time': pd.to_datetime([step for step, _ in steps]), 'y': ys, 'x': xs},
+        name=name
+    )
+    return stack.rio.write_crs(grid.crs).rio.write_transform(grid.transform)
@@ -0,0 +1,139 @@
+from typing import List, Tuple
+import math
+import os
+
+from affine import Affine
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
+from rasterio.warp import reproject
+from shapely.geometry import Polygon, mapping
+
+from e84_proj.extract.utils import coords_to_polygon
+
+WARP_THREADS = os.cpu_count() or 1
+WARP_MEM_LIMIT_MB = 512
+
+RESAMPLING_METHODS = {
+    'nearest_neighbor': Resampling.nearest,
+    'nearest': Resampling.nearest,
+    'bilinear': Resampling.bilinear,
+    'average': Resampling.average,
+    'mode': Resampling.mode,
+}
+
+# nearest for categorical LULC, bilinear for continuous rainfall and population
+INPUT_RESAMPLING = {
+    'chirps': Resampling.bilinear,
+    'lulc': Resampling.nearest,
+    'worldpop': Resampling.bilinear,
+}
+
+
+def estimate_utm_crs(polygon: Polygon) -> str:
+    """
+    UTM zone crs for a polygon in epsg:4326, picked from its centroid
+
+    Returns:
+        str: crs like `epsg:32633`
+    """
+    lon, lat = polygon.centroid.x, polygon.centroid.y
+    zone = min(int((lon + 180) // 6) + 1, 60)
+    return f'epsg:{32600 + zone if lat >= 0 else 32700 + zone}'
+
+
+def aoi_grid(coords: List[tuple], dst_crs: str, resolution: float) -> Tuple[Affine, int, int]:
+    """
+    pixel grid covering an AOI.  Bounds are snapped to whole multiples of the
+    resolution so every input warped onto the grid lines up pixel for pixel
+
+    Args:
+        coords (List[tuple]): AOI coordinates in epsg:4326
+        dst_crs (str): grid crs
+        resolution (float): pixel size in units of dst_crs
+
+    Returns:
+        Tuple[Affine, int, int]: transform, width, height
+    """
+    xmin, ymin, xmax, ymax = coords_to_polygon(coords, dst_crs, 'epsg:4326').bounds
+    left = math.floor(xmin / resolution) * resolution
+    top = math.ceil(ymax / resolution) * resolution
+    width = max(int(math.ceil((xmax - left) / resolution)), 1)
+    height = max(int(math.ceil((top - ymin) / resolution)), 1)
+    return Affine(resolution, 0.0, left, 0.0, -resolution, top), width, height
+
+
+def warp_to_grid(
+        src_path: str,
+        dst_path: str,
+        dst_crs,
+        dst_transform: Affine,
+        width: int,
+        height: int,
+        resampling: Resampling = Resampling.nearest,
+        clip_geom: Polygon = None,
+        num_threads: int = WARP_THREADS,
+        open_kwargs: dict = None
+) -> str:
+    """
+    clip, reproject and resample a raster in one warp.  GDAL only reads the
+    source window that covers the target grid, and no intermediate files are written
+
+    Args:
+        src_path (str): input raster
+        dst_path (str): output raster
+        dst_crs: target crs
+        dst_transform (Affine): target transform
+        width (int): target width in pixels
+        height (int): target height in pixels
+        resampling (Resampling): resampling method
+        clip_geom (Polygon): optional polygon in dst_crs, pixels outside it become nodata
+        num_threads (int): warp threads
+        open_kwargs (dict): extra `rio.open` kwargs, like an overview_level to read from
+
+    Returns:
+        str: dst_path
+    """
+    with rio.open(src_path, **(open_kwargs or {})) as src:
+        dtype = src.dtypes[0]
+        nodata = src.nodata
+        # pixels outside the source (or the clip polygon) get nodata, or 0 / nan
+        # when the source does not declare a nodata value
+        fill = nodata
+        if fill is None:
+            fill = np.nan if np.issubdtype(np.dtype(dtype), np.floating) else 0
+        destination = np.full((src.count, height, width), fill, dtype=dtype)
+        reproject(
+            source=rio.band(src, list(range(1, src.count + 1))),
+            destination=destination,
+            dst_transform=dst_transform,
+            dst_crs=dst_crs,
+            dst_nodata=fill,
+            resampling=resampling,
+            num_threads=num_threads,
+            warp_mem_limit=WARP_MEM_LIMIT_MB
+        )
+        profile = src.profile.copy()
+
+    if clip_geom is not None:
+        outside = geometry_mask([mapping(clip_geom)], out_shape=(height, width), transform=dst_transform)
+        destination[:, outside] = fill
+
+    for key in ('blockxsize', 'blockysize'):
+        profile.pop(key, None)
+    profile.update(
+        driver='GTiff',
+        crs=dst_crs,
+        transform=dst_transform,
+        width=width,
+        height=height,
+        # declare the fill, otherwise pixels outside the source or the clip read as valid
+        nodata=fill,
+        compress='deflate',
+        tiled=width >= 256 and height >= 256
+    )
+    with rio.open(dst_path, 'w', **profile) as dst:
+        dst.write(destination)
+
+    return dst_path
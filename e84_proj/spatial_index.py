@@ -0,0 +1,116 @@
+from typing import Callable, List, Sequence, Tuple
+import os
+
+import numpy as np
+import rasterio as rio
+from rasterio.warp import transform_bounds
+import shapely
+from shapely.strtree import STRtree
+
+
+class SpatialIndex:
+    """
+    STRtree over a set of geometries (item footprints, tile bounds, zone
+    polygons) with an id per geometry.  Queries take many geometries at once and
+    run in one call into the tree.  The geometries and ids are saved as WKB in an
+    .npz file, so an index built from a catalog or a tile set is reused between
+    runs and only the tree itself is rebuilt on load
+    """
+
+    def __init__(self, geometries: Sequence, ids: Sequence = None):
+        """
+        Args:
+            geometries (Sequence): shapely geometries
+            ids (Sequence): one id per geometry, defaults to positions
+        """
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.ids = np.arange(len(self.geometries)) if ids is None else np.asarray(ids)
+        if len(self.ids) != len(self.geometries):
+            raise ValueError('ids and geometries must be the same length')
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self) -> int:
+        return len(self.geometries)
+
+    @classmethod
+    def from_bounds(cls, bounds: Sequence[Tuple[float, float, float, float]], ids: Sequence = None):
+        """
+        index of (xmin, ymin, xmax, ymax) boxes
+        """
+        bounds = np.asarray(bounds, dtype='float64').reshape(-1, 4)
+        return cls(shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3]), ids)
+
+    @classmethod
+    def from_rasters(cls, paths: List[str], crs: str = 'epsg:4326'):
+        """
+        index of raster footprints keyed by path, bounds are transformed to crs
+        """
+        bounds = []
+        for path in paths:
+            with rio.open(path) as src:
+                bounds.append(transform_bounds(src.crs, crs, *src.bounds, densify_pts=21))
+        return cls.from_bounds(bounds, paths)
+
+    def query(self, geometries: Sequence, predicate: str = 'intersects') -> Tuple[np.ndarray, np.ndarray]:
+        """
+        bulk query
+
+        Args:
+            geometries (Sequence): query geometries in the index crs
+            predicate (str): shapely predicate, None for bounding box hits only
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: positions into geometries and the ids
+                they matched, one pair per hit
+        """
+        query_idx, tree_idx = self.tree.query(np.asarray(geometries, dtype=object), predicate=predicate)
+        return query_idx, self.ids[tree_idx]
+
+    def matches(self, geometries: Sequence, predicate: str = 'intersects') -> List[list]:
+        """
+        ids matched by each query geometry
+
+        Returns:
+            List[list]: per query geometry, the matching ids in index order
+        """
+        query_idx, ids = self.query(geometries, predicate)
+        grouped = [[] for _ in range(len(geometries))]
+        for i, id_ in zip(query_idx, ids.tolist()):
+            grouped[i].append(id_)
+        return grouped
+
+    def save(self, path: str) -> str:
+        """
+        write geometries and ids to an .npz file.  WKB is packed into one byte
+        array with offsets so nothing needs pickling
+
+        Returns:
+            str: path
+        """
+        wkb = shapely.to_wkb(self.geometries)
+        offsets = np.cumsum([0] + [len(b) for b in wkb])
+        tmp_path = path + '.part.npz'
+        np.savez_compressed(tmp_path, wkb=np.frombuffer(b''.join(wkb), dtype='uint8'), offsets=offsets, ids=self.ids)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        read an index written by `save`
+        """
+        with np.load(path, allow_pickle=False) as data:
+            wkb, offsets, ids = data['wkb'].tobytes(), data['offsets'], data['ids']
+        geometries = shapely.from_wkb([wkb[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+        return cls(geometries, ids)
+
+    @classmethod
+    def cached(cls, path: str, build: Callable[[], 'SpatialIndex']):
+        """
+        load the index at path, or build and save it when there is none
+        """
+        if os.path.exists(path):
+            return cls.load(path)
+        index = build()
+        index.save(path)
+        return index
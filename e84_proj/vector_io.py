@@ -0,0 +1,135 @@
+from typing import List, Tuple
+import hashlib
+import json
+import os
+import uuid
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+PARQUET_SUFFIXES = ('.parquet', '.geoparquet')
+GEOPARQUET_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'e84_proj', 'geoparquet')
+# small row groups so bbox filtered reads skip most of a file
+ROW_GROUP_SIZE = 10_000
+
+
+def is_parquet(path: str) -> bool:
+    return path.lower().endswith(PARQUET_SUFFIXES)
+
+
+def geoparquet_cache_path(path: str, cache_dir: str = None) -> str:
+    """
+    cached GeoParquet path for a vector file.  The key includes the source size
+    and modified time, so an edited source is converted again
+    """
+    cache_dir = cache_dir or GEOPARQUET_CACHE_DIR
+    stat = os.stat(path)
+    key = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{stem}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.parquet')
+
+
+def write_polygons(gdf: gpd.GeoDataFrame, path: str) -> str:
+    """
+    write polygons to GeoParquet when the path ends in .parquet, any other
+    extension goes through pyogrio.  Parquet rows are sorted along a hilbert
+    curve so each row group covers a compact area, and a bbox covering column is
+    written so readers can skip row groups.  The original row order is kept in
+    the index
+
+    Returns:
+        str: path
+    """
+    if not is_parquet(path):
+        gdf.to_file(path, engine='pyogrio')
+        return path
+    gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort()]
+    # a unique temp name per writer, so concurrent conversions of one source
+    # never write into each other's file before the rename.  Opened normally so
+    # the result gets the usual umask permissions
+    tmp_path = f'{path}.{os.getpid()}.{uuid.uuid4().hex}.part'
+    try:
+        gdf.to_parquet(tmp_path, index=True, row_group_size=ROW_GROUP_SIZE, write_covering_bbox=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def geoparquet_geometry(path: str) -> Tuple[str, bool]:
+    """
+    primary geometry column of a GeoParquet file, and whether it has a bbox
+    covering column to filter row groups on
+
+    Returns:
+        Tuple[str, bool]: geometry column name, has covering bbox
+    """
+    metadata = pq.read_schema(path).metadata or {}
+    geo = json.loads(metadata.get(b'geo', b'{}'))
+    name = geo.get('primary_column', 'geometry')
+    return name, 'covering' in geo.get('columns', {}).get(name, {})
+
+
+def to_geoparquet(path: str, cache_dir: str = None) -> str:
+    """
+    convert a GeoJSON/GeoPackage/etc file to GeoParquet once and return the
+    cached copy on later calls
+
+    Args:
+        path (str): vector file readable by pyogrio
+        cache_dir (str): where converted files are kept, GEOPARQUET_CACHE_DIR when None
+
+    Returns:
+        str: GeoParquet path
+    """
+    if is_parquet(path):
+        return path
+    cache_dir = cache_dir or GEOPARQUET_CACHE_DIR
+    out_path = geoparquet_cache_path(path, cache_dir)
+    if not os.path.exists(out_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        write_polygons(gpd.read_file(path, engine='pyogrio'), out_path)
+    return out_path
+
+
+def read_polygons(
+        path: str,
+        columns: List[str] = None,
+        bbox: Tuple[float, float, float, float] = None,
+        cache: bool = True,
+        cache_dir: str = None
+) -> gpd.GeoDataFrame:
+    """
+    read polygons decoding only the requested columns and the features that
+    intersect bbox.  Text formats are converted to GeoParquet on first use when
+    caching, after that only matching row groups are read
+
+    Args:
+        path (str): GeoParquet or any file readable by pyogrio
+        columns (List[str]): attribute columns to read, the geometry column is
+            always read whatever it is named.  None reads every column
+        bbox (Tuple[float, float, float, float]): (xmin, ymin, xmax, ymax) in the
+            file's crs
+        cache (bool): convert non parquet inputs to a cached GeoParquet copy
+        cache_dir (str): where converted files are kept, GEOPARQUET_CACHE_DIR when None
+
+    Returns:
+        gpd.GeoDataFrame: polygons in their original row order
+    """
+    if cache:
+        path = to_geoparquet(path, cache_dir)
+    if not is_parquet(path):
+        return gpd.read_file(path, engine='pyogrio', columns=columns, bbox=bbox)
+
+    geometry, covered = geoparquet_geometry(path)
+    if columns is not None:
+        columns = list(columns) + [geometry]
+    if bbox is None or covered:
+        # the bbox filter runs on the covering column, row groups outside it are never decoded
+        return gpd.read_parquet(path, columns=columns, bbox=bbox).sort_index()
+    # files written elsewhere may have no covering column, filter after reading
+    gdf = gpd.read_parquet(path, columns=columns)
+    xmin, ymin, xmax, ymax = bbox
+    return gdf.cx[xmin:xmax, ymin:ymax].sort_index()
@@ -24,7 +24,13 @@ def coords_to_poly(xmin, xmax, ymin, ymax, EPSG_val=4326) -> gpd.GeoDataFrame:
     bbox_poly_gdf = gpd.GeoDataFrame(d, crs='EPSG:4326')
     return bbox_poly_gdf
 
-gdf = gpd.read_file("/home/treuter/repos/geo_py/geo_py/Census_Block_Groups_in_2000.geojson")
+# only decode the two columns used below, geometry is never parsed
+gdf = gpd.read_file(
+    "/home/treuter/repos/geo_py/geo_py/Census_Block_Groups_in_2000.geojson",
+    engine='pyogrio',
+    columns=['SQMI', 'GIS_ID'],
+    read_geometry=False
+)
 areas = gdf['SQMI']
 sum = 0
 for x in areas:
@@ -0,0 +1,29 @@
+import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
+
+
+@pytest.fixture(autouse=True)
+def geoparquet_cache_dir(tmp_path, monkeypatch):
+    """
+    keeps converted GeoParquet files out of the real user cache
+    """
+    cache_dir = tmp_path / 'geoparquet_cache'
+    monkeypatch.setattr('e84_proj.vector_io.GEOPARQUET_CACHE_DIR', str(cache_dir))
+    return cache_dir
+
+
+@pytest.fixture
+def write_raster():
+    """
+    writes a single band GeoTIFF, by default on a 0.01 degree grid near the test AOI
+    """
+    def write(path, data, transform=None, crs='epsg:4326', nodata=None):
+        transform = transform or from_origin(16.0, 11.0, 0.01, 0.01)
+        with rio.open(
+            path, 'w', driver='GTiff', height=data.shape[0], width=data.shape[1], count=1,
+            dtype=data.dtype, crs=crs, transform=transform, nodata=nodata
+        ) as dst:
+            dst.write(data, 1)
+        return str(path)
+    return write
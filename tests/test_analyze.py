@@ -0,0 +1,248 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
+from rasterstats import zonal_stats
+from shapely.geometry import box
+import xarray as xr
+
+from e84_proj.analayze.analyze import CellAccumulator, E84Analyzer
+from e84_proj.analayze.expression import BandExpression
+from e84_proj.analayze.temporal import TemporalReducer
+from e84_proj.analyze import Analyzer
+
+
+def test_h3_binning_totals_match_pixels(tmp_path, write_raster):
+    rain = write_raster(tmp_path / 'rain.tif', np.full((6, 6), 2.0, dtype='float32'))
+    pop_data = np.ones((6, 6), dtype='float32')
+    pop_data[0, 0] = -1
+    pop = write_raster(tmp_path / 'pop.tif', pop_data, nodata=-1)
+
+    actual = E84Analyzer().h3Binning({'rain': rain, 'pop': pop}, resolution=6, weights='pop', block_size=4)
+
+    assert actual['rain_count'].sum() == 36
+    assert actual['rain_sum'].sum() == pytest.approx(72)
+    assert actual['pop_count'].sum() == 35
+    assert np.allclose(actual['rain_mean'], 2)
+    assert np.allclose(actual['rain_wmean'], 2)
+    assert actual['h3'].is_unique
+
+
+def test_h3_binning_rejects_unknown_weights(tmp_path, write_raster):
+    rain = write_raster(tmp_path / 'rain.tif', np.full((6, 6), 2.0, dtype='float32'))
+    with pytest.raises(ValueError, match='population'):
+        E84Analyzer().h3Binning({'rain': rain}, resolution=6, weights='population')
+
+
+def test_cell_accumulator_merges_blocks():
+    accumulator = CellAccumulator(merge_every=2)
+    for cells, values in (([3, 1, 3], [1, 2, 3]), ([1, 2], [4, 5]), ([3], [6])):
+        accumulator.add(np.array(cells, dtype=np.uint64), {'sum': np.array(values, dtype='float64')})
+
+    assert accumulator.cells.tolist() == [1, 2, 3]
+    assert accumulator.columns['sum'].tolist() == [6, 5, 10]
+
+
+CENSUS_PATH = os.path.join(os.path.dirname(__file__), '..', 'geo_py', 'Census_Block_Groups_in_2000.geojson')
+
+
+def test_spatial_statistics_matches_rasterstats(tmp_path, write_raster):
+    zones = gpd.read_file(CENSUS_PATH)
+    xmin, ymin, xmax, ymax = zones.total_bounds
+    res = 0.001
+    width = int(np.ceil((xmax - xmin) / res))
+    height = int(np.ceil((ymax - ymin) / res))
+    data = np.random.default_rng(0).random((height, width)).astype('float32')
+    raster = write_raster(tmp_path / 'values.tif', data, transform=from_origin(xmin, ymax, res, res))
+
+    actual = Analyzer([(0, 0)]).spatial_statistics(CENSUS_PATH, raster, block_size=64)
+    expected = zonal_stats(CENSUS_PATH, raster, stats=['count', 'mean', 'min', 'max'])
+
+    assert len(actual) == len(zones)
+    for (_, row), stats in zip(actual.iterrows(), expected):
+        assert row['count'] == stats['count']
+        if stats['count']:
+            assert row['mean'] == pytest.approx(stats['mean'], rel=1e-5)
+            assert row['min'] == pytest.approx(stats['min'], rel=1e-5)
+            assert row['max'] == pytest.approx(stats['max'], rel=1e-5)
+
+
+def test_spatial_statistics_covers_zones_off_pixel_edges(tmp_path, write_raster):
+    data = np.random.default_rng(0).random((100, 100)).astype('float32')
+    raster = write_raster(tmp_path / 'values.tif', data, transform=from_origin(0, 100, 1, 1))
+    zones_path = str(tmp_path / 'zones.gpkg')
+    gpd.GeoDataFrame({'name': ['a']}, geometry=[box(10.7, 80.1, 19.9, 89.2)], crs='epsg:4326').to_file(zones_path)
+
+    actual = Analyzer([(0, 0)]).spatial_statistics(zones_path, raster)
+    expected = zonal_stats(zones_path, raster, stats=['count', 'mean'])[0]
+
+    assert actual['count'][0] == expected['count'] == 81
+    assert actual['mean'][0] == pytest.approx(expected['mean'], rel=1e-5)
+
+
+def test_spatial_statistics_std_is_stable_and_misses_are_nan(tmp_path, write_raster):
+    data = 1e8 + np.random.default_rng(0).random((20, 20))
+    raster = write_raster(tmp_path / 'values.tif', data, transform=from_origin(0, 20, 1, 1))
+    zones = gpd.GeoDataFrame(
+        {'count': [7, 8]}, geometry=[box(0, 0, 20, 20), box(50, 50, 60, 60)], crs='epsg:4326'
+    )
+    zones.to_file(tmp_path / 'zones.gpkg')
+
+    with pytest.raises(ValueError, match='count'):
+        Analyzer([(0, 0)]).spatial_statistics(str(tmp_path / 'zones.gpkg'), raster)
+    actual = Analyzer([(0, 0)]).spatial_statistics(str(tmp_path / 'zones.gpkg'), raster, block_size=7, prefix='v_')
+
+    assert actual['count'].tolist() == [7, 8]
+    assert actual['v_count'].tolist() == [400, 0]
+    assert actual['v_std'][0] == pytest.approx(data.std(), rel=1e-6)
+    assert np.isnan(actual.loc[1, ['v_mean', 'v_min', 'v_max', 'v_std']].astype(float)).all()
+    only_outside = Analyzer([(0, 0)]).spatial_statistics(str(tmp_path / 'zones.gpkg'), raster, bbox=(49, 49, 61, 61), prefix='v_')
+    assert only_outside['v_count'].tolist() == [0]
+
+
+def test_difference_streams_windows_without_overflow(tmp_path, write_raster):
+    start_data = np.full((40, 40), 250, dtype='uint8')
+    start_data[0, 0] = 0
+    end_data = np.full((40, 40), 10, dtype='uint8')
+    start = write_raster(tmp_path / 'start.tif', start_data, nodata=0)
+    end = write_raster(tmp_path / 'end.tif', end_data, nodata=0)
+
+    out = Analyzer([(0, 0)]).difference(start, end, str(tmp_path / 'diff.tif'), block_size=16, max_workers=2)
+
+    with rio.open(out) as src:
+        actual = src.read(1, masked=True)
+        assert src.dtypes[0] == 'int32'
+        assert src.profile['tiled']
+    assert actual.mask[0, 0]
+    assert (actual[1:, 1:] == -240).all()
+
+
+def test_evaluate_fuses_expression_with_nodata(tmp_path, write_raster):
+    a = write_raster(tmp_path / 'a.tif', np.full((20, 20), 5, dtype='uint8'))
+    b_data = np.full((20, 20), 2, dtype='uint8')
+    b_data[3, 3] = 255
+    b = write_raster(tmp_path / 'b.tif', b_data, nodata=255)
+    lulc_data = np.zeros((20, 20), dtype='uint8')
+    lulc_data[:10] = 2
+    lulc = write_raster(tmp_path / 'lulc.tif', lulc_data)
+
+    out = Analyzer([(0, 0)]).evaluate(
+        '(b - a) * (lulc == 2)', {'a': a, 'b': b, 'lulc': lulc}, str(tmp_path / 'out.tif'), block_size=16
+    )
+
+    with rio.open(out) as src:
+        actual = src.read(1, masked=True)
+    assert actual.mask[3, 3]
+    assert actual[0, 0] == -3
+    assert actual[15, 15] == 0
+
+
+def test_evaluate_keeps_float_inputs_for_integer_output(tmp_path, write_raster):
+    a = write_raster(tmp_path / 'a.tif', np.full((16, 16), 0.4, dtype='float32'))
+    b = write_raster(tmp_path / 'b.tif', np.full((16, 16), 0.4, dtype='float32'))
+
+    out = Analyzer([(0, 0)]).evaluate('(a + b) * 10', {'a': a, 'b': b}, str(tmp_path / 'out.tif'), dtype='int16')
+
+    with rio.open(out) as src:
+        # casting the inputs to int16 first would give 0
+        assert src.read(1)[0, 0] == 8
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        pytest.param('__import__("os")', id='builtin call'),
+        pytest.param('a.real', id='attribute access'),
+        pytest.param('c + 1', id='unknown input'),
+    ]
+)
+def test_band_expression_rejects_unsafe_input(expression):
+    with pytest.raises(ValueError):
+        BandExpression(expression, ['a', 'b'])
+
+
+@pytest.mark.parametrize(
+    "data,kwargs,expected",
+    [
+        pytest.param(
+            np.array([[0, 1, 2], [3, 2, 9]], dtype='uint8'),
+            {},
+            np.array([[0, 0, 1], [0, 1, 0]], dtype='uint8'),
+            id='default lulc mapping'
+        ),
+        pytest.param(
+            np.array([[-5, 2], [300, 7]], dtype='int16'),
+            {'mapping': {-5: 3, 7: 4}},
+            np.array([[3, 0], [0, 4]], dtype='uint8'),
+            id='signed lookup table'
+        ),
+        pytest.param(
+            np.array([[0.5, 10.0], [25.0, np.nan]], dtype='float32'),
+            {'bins': [5, 20], 'classes': [1, 2, 3]},
+            np.array([[1, 2], [3, 0]], dtype='uint8'),
+            id='ranges with nan'
+        ),
+        pytest.param(
+            np.array([[100000, 2]], dtype='int32'),
+            {'mapping': {2: 1}, 'as_mask': True},
+            np.array([[False, True]]),
+            id='searchsorted fallback as mask'
+        ),
+    ]
+)
+def test_reclassify(data, kwargs, expected):
+    actual = Analyzer([(0, 0)]).reclassify(xr.DataArray(data, dims=('y', 'x')), **kwargs)
+    assert actual.dtype == expected.dtype
+    np.testing.assert_array_equal(actual.values, expected)
+
+
+def test_reclassify_dask_is_lazy():
+    data = xr.DataArray(np.array([[0, 2], [2, 5]], dtype='uint8'), dims=('y', 'x')).chunk({'y': 1})
+    actual = Analyzer([(0, 0)]).reclassify(data)
+    assert actual.chunks is not None
+    np.testing.assert_array_equal(actual.compute().values, [[0, 1], [1, 0]])
+
+
+def _monthly_stack(years, trend_per_year=0.0):
+    time = pd.date_range('2001-01-01', periods=12 * years, freq='MS')
+    seasonal = np.tile(np.arange(12, dtype='float64'), years)
+    elapsed = (time - time[0]) / np.timedelta64(1, 'D') / 365.25
+    values = seasonal + trend_per_year * np.asarray(elapsed)
+    data = np.broadcast_to(values[:, None, None], (len(time), 4, 5)).astype('float32').copy()
+    data[:, 0, 0] = np.nan
+    return xr.DataArray(data, dims=('time', 'y', 'x'), coords={'time': time})
+
+
+def test_temporal_reductions_stay_lazy_and_match_numpy():
+    stack = _monthly_stack(years=3)
+    reducer = TemporalReducer(stack, spatial_chunk=2, time_chunk=5, max_chunk_bytes=36 * 4 * 4)
+
+    total = reducer.sum()
+    percentiles = reducer.percentile([10, 90])
+    assert total.chunks is not None and percentiles.chunks is not None
+
+    assert np.isnan(total[0, 0])
+    assert np.allclose(total[1:, 1:], np.nansum(stack.values, axis=0)[1:, 1:])
+    assert np.allclose(reducer.mean()[2, 2], 5.5)
+    assert np.allclose(percentiles[2, 2], np.percentile(stack.values[:, 2, 2], [10, 90]))
+
+
+def test_temporal_trend_and_anomaly():
+    stack = _monthly_stack(years=4, trend_per_year=2.0)
+    reducer = TemporalReducer(stack, spatial_chunk=2)
+
+    climatology = reducer.climatology(baseline=('2001', '2002'))
+    anomaly = reducer.anomaly(climatology=climatology)
+    # one step a year, every january, has no seasonal cycle to fit around
+    slope, _ = TemporalReducer(stack.isel(time=slice(0, None, 12))).trend()
+
+    assert climatology.sizes['month'] == 12
+    assert anomaly.sizes['time'] == 48
+    # with the seasonal cycle removed the anomaly only grows with the trend
+    assert float(anomaly.isel(time=-1, y=1, x=1)) > float(anomaly.isel(time=0, y=1, x=1))
+    assert np.allclose(slope[1, 1], 2.0)
+    assert np.isnan(slope[0, 0])
@@ -0,0 +1,70 @@
+from unittest import mock
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import MultiPolygon, Polygon
+
+from e84_proj.batch import BatchRunner, ResultTable, read_aois
+
+SQUARE = [(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]
+
+
+def test_result_table_checkpoints(tmp_path):
+    table = ResultTable(str(tmp_path / 'results.csv'))
+    assert table.done() == set()
+
+    table.append({'aoi_id': 'a', 'population': 1.0})
+    table.append({'aoi_id': 'b', 'population': 2.0})
+    with open(table.path, 'a') as f:
+        f.write('c,3.5')
+
+    assert table.done() == {'a', 'b'}
+    # the cut off row is dropped before the next one is written
+    table.append({'aoi_id': 'd', 'population': 4.0})
+    with open(table.path, 'a') as f:
+        f.write('e,oops\n')
+    assert table.done() == {'a', 'b', 'd'}
+    with open(table.path) as f:
+        assert f.read().splitlines()[-2] == 'd,4.0'
+
+
+def test_read_aois(tmp_path):
+    path = str(tmp_path / 'aois.geojson')
+    single = MultiPolygon([Polygon([(x + 2, y) for x, y in SQUARE])])
+    gpd.GeoDataFrame({'name': ['one', 'two']}, geometry=[Polygon(SQUARE), single], crs='epsg:4326').to_file(path)
+
+    aois = read_aois(path, 'name')
+
+    assert [aoi_id for aoi_id, _ in aois] == ['one', 'two']
+    assert Polygon(aois[1][1]).bounds == (2, 0, 3, 1)
+
+
+@pytest.mark.parametrize(
+    "geometry",
+    [
+        pytest.param(MultiPolygon([Polygon(SQUARE), Polygon([(x + 2, y) for x, y in SQUARE])]), id='multi part'),
+        pytest.param(Polygon(SQUARE, [[(0.2, 0.2), (0.2, 0.8), (0.8, 0.8), (0.8, 0.2)]]), id='hole'),
+    ]
+)
+def test_read_aois_rejects_shapes_it_would_change(tmp_path, geometry):
+    path = str(tmp_path / 'aois.geojson')
+    gpd.GeoDataFrame({'name': ['one', 'two']}, geometry=[Polygon(SQUARE), geometry], crs='epsg:4326').to_file(path)
+
+    with pytest.raises(ValueError, match='two'):
+        read_aois(path, 'name')
+
+
+def test_batch_runner_skips_done_aois(tmp_path):
+    extractor = mock.MagicMock(mode='download')
+    runner = BatchRunner(
+        {'worldpop': ('http://pop.tif', None)}, extractor, str(tmp_path / 'results.csv'),
+        geoparquet_path=str(tmp_path / 'results.parquet')
+    )
+    runner.table.append({'aoi_id': 'a', 'population': 1.0})
+
+    assert runner.run([('a', SQUARE)]) == []
+    extractor.fetch_asset.assert_not_called()
+    results = gpd.read_parquet(tmp_path / 'results.parquet')
+    assert list(results['aoi_id']) == ['a']
+    assert results['population'].tolist() == [1.0]
+    assert results.geometry[0].equals(Polygon(SQUARE))
@@ -1,10 +1,15 @@
+from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock
 from unittest import mock
+import threading
+import time
 
 import pytest
 from shapely.geometry import Polygon
 
-from e84_proj.extract.stac_client.client import StacClient
+from e84_proj.extract.stac_client.cache import SearchCache
+from e84_proj.extract.stac_client.client import StacClient, clear_client_cache
+from e84_proj.extract.stac_client.footprints import FootprintStore
 
 @pytest.mark.parametrize(
     "catalog_endpoint,collection", 
@@ -18,6 +23,166 @@ from e84_proj.extract.stac_client.client import StacClient
 )
 @mock.patch('pystac_client.Client.open')
 def test_connection_factory(mock_open, catalog_endpoint, collection):
+    clear_client_cache()
     client = StacClient(catalog_endpoint=catalog_endpoint, collection=collection)
     actual = client.connection_factory()
-    mock_open.assert_called_once()
\ No newline at end of file
+    mock_open.assert_called_once()
+
+
+@mock.patch('pystac_client.Client.open')
+def test_connection_factory_memoizes_per_endpoint(mock_open):
+    clear_client_cache()
+    first = StacClient('fake_endpoint', 'collection_a').connection_factory()
+    second = StacClient('fake_endpoint', 'collection_b').connection_factory()
+    mock_open.assert_called_once()
+    assert first is second
+
+
+AOI = Polygon([(15.57692, 11.28722), (16.69969, 11.29509), (16.79151, 10.03066), (15.57692, 11.28722)])
+
+
+def test_aoi_search_uses_search_cache(tmp_path):
+    cache = SearchCache(str(tmp_path / 'searches.sqlite'))
+    client = StacClient('fake_endpoint', 'fake_collection', search_cache=cache)
+    catalog = MagicMock()
+    catalog.search.return_value.items.return_value = [_item(AOI, 's3://bucket/item.tif')]
+
+    first = client.aoi_search(catalog, AOI, '2022-06-15')
+    second = client.aoi_search(catalog, AOI, '2022-06-15')
+
+    assert first == second == ['s3://bucket/item.tif']
+    catalog.search.assert_called_once()
+
+
+def test_aoi_search_serves_stale_while_revalidating(tmp_path):
+    cache = SearchCache(str(tmp_path / 'searches.sqlite'), ttl=0, stale_while_revalidate=True)
+    options = {'max_items': None, 'asset_keys': None, 'media_type': None}
+    key = cache.key('fake_endpoint', 'fake_collection', AOI, '2022-06-15', options)
+    cache.set(key, ['s3://bucket/old.tif'])
+    client = StacClient('fake_endpoint', 'fake_collection', search_cache=cache)
+    release = threading.Event()
+    client._revalidate = MagicMock(side_effect=lambda *args: release.wait(5))
+    catalog = MagicMock()
+
+    with patch('e84_proj.extract.stac_client.client.threading.Thread', wraps=threading.Thread) as thread:
+        first = client.aoi_search(catalog, AOI, '2022-06-15')
+        second = client.aoi_search(catalog, AOI, '2022-06-15')
+    release.set()
+
+    assert first == second == ['s3://bucket/old.tif']
+    # the second stale read finds the refresh in flight and does not start another
+    assert thread.call_count == 1
+    # the key is released once the refresh finishes
+    for _ in range(500):
+        if cache.begin_revalidation(key):
+            break
+        time.sleep(0.01)
+    else:
+        pytest.fail('revalidation never finished')
+    cache.end_revalidation(key)
+    client._revalidate.assert_called_once_with(catalog, AOI, '2022-06-15', options, key)
+    catalog.search.assert_not_called()
+
+
+def _item(geometry, href):
+    item = MagicMock()
+    item.geometry = geometry.__geo_interface__
+    item.assets = {'data': MagicMock(href=href)}
+    return item
+
+
+def test_batch_search_groups_aois_and_matches_items_locally():
+    west = Polygon([(0, 0), (1, 0), (1, 1), (0, 0)])
+    east = Polygon([(2, 0), (3, 0), (3, 1), (2, 0)])
+    far = Polygon([(40, 40), (41, 40), (41, 41), (40, 40)])
+    catalog = MagicMock()
+    catalog.search.return_value.items.return_value = [
+        _item(Polygon([(0, 0), (1.5, 0), (1.5, 1.5), (0, 1.5)]), 's3://bucket/west.tif'),
+        _item(Polygon([(1.5, 0), (3.5, 0), (3.5, 1.5), (1.5, 1.5)]), 's3://bucket/east.tif'),
+    ]
+    client = StacClient('fake_endpoint', 'fake_collection')
+
+    actual = client.batch_search(catalog, [west, east, far], ['2022-06-15', '2023-06-15'])
+
+    # two tiles x two dates, not three AOIs x two dates
+    assert catalog.search.call_count == 4
+    assert actual[(0, '2022-06-15')] == ['s3://bucket/west.tif']
+    assert actual[(1, '2023-06-15')] == ['s3://bucket/east.tif']
+
+
+
+def test_iter_hrefs_stops_paging_at_max_items():
+    pages_read = []
+
+    def items():
+        for i in range(100):
+            pages_read.append(i)
+            yield _item(AOI, f's3://bucket/{i}.tif')
+
+    search = MagicMock()
+    search.items.return_value = items()
+    client = StacClient('fake_endpoint', 'fake_collection')
+
+    actual = list(client.iter_hrefs(search, max_items=2, asset_keys=['data']))
+
+    assert actual == ['s3://bucket/0.tif', 's3://bucket/1.tif']
+    assert len(pages_read) == 2
+
+
+def _item_dict(item_id, geometry, datetime, href):
+    return {
+        'id': item_id,
+        'geometry': geometry.__geo_interface__,
+        'properties': {'datetime': datetime},
+        'assets': {'data': {'href': href, 'type': 'image/tiff'}},
+    }
+
+
+def test_aoi_search_answers_from_synced_footprints(tmp_path):
+    store = FootprintStore(str(tmp_path / 'footprints.sqlite'))
+    client = StacClient('fake_endpoint', 'fake_collection', footprints=store)
+    far = Polygon([(40, 40), (41, 40), (41, 41), (40, 40)])
+    catalog = MagicMock()
+    catalog.search.return_value.items_as_dicts.return_value = [
+        _item_dict('june', AOI, '2022-06-15T00:00:00Z', 's3://bucket/june.tif'),
+        _item_dict('july', AOI, '2022-07-15T00:00:00Z', 's3://bucket/july.tif'),
+        _item_dict('far', far, '2022-06-15T00:00:00Z', 's3://bucket/far.tif'),
+    ]
+
+    with patch.object(client, 'connection_factory', return_value=catalog):
+        assert client.sync_footprints() == 3
+        client.sync_footprints()
+
+    # the second sync only asks for items from the latest stored datetime on
+    assert catalog.search.call_args.kwargs['datetime'].startswith('2022-07-15T00:00:00')
+    assert client.aoi_search(catalog, AOI, '2022-06-15') == ['s3://bucket/june.tif']
+    assert client.aoi_search(catalog, AOI, '2022-06') == ['s3://bucket/june.tif']
+    assert client.aoi_search(catalog, AOI, '2022-06-01/..') == ['s3://bucket/june.tif', 's3://bucket/july.tif']
+    assert catalog.search.call_count == 2
+
+
+def test_time_series_groups_and_dedupes_items_per_step():
+    def dated(geometry, href, when):
+        item = _item(geometry, href)
+        item.datetime = datetime(*when, tzinfo=timezone.utc)
+        return item
+
+    west = Polygon([(15, 10), (16.2, 10), (16.2, 12), (15, 12)])
+    east = Polygon([(16.2, 10), (17, 10), (17, 12), (16.2, 12)])
+    catalog = MagicMock()
+    catalog.search.return_value.items.return_value = [
+        dated(west, 's3://bucket/2022-07-west.tif', (2022, 7, 1)),
+        dated(west, 's3://bucket/2022-06-west.tif', (2022, 6, 1)),
+        dated(east, 's3://bucket/2022-06-east.tif', (2022, 6, 1)),
+        # reprocessed copy of a step that is already covered
+        dated(west, 's3://bucket/2022-06-west-v2.tif', (2022, 6, 2)),
+    ]
+    client = StacClient('fake_endpoint', 'fake_collection')
+
+    actual = client.time_series(catalog, AOI, '2022-06/2022-07', step='month')
+
+    assert actual == [
+        ('2022-06', ['s3://bucket/2022-06-west.tif', 's3://bucket/2022-06-east.tif']),
+        ('2022-07', ['s3://bucket/2022-07-west.tif']),
+    ]
+    catalog.search.assert_called_once()
@@ -0,0 +1,169 @@
+from unittest.mock import MagicMock
+import os
+
+import numpy as np
+import pytest
+from rasterio.transform import from_origin
+
+from e84_proj.extract.cache import AssetCache
+from e84_proj.extract.cog import read_aoi_window, to_vsi_path
+from e84_proj.extract.downloader import (
+    PARTIAL_SUFFIX, DownloadEngine, DownloadJob, DownloadResult, split_s3_href
+)
+from e84_proj.extract.extraction import Extract
+
+LINKS = {
+    "chirps": {
+        "start": 's3://deafrica-input-datasets/rainfall_chirps_monthly/chirps-v2.0_2022.06.tif',
+        "end": 's3://deafrica-input-datasets/rainfall_chirps_monthly/chirps-v2.0_2023.06.tif'
+    },
+    "lulc": {
+        "start": 'https://example.com/lulc_2022.tif',
+        "end": 'https://example.com/lulc_2023.tif'
+    },
+    "worldpop": 'https://example.com/pop.tif'
+}
+
+
+@pytest.mark.parametrize(
+    "href,expected",
+    [
+        pytest.param(
+            's3://deafrica-input-datasets/rainfall_chirps_monthly/chirps-v2.0_2022.06.tif',
+            ('deafrica-input-datasets', 'rainfall_chirps_monthly/chirps-v2.0_2022.06.tif'),
+            id='bucket and nested key'
+        )
+    ]
+)
+def test_split_s3_href(href, expected):
+    assert split_s3_href(href) == expected
+
+
+def test_execute_downloads_runs_all_jobs_together(tmp_path):
+    engine = MagicMock()
+    engine.validators.return_value = ['"etag"'] * 5
+    engine.run.return_value = []
+    extractor = Extract([(0, 0)], path=str(tmp_path) + '/', engine=engine)
+    actual = extractor.execute_downloads(LINKS)
+
+    engine.run.assert_called_once()
+    jobs = engine.run.call_args[0][0]
+    assert len(jobs) == 5
+    assert len({job.file_path for job in jobs}) == 5
+    assert actual['chirps']['start'].startswith(str(tmp_path))
+    assert extractor.cache.stats['misses'] == 5
+
+
+def test_execute_downloads_reports_every_file(tmp_path, capsys):
+    engine = MagicMock()
+    engine.validators.return_value = ['"etag"'] * 5
+    engine.run.return_value = [
+        DownloadResult('https://example.com/a.tif', str(tmp_path / 'a.tif'), 2 * 1024 * 1024, 1.0),
+        DownloadResult('https://example.com/b.tif', str(tmp_path / 'b.tif'), 1024 * 1024, 4.0),
+    ]
+    Extract([(0, 0)], path=str(tmp_path) + '/', engine=engine).execute_downloads(LINKS)
+
+    out = capsys.readouterr().out
+    assert 'https://example.com/a.tif: 2.0 MB at 2.00 MB/s' in out
+    assert 'https://example.com/b.tif: 1.0 MB at 0.25 MB/s' in out
+
+
+def test_asset_cache_evicts_least_recently_used(tmp_path):
+    cache = AssetCache(str(tmp_path), max_bytes=10)
+    old = cache.path_for('https://example.com/old.tif', '"1"')
+    new = cache.path_for('https://example.com/new.tif', '"1"')
+    for path, mtime in ((old, 1), (new, 2)):
+        with open(path, 'wb') as f:
+            f.write(b'x' * 8)
+        os.utime(path, (mtime, mtime))
+
+    assert cache.evict() == 1
+    assert cache.get(old) is None
+    assert cache.get(new) == new
+    assert cache.stats['hits'] == 1
+
+
+def test_asset_cache_key_changes_with_validator(tmp_path):
+    cache = AssetCache(str(tmp_path))
+    href = 'https://example.com/lulc_2022.tif'
+    assert cache.path_for(href, '"1"') != cache.path_for(href, '"2"')
+
+
+@pytest.mark.parametrize(
+    "href,expected",
+    [
+        pytest.param(
+            's3://deafrica-input-datasets/rainfall_chirps_monthly/chirps-v2.0_2022.06.tif',
+            '/vsis3/deafrica-input-datasets/rainfall_chirps_monthly/chirps-v2.0_2022.06.tif',
+            id='s3 uri'
+        ),
+        pytest.param(
+            'https://example.com/lulc_2022.tif',
+            '/vsicurl/https://example.com/lulc_2022.tif',
+            id='http url'
+        ),
+        pytest.param('/tmp/local.tif', '/tmp/local.tif', id='local path'),
+    ]
+)
+def test_to_vsi_path(href, expected):
+    assert to_vsi_path(href) == expected
+
+
+@pytest.mark.parametrize(
+    "status,expected",
+    [
+        pytest.param(206, b'oldnew', id='validator matches, resume'),
+        pytest.param(200, b'new', id='object changed, start over'),
+    ]
+)
+def test_http_resume_sends_if_range(tmp_path, status, expected):
+    path = str(tmp_path / 'asset.tif')
+    with open(path + PARTIAL_SUFFIX, 'wb') as f:
+        f.write(b'old')
+    engine = DownloadEngine()
+    response = MagicMock(status=status, headers={'Content-Range': 'bytes 3-5/6'})
+    response.stream.return_value = [b'new']
+    engine._http = MagicMock()
+    engine._http.request.return_value = response
+
+    result = engine.fetch(DownloadJob('https://example.com/asset.tif', path, validator='"etag"'))
+
+    headers = engine._http.request.call_args.kwargs['headers']
+    assert headers == {'Range': 'bytes=3-', 'If-Range': '"etag"'}
+    with open(path, 'rb') as f:
+        assert f.read() == expected
+    assert result.resumed_from == (3 if status == 206 else 0)
+
+
+def test_read_aoi_window_rejects_aoi_outside_asset(tmp_path, write_raster):
+    path = write_raster(tmp_path / 'asset.tif', np.ones((10, 10), dtype='uint8'), transform=from_origin(0, 10, 1, 1))
+    far = [(50, 50), (51, 50), (51, 51), (50, 51), (50, 50)]
+
+    with pytest.raises(ValueError, match='does not intersect'):
+        read_aoi_window(path, far, str(tmp_path / 'window.tif'))
+    assert not os.path.exists(tmp_path / 'window.tif')
+
+
+def test_asset_cache_leaves_foreign_files_and_drops_abandoned_partials(tmp_path):
+    cache = AssetCache(str(tmp_path), max_bytes=0)
+    foreign = tmp_path / 'analysis_output.tif'
+    foreign.write_bytes(b'x' * 8)
+    cached = cache.path_for('https://example.com/a.tif', '"1"')
+    stale = cache.path_for('https://example.com/b.tif', '"1"') + PARTIAL_SUFFIX
+    fresh = cache.path_for('https://example.com/c.tif', '"1"') + PARTIAL_SUFFIX
+    for path in (cached, stale, fresh):
+        with open(path, 'wb') as f:
+            f.write(b'x' * 8)
+    os.utime(stale, (1, 1))
+
+    assert cache.evict() == 2
+    assert foreign.exists()
+    assert not os.path.exists(cached)
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+
+def test_extract_keeps_cache_in_its_own_folder(tmp_path):
+    extractor = Extract([(0, 0)], path=str(tmp_path), engine=MagicMock())
+    assert extractor.cache.root == os.path.join(str(tmp_path), 'asset_cache')
+    assert not os.path.exists(extractor.cache.root)
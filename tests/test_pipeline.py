@@ -0,0 +1,22 @@
+import pytest
+
+from e84_proj.pipeline import Pipeline
+
+
+def test_pipeline_runs_stages_with_deps():
+    pipeline = Pipeline(io_workers=2, cpu_workers=1)
+    pipeline.add('a', lambda: 1)
+    pipeline.add('b', lambda: 2)
+    pipeline.add('sum', lambda a, b: a + b, deps=['a', 'b'])
+
+    results = pipeline.run()
+
+    assert results == {'a': 1, 'b': 2, 'sum': 3}
+    assert set(pipeline.timings) == {'a', 'b', 'sum'}
+    assert 'sum' in pipeline.report()
+
+
+def test_pipeline_rejects_unknown_deps():
+    pipeline = Pipeline()
+    with pytest.raises(ValueError):
+        pipeline.add('b', lambda a: a, deps=['a'])
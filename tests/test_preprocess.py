@@ -0,0 +1,177 @@
+from unittest import mock
+import pickle
+
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.windows import from_bounds
+
+from e84_proj.preprocess.grid import TargetGrid
+from e84_proj.preprocess.overviews import build_external_overviews, select_overview_level
+from e84_proj.preprocess.preprocess import Preprocessor
+from e84_proj.preprocess.stack import load_stack, read_step
+
+COORDS = [(16.01, 10.99), (16.15, 10.99), (16.15, 10.85), (16.01, 10.85), (16.01, 10.99)]
+
+
+def test_process_is_lazy_until_written(tmp_path, write_raster):
+    path = write_raster(tmp_path / 'rain.tif', np.arange(400, dtype='float32').reshape(20, 20))
+    preprocessor = Preprocessor(COORDS, chunks={'band': 1, 'y': 8, 'x': 8})
+
+    lazy = preprocessor.process(path, 'epsg:32633', 500, Resampling.bilinear)
+    assert lazy.chunks is not None
+    assert lazy.rio.crs.to_epsg() == 32633
+
+    out = preprocessor.write_raster(lazy, str(tmp_path / 'out.tif'), scheduler='synchronous')
+    preprocessor.close()
+
+    with rio.open(out) as src:
+        assert src.crs.to_epsg() == 32633
+        assert src.res == pytest.approx((500, 500))
+        # the warp covers the AOI (about 15 x 15 km), not the 20 x 20 km raster
+        assert max(src.width, src.height) < 40
+
+
+def test_write_raster_rejects_process_scheduler(tmp_path, write_raster):
+    path = write_raster(tmp_path / 'rain.tif', np.ones((20, 20), dtype='float32'))
+    preprocessor = Preprocessor(COORDS)
+    with pytest.raises(ValueError, match='threads'):
+        preprocessor.write_raster(preprocessor.open_raster(path), str(tmp_path / 'out.tif'), scheduler='processes')
+    assert preprocessor.chunks is not Preprocessor(COORDS).chunks
+
+
+def test_merge_tiles_builds_cropped_virtual_mosaic(tmp_path, write_raster):
+    west = write_raster(tmp_path / 'west.tif', np.full((20, 10), 1, dtype='uint8'), nodata=0)
+    east = write_raster(
+        tmp_path / 'east.tif', np.full((20, 10), 2, dtype='uint8'),
+        transform=from_origin(16.1, 11.0, 0.01, 0.01), nodata=0
+    )
+    preprocessor = Preprocessor(COORDS)
+
+    out = preprocessor.merge_tiles([west, east], str(tmp_path / 'mosaic.vrt'))
+
+    with rio.open(out) as src:
+        data = src.read(1)
+        assert src.res == pytest.approx((0.01, 0.01))
+        assert src.bounds.left == pytest.approx(16.01)
+        assert src.bounds.top == pytest.approx(10.99)
+    assert data.shape == (14, 14)
+    assert set(np.unique(data)) == {1, 2}
+
+
+def test_warp_clips_reprojects_and_resamples_in_one_pass(tmp_path, write_raster):
+    path = write_raster(tmp_path / 'lulc.tif', np.full((20, 20), 2, dtype='uint8'), nodata=0)
+    preprocessor = Preprocessor(COORDS)
+
+    out = preprocessor.warp(path, str(tmp_path / 'lulc_utm.tif'), 1000, input_name='lulc')
+
+    with rio.open(out) as src:
+        data = src.read(1, masked=True)
+        assert src.crs.to_epsg() == 32633
+        assert src.res == (1000, 1000)
+        assert src.transform.c % 1000 == 0
+    assert set(np.unique(data.compressed())) == {2}
+
+
+def test_warp_marks_clipped_pixels_nodata_without_source_nodata(tmp_path, write_raster):
+    path = write_raster(tmp_path / 'lulc.tif', np.full((20, 20), 2, dtype='uint8'))
+    preprocessor = Preprocessor(COORDS)
+
+    out = preprocessor.warp(path, str(tmp_path / 'lulc_utm.tif'), 1000, input_name='lulc')
+
+    with rio.open(out) as src:
+        data = src.read(1, masked=True)
+        assert src.nodata == 0
+    # the grid corners fall outside the AOI polygon once it is projected to UTM
+    assert data.mask.any()
+    assert set(np.unique(data.compressed())) == {2}
+
+
+def test_target_grid_aligns_inputs_and_reuses_source_windows(tmp_path, write_raster):
+    start = write_raster(tmp_path / 'start.tif', np.full((20, 20), 1.0, dtype='float32'))
+    end = write_raster(tmp_path / 'end.tif', np.full((20, 20), 3.0, dtype='float32'))
+    lulc = write_raster(
+        tmp_path / 'lulc.tif', np.full((200, 200), 2, dtype='uint8'),
+        transform=from_origin(16.0, 11.0, 0.001, 0.001), nodata=0
+    )
+    grid = TargetGrid.from_coords(COORDS, resolution=1000)
+
+    with mock.patch('e84_proj.preprocess.grid.from_bounds', wraps=from_bounds) as windows:
+        arrays = grid.read_many({
+            'start': (start, Resampling.bilinear),
+            'end': (end, Resampling.bilinear),
+            'lulc': (lulc, Resampling.nearest),
+        })
+
+    assert {array.shape for array in arrays.values()} == {grid.shape}
+    # both chirps dates share one source grid, lulc has its own
+    assert windows.call_count == 2
+    change = (arrays['end'] - arrays['start']) * (arrays['lulc'] == 2)
+    assert np.allclose(change.compressed(), 2)
+
+
+def test_target_grid_masks_pixels_outside_a_source_without_nodata(tmp_path, write_raster):
+    # covers only the western half of the AOI, real zeros inside it stay valid
+    path = write_raster(tmp_path / 'lulc.tif', np.zeros((20, 8), dtype='uint8'))
+    grid = TargetGrid.from_coords(COORDS, resolution=1000)
+
+    array = grid.read(path, Resampling.nearest)
+
+    assert array.mask.any()
+    assert not array.mask.all()
+    assert set(np.unique(array.compressed())) == {0}
+
+
+def test_target_grid_keeps_source_windows_when_pickled(tmp_path, write_raster):
+    path = write_raster(tmp_path / 'rain.tif', np.full((20, 20), 1.0, dtype='float32'))
+    grid = TargetGrid.from_coords(COORDS, resolution=1000)
+    grid.read(path, Resampling.bilinear)
+
+    copy = pickle.loads(pickle.dumps(grid))
+    with mock.patch('e84_proj.preprocess.grid.from_bounds', wraps=from_bounds) as windows:
+        array = copy.read(path, Resampling.bilinear)
+    windows.assert_not_called()
+    assert array.shape == grid.shape
+
+
+def test_target_grid_reads_from_overviews(tmp_path, write_raster):
+    lulc = write_raster(
+        tmp_path / 'lulc.tif', np.full((400, 400), 2, dtype='uint8'),
+        transform=from_origin(16.0, 11.0, 0.0005, 0.0005), nodata=0
+    )
+    grid = TargetGrid.from_coords(COORDS, resolution=1000)
+
+    assert build_external_overviews(lulc, Resampling.mode)
+    assert not build_external_overviews(lulc, Resampling.mode)
+    with rio.open(lulc) as src:
+        level = select_overview_level(src, grid.source_resolution(lulc))
+    assert level is not None
+
+    with mock.patch('e84_proj.preprocess.grid.rio.open', wraps=rio.open) as opens:
+        array = grid.read(lulc, Resampling.nearest)
+    assert opens.call_count == 1
+    assert array.shape == grid.shape
+    assert set(np.unique(array.compressed())) == {2}
+
+
+def test_load_stack_is_lazy_and_aligned(tmp_path, write_raster):
+    steps = []
+    for i, month in enumerate(['2022-06', '2022-07', '2022-08']):
+        path = write_raster(tmp_path / f'{month}.tif', np.full((20, 20), i, dtype='float32'))
+        steps.append((month, [path]))
+    grid = TargetGrid.from_coords(COORDS, resolution=1000)
+
+    with mock.patch('e84_proj.preprocess.stack.read_step', wraps=read_step) as reads:
+        stack = load_stack(steps, grid, Resampling.bilinear)
+        assert stack.shape == (3,) + grid.shape
+        assert stack.chunks is not None
+        reads.assert_not_called()
+
+        means = stack.mean(dim=('y', 'x')).compute()
+
+    assert reads.call_count == 3
+    assert np.allclose(means, [0, 1, 2])
+    assert list(stack.time.dt.month) == [6, 7, 8]
+    assert stack.rio.crs == grid.crs
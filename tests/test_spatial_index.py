@@ -0,0 +1,42 @@
+from shapely.geometry import Point, box
+
+from e84_proj.spatial_index import SpatialIndex
+
+TILES = [(0, 0, 1, 1), (1, 0, 2, 1), (5, 5, 6, 6)]
+TILE_IDS = ['a', 'b', 'c']
+
+
+def test_bulk_query_matches_linear_scan():
+    index = SpatialIndex.from_bounds(TILES, TILE_IDS)
+    queries = [Point(0.5, 0.5), box(0.5, 0.2, 1.5, 0.4), Point(10, 10)]
+
+    expected = [
+        [tile_id for tile_id, tile in zip(TILE_IDS, TILES) if box(*tile).intersects(query)]
+        for query in queries
+    ]
+
+    assert [sorted(ids) for ids in index.matches(queries)] == expected
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'tiles.npz')
+    SpatialIndex.from_bounds(TILES, TILE_IDS).save(path)
+
+    loaded = SpatialIndex.load(path)
+
+    assert len(loaded) == 3
+    assert loaded.matches([Point(5.5, 5.5)]) == [['c']]
+
+
+def test_cached_builds_once(tmp_path):
+    path = str(tmp_path / 'tiles.npz')
+    calls = []
+
+    def build():
+        calls.append(1)
+        return SpatialIndex.from_bounds(TILES, TILE_IDS)
+
+    SpatialIndex.cached(path, build)
+    SpatialIndex.cached(path, build)
+
+    assert len(calls) == 1
@@ -1,4 +1,7 @@
-from e84_proj.extract.utils import coords_to_polygon
+from e84_proj.extract.utils import (
+    coords_to_polygon, generate_h3_grid, get_transformer, h3_cell_ids, iter_h3_grid, transform_geometries
+)
+import numpy as np
 import pytest
 from shapely.geometry import Polygon
 
@@ -46,4 +49,38 @@ from shapely.geometry import Polygon
 )
 def test_coords_to_polygon(coords, out_crs, expected):
     actual = coords_to_polygon(coords, out_crs)
-    assert actual == expected
\ No newline at end of file
+    assert actual == expected
+
+def test_get_transformer_is_cached():
+    get_transformer.cache_clear()
+    first = get_transformer('epsg:4326', 'epsg:3857')
+    second = get_transformer('epsg:4326', 'epsg:3857')
+    assert first is second
+    assert get_transformer.cache_info().hits == 1
+
+
+def test_transform_geometries_bulk_matches_single():
+    polys = np.array([
+        Polygon([(15.57692, 11.28722), (16.69969, 11.29509), (16.79151, 10.03066), (15.57692, 11.28722)]),
+        Polygon([(0, 0), (1, 0), (1, 1), (0, 0)]),
+    ])
+    actual = transform_geometries(polys, 'epsg:4326', 'epsg:3857')
+    for poly, projected in zip(polys, actual):
+        expected = coords_to_polygon(list(poly.exterior.coords), 'epsg:3857')
+        assert projected.equals_exact(expected, 1e-6)
+
+
+def test_generate_h3_grid_covers_aoi():
+    coords = [(15.57692, 11.28722), (16.69969, 11.29509), (16.79151, 10.03066), (15.42739, 10.03853), (15.57692, 11.28722)]
+    cells = h3_cell_ids(coords, 5)
+    gdf = generate_h3_grid(coords, 5)
+
+    assert cells.dtype == np.uint64
+    assert len(gdf) == len(cells)
+    assert gdf.geometry.is_valid.all()
+    # cell centroids fall inside the AOI, so the boundaries must be (lon, lat)
+    assert gdf.geometry.centroid.within(Polygon(coords).buffer(0.1)).all()
+    chunks = [chunk['h3'].to_numpy() for chunk in iter_h3_grid(coords, 5, chunk_size=7)]
+    # the tiled fill finds the same cells as filling the whole AOI
+    assert len(chunks) > 1
+    assert np.array_equal(np.sort(np.concatenate(chunks)), np.sort(cells))
@@ -0,0 +1,78 @@
+import os
+
+import geopandas as gpd
+from shapely.geometry import box
+
+from e84_proj.vector_io import read_polygons, to_geoparquet, write_polygons
+
+
+def write_boxes(path):
+    # out of spatial order so the hilbert sort has to be undone on read
+    xs = [5, 0, 9, 2, 7]
+    gdf = gpd.GeoDataFrame(
+        {'GIS_ID': [f'id{x}' for x in xs], 'SQMI': [float(x) for x in xs], 'NAME': ['x'] * len(xs)},
+        geometry=[box(x, 0, x + 0.5, 0.5) for x in xs],
+        crs='epsg:4326'
+    )
+    gdf.to_file(path)
+    return gdf
+
+
+def test_read_polygons_projects_columns_and_keeps_order(tmp_path):
+    path = str(tmp_path / 'boxes.geojson')
+    expected = write_boxes(path)
+
+    actual = read_polygons(path, columns=['GIS_ID'], cache_dir=str(tmp_path / 'cache'))
+
+    assert list(actual.columns) == ['GIS_ID', 'geometry']
+    assert list(actual['GIS_ID']) == list(expected['GIS_ID'])
+
+
+def test_read_polygons_bbox_filter(tmp_path):
+    path = str(tmp_path / 'boxes.geojson')
+    write_boxes(path)
+
+    actual = read_polygons(path, columns=['SQMI'], bbox=(1.5, 0, 7.2, 1), cache_dir=str(tmp_path / 'cache'))
+
+    assert sorted(actual['SQMI']) == [2.0, 5.0, 7.0]
+
+
+def test_geoparquet_conversion_is_cached(tmp_path):
+    path = str(tmp_path / 'boxes.geojson')
+    write_boxes(path)
+    cache_dir = str(tmp_path / 'cache')
+
+    first = to_geoparquet(path, cache_dir)
+    mtime = os.path.getmtime(first)
+
+    assert to_geoparquet(path, cache_dir) == first
+    assert os.path.getmtime(first) == mtime
+
+
+def test_read_polygons_without_covering_or_default_geometry_name(tmp_path):
+    path = str(tmp_path / 'plain.parquet')
+    gdf = write_boxes(str(tmp_path / 'boxes.geojson')).rename_geometry('geom')
+    gdf.to_parquet(path)
+
+    actual = read_polygons(path, columns=['SQMI'], bbox=(1.5, 0, 7.2, 1))
+
+    assert list(actual.columns) == ['SQMI', 'geom']
+    assert sorted(actual['SQMI']) == [2.0, 5.0, 7.0]
+
+
+def test_write_polygons_leaves_no_temp_files(tmp_path):
+    gdf = write_boxes(str(tmp_path / 'boxes.geojson'))
+
+    write_polygons(gdf, str(tmp_path / 'boxes.parquet'))
+
+    assert sorted(os.listdir(tmp_path)) == ['boxes.geojson', 'boxes.parquet']
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(tmp_path / 'boxes.parquet').st_mode & 0o777 == 0o666 & ~umask
+
+
+def test_default_cache_dir_is_resolved_per_call(tmp_path, geoparquet_cache_dir):
+    path = str(tmp_path / 'boxes.geojson')
+    write_boxes(path)
+
+    assert os.path.dirname(to_geoparquet(path)) == str(geoparquet_cache_dir)